@@ -9,7 +9,26 @@ from flask import Flask, redirect, url_for, request, send_from_directory
 from flask_login import LoginManager
 from flask_cors import CORS
 from models.user import User
+# 匯入模型以註冊本地副本的資料表，init_db 的 create_all 才會建立它們
+from models.defect import Defect, DefectDailyRollup, SyncState  # noqa: F401
 from config.database import init_db
+from utils.api import init_api_client
+from utils.async_api import init_async_api_client
+from utils.breaker import init_upstream_guard
+from utils.cache import init_response_cache
+from utils.identity import init_identity_cache, load_user_by_id
+from utils.image_cache import init_image_cache
+from utils.thumbnails import init_thumbnails
+from utils.prefetch import init_image_prefetch
+from utils.singleflight import init_single_flight
+from utils.locations import init_location_index
+from utils.passwords import init_passwords
+from utils.map_data import init_map_data
+from utils.replica import init_replica
+from utils.defect_store import init_defect_store
+from utils.tiles import init_tiles
+from utils.export import init_export
+from utils.server import get_server_config, run_production
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 # 應用版本
@@ -56,22 +75,66 @@ def create_app(config):
             "methods": cors_methods,
             "allow_headers": cors_headers + ["X-Script-Name", "Authorization"],
             "supports_credentials": True,
-            "expose_headers": ["Content-Type", "X-Total-Count"]
+            "expose_headers": ["Content-Type", "X-Total-Count", "X-Data-Age"]
         }
     })
 
     # 初始化資料庫
     init_db(app)
 
+    # 初始化瑕疵 API 客戶端（每個 worker 共用一個連線池）
+    init_api_client(app)
+    init_async_api_client(app)
+
+    # 初始化上游 API 響應快取
+    init_response_cache(app)
+
+    # 合併同時進行的相同上游請求
+    init_single_flight(app)
+
+    # 上游斷路器與自適應並行上限
+    init_upstream_guard(app)
+
+    # 瑕疵圖片磁碟快取與縮圖
+    init_image_cache(app)
+    init_thumbnails(app)
+
+    # 地理位置索引（背景定期更新）
+    init_location_index(app)
+
+    # 地圖聚合結果快取
+    init_map_data(app)
+
+    # 瑕疵資料本地副本（背景增量同步）
+    init_replica(app)
+
+    # 瑕疵資料欄式記憶體儲存
+    init_defect_store(app)
+
+    # 瑕疵圖層圖磚快取（啟用欄式儲存時背景預先產生）
+    init_tiles(app)
+
+    # 瑕疵資料背景匯出
+    init_export(app)
+
+    # 新瑕疵圖片預先下載（背景定期執行）
+    init_image_prefetch(app)
+
     # 初始化 LoginManager
     login_manager = LoginManager()
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
     login_manager.login_message = '請先登入系統'
 
+    # 密碼雜湊執行緒池與最後登入時間批次寫入
+    init_passwords(app)
+
+    # 登入使用者快取（每個 worker 各自保留，使用者更新時失效）
+    init_identity_cache(app)
+
     @login_manager.user_loader
     def load_user(user_id):
-        return User.query.get(int(user_id))
+        return load_user_by_id(user_id)
     
     # 禁用 Flask-Assets
     assets_enabled = False
@@ -127,6 +190,9 @@ if __name__ == '__main__':
     parser.add_argument('--port', type=int, default=5000, help='服務端口')
     parser.add_argument('--debug', action='store_true', help='啟用調試模式')
     parser.add_argument('--ssl', action='store_true', help='啟用 HTTPS')
+    parser.add_argument('--asgi', action='store_true', help='以 ASGI 伺服器（uvicorn）執行')
+    parser.add_argument('--prod', action='store_true', help='以正式環境多 worker 模式（gunicorn）執行')
+    parser.add_argument('--workers', type=int, default=0, help='worker 數，預設依 server 設定或 CPU 核心數')
     args = parser.parse_args()
 
     # SSL 配置
@@ -153,16 +219,34 @@ if __name__ == '__main__':
     print(f"端口: {args.port}")
     print(f"調試模式: {'啟用' if args.debug else '停用'}")
     print(f"HTTPS: {'啟用' if args.ssl else '停用'}")
+    print(f"ASGI: {'啟用' if args.asgi else '停用'}")
+    if args.prod:
+        print(f"Worker 數: {args.workers or get_server_config(current_config)['workers']}")
     if args.ssl:
         print(f"證書路徑: {cert_file}")
     api_base_url = current_config.get('road_defect_api', {}).get('base_url', 'http://127.0.0.1:5002/api/v1')
     print(f"瑕疵 API: {api_base_url}")
     print("=====================\n")
 
-    # 啟動應用程式
-    app.run(
-        host=args.host,
-        port=args.port,
-        debug=args.debug or current_config['flask']['debug'],
-        ssl_context=ssl_context
-    )
+    if args.prod:
+        # 預先載入應用程式後 fork 多個 worker（設定見 config.json 的 server 區段）
+        run_production(app, args.host, args.port, workers=args.workers, ssl_context=ssl_context)
+    elif args.asgi:
+        # 以 ASGI 伺服器啟動（入口見 asgi.py）
+        import uvicorn
+        uvicorn.run(
+            'asgi:asgi_app',
+            host=args.host,
+            port=args.port,
+            reload=args.debug,
+            ssl_certfile=ssl_context[0] if ssl_context else None,
+            ssl_keyfile=ssl_context[1] if ssl_context else None
+        )
+    else:
+        # 啟動應用程式
+        app.run(
+            host=args.host,
+            port=args.port,
+            debug=args.debug or current_config['flask']['debug'],
+            ssl_context=ssl_context
+        )
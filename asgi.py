@@ -0,0 +1,30 @@
+"""
+ASGI 入口
+
+以 ASGI 伺服器執行，例如：
+
+    uvicorn asgi:asgi_app --host 0.0.0.0 --port 5000 --limit-concurrency 64
+
+Flask 2.0 本身是 WSGI 應用程式，由 asgiref 的 WsgiToAsgi 轉接。每個請求在各自的
+ThreadSensitiveContext 中執行，同步視圖取得獨立的執行緒，而不是全部排隊在同一個執行緒上。
+
+限制：這不是原生的 ASGI 路徑。每個進行中的請求都佔用一個執行緒，
+非同步視圖也一樣：ensure_sync 以 AsyncToSync 將協程交給伺服器的事件迴圈，
+該執行緒在協程完成前一直阻塞等待。因此每個 worker 的並行請求數仍受執行緒數量限制，
+而不是由非同步 I/O 決定；非同步視圖省下的只是視圖內的上游子請求
+（並行送出、共用連線池，不再各佔一個執行緒）。--limit-concurrency 即為每個 worker
+同時存在的請求執行緒上限，應依記憶體與資料庫連線池大小設定，不宜設為數百。
+協程中只等待上游請求，資料庫查詢、聚合與模板渲染以 utils.async_api.run_sync
+交給執行緒池，不會阻塞事件迴圈上的其他協程。
+"""
+from asgiref.sync import ThreadSensitiveContext
+from asgiref.wsgi import WsgiToAsgi
+from app import app
+
+wsgi_adapter = WsgiToAsgi(app)
+
+
+async def asgi_app(scope, receive, send):
+    """ASGI 應用程式"""
+    async with ThreadSensitiveContext():
+        await wsgi_adapter(scope, receive, send)
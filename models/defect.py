@@ -0,0 +1,167 @@
+"""
+瑕疵資料本地副本模型定義
+"""
+import json
+from datetime import datetime, timezone
+from config.database import db
+from utils.timeutil import parse_time
+
+
+class Defect(db.Model):
+    """上游瑕疵記錄的本地副本"""
+    __tablename__ = 'defects'
+    __table_args__ = (
+        db.Index('ix_defects_location', 'city', 'district', 'road_section'),
+        db.Index('ix_defects_type_severity', 'defect_type', 'severity'),
+    )
+
+    # 使用上游的瑕疵 ID 作為主鍵
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+
+    # 分類
+    defect_type = db.Column(db.Integer, nullable=True, index=True)
+    severity = db.Column(db.Integer, nullable=True, index=True)
+
+    # 位置
+    city = db.Column(db.String(50), nullable=True, index=True)
+    district = db.Column(db.String(50), nullable=True, index=True)
+    road_section = db.Column(db.String(100), nullable=True, index=True)
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+
+    # 時間戳記（UTC）
+    capture_time = db.Column(db.DateTime, nullable=True, index=True)
+    synced_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    # 上游原始記錄（JSON），確保回傳格式與上游一致
+    raw = db.Column(db.Text, nullable=False)
+
+    @staticmethod
+    def _enum_value(value):
+        """取得 {'value': ..., 'name': ...} 格式欄位的數值"""
+        if isinstance(value, dict):
+            value = value.get('value')
+        try:
+            return int(value) if value is not None else None
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def _float(value):
+        try:
+            return float(value) if value is not None else None
+        except (TypeError, ValueError):
+            return None
+
+    def update_from_record(self, record: dict):
+        """以上游記錄更新欄位
+
+        Args:
+            record: 上游瑕疵記錄
+        """
+        self.defect_type = self._enum_value(record.get('defect_type'))
+        self.severity = self._enum_value(record.get('severity'))
+        self.city = record.get('city')
+        self.district = record.get('district')
+        self.road_section = record.get('road_section')
+        self.latitude = self._float(record.get('latitude'))
+        self.longitude = self._float(record.get('longitude'))
+        self.capture_time = parse_time(record.get('capture_time'))
+        self.synced_at = datetime.now(timezone.utc)
+        self.raw = json.dumps(record, ensure_ascii=False)
+
+    @staticmethod
+    def from_record(record: dict) -> 'Defect':
+        """從上游記錄建立本地副本
+
+        Args:
+            record: 上游瑕疵記錄
+
+        Returns:
+            Defect: 瑕疵物件
+        """
+        defect = Defect(id=int(record['id']))
+        defect.update_from_record(record)
+        return defect
+
+    def to_dict(self) -> dict:
+        """轉換為與上游相同的字典格式
+
+        Returns:
+            dict: 瑕疵資料字典
+        """
+        return json.loads(self.raw)
+
+    def __repr__(self):
+        """獲取物件的字符串表示"""
+        return f'<Defect(id={self.id}, city={self.city}, road_section={self.road_section})>'
+
+
+class SyncState(db.Model):
+    """同步工作的進度（高水位標記）"""
+    __tablename__ = 'sync_state'
+
+    name = db.Column(db.String(50), primary_key=True)
+    high_water_mark = db.Column(db.DateTime, nullable=True)
+    # 上次完整比對上游的時間（UTC），完整比對會移除上游已刪除的記錄
+    reconciled_at = db.Column(db.DateTime, nullable=True)
+    last_synced_at = db.Column(db.DateTime, nullable=True)
+    last_count = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def get(name: str) -> 'SyncState':
+        """取得同步進度，不存在時建立
+
+        Args:
+            name: 同步工作名稱
+
+        Returns:
+            SyncState: 同步進度
+        """
+        state = SyncState.query.get(name)
+        if state is None:
+            state = SyncState(name=name, last_count=0)
+            db.session.add(state)
+        return state
+
+    def to_dict(self) -> dict:
+        """轉換為字典格式"""
+        return {
+            'name': self.name,
+            'high_water_mark': self.high_water_mark.isoformat() if self.high_water_mark else None,
+            'reconciled_at': self.reconciled_at.isoformat() if self.reconciled_at else None,
+            'last_synced_at': self.last_synced_at.isoformat() if self.last_synced_at else None,
+            'last_count': self.last_count
+        }
+
+
+class DefectDailyRollup(db.Model):
+    """每日瑕疵數量彙總（日、城市、行政區、類型、嚴重程度）"""
+    __tablename__ = 'defect_daily_rollups'
+    __table_args__ = (
+        db.UniqueConstraint('day', 'city', 'district', 'defect_type', 'severity', name='uq_defect_daily_rollups_key'),
+        db.Index('ix_defect_daily_rollups_location', 'city', 'district'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    city = db.Column(db.String(50), nullable=True)
+    district = db.Column(db.String(50), nullable=True)
+    defect_type = db.Column(db.Integer, nullable=True)
+    severity = db.Column(db.Integer, nullable=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    # 區間內最早與最晚的拍攝時間（UTC）
+    first_capture_time = db.Column(db.DateTime, nullable=True)
+    last_capture_time = db.Column(db.DateTime, nullable=True)
+
+    @staticmethod
+    def key_of(defect: 'Defect'):
+        """取得瑕疵所屬的彙總鍵，沒有拍攝時間時返回 None"""
+        if defect.capture_time is None:
+            return None
+        return (defect.capture_time.date(), defect.city, defect.district, defect.defect_type, defect.severity)
+
+    def __repr__(self):
+        """獲取物件的字符串表示"""
+        return f'<DefectDailyRollup(day={self.day}, city={self.city}, count={self.count})>'
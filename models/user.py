@@ -2,9 +2,9 @@
 使用者資料模型定義
 """
 from datetime import datetime, timezone
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from config.database import db
+from utils.passwords import get_login_recorder, get_password_hasher, hash_password, verify_password_hash
 
 class User(UserMixin, db.Model):
     """使用者資料表模型"""
@@ -27,7 +27,7 @@ class User(UserMixin, db.Model):
     @password.setter
     def password(self, password: str):
         """設定密碼（自動進行雜湊處理）"""
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def verify_password(self, password: str) -> bool:
         """驗證密碼
@@ -38,7 +38,23 @@ class User(UserMixin, db.Model):
         Returns:
             bool: 密碼是否正確
         """
-        return check_password_hash(self.password_hash, password)
+        return verify_password_hash(self.password_hash, password)
+
+    def rehash_password_if_needed(self, password: str) -> bool:
+        """雜湊參數已變更時，以驗證通過的密碼重新雜湊並儲存
+
+        Args:
+            password: 已驗證的密碼
+
+        Returns:
+            bool: 是否重新雜湊
+        """
+        hasher = get_password_hasher()
+        if hasher is None or not hasher.needs_rehash(self.password_hash):
+            return False
+        self.password = password
+        db.session.commit()
+        return True
 
     @staticmethod
     def create(username: str, password: str) -> 'User':
@@ -70,7 +86,11 @@ class User(UserMixin, db.Model):
         return User.query.filter_by(username=username).first()
 
     def update_last_login(self):
-        """更新最後登入時間"""
+        """更新最後登入時間（啟用批次寫入時由背景工作寫入資料庫）"""
+        recorder = get_login_recorder()
+        if recorder is not None:
+            recorder.record(self.id)
+            return
         self.last_login_at = datetime.now(timezone.utc)
         db.session.commit()
 
@@ -5,6 +5,7 @@ from flask import Blueprint, render_template, redirect, url_for, request, flash
 from flask_login import login_user, logout_user, login_required, current_user
 from models.user import User
 from config.database import db
+from utils.passwords import PasswordHashingBusy
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -19,7 +20,13 @@ def login():
         password = request.form.get('password')
         
         user = User.get_by_username(username)
-        if user and user.verify_password(password):
+        try:
+            verified = user is not None and user.verify_password(password)
+        except PasswordHashingBusy as e:
+            flash(str(e))
+            return render_template('auth/login.html'), 503
+        if verified:
+            user.rehash_password_if_needed(password)
             login_user(user)
             user.update_last_login()
             return redirect(url_for('defects.home'))
@@ -1,10 +1,34 @@
 """
 瑕疵管理相關路由
 """
-from flask import Blueprint, render_template, request, current_app, Response, jsonify
-from flask_login import login_required
+from flask import (Blueprint, render_template, request, current_app, Response, jsonify, send_file,
+                   stream_with_context, url_for)
+from flask_login import current_user, login_required
 import json
-from utils.api import call_road_defect_api
+from datetime import datetime
+from utils.api import call_road_defect_api, iter_response_content
+from utils.async_api import async_call_road_defect_api, async_view, run_sync
+from utils.aggregation import (
+    TREND_INTERVALS, compute_distribution, compute_road_analysis, compute_stats, compute_trends,
+    get_local_dataset
+)
+from utils.breaker import get_upstream_guard
+from utils.cache import get_response_cache
+from utils.defect_store import get_defect_store
+from utils.export import (EXPORT_FORMATS, STREAMING_FORMATS, check_format, get_export_config, get_export_jobs,
+                          iter_csv, iter_rows)
+from utils.image_cache import ImageUnavailable, fetch_image, get_image_cache
+from utils.locations import get_location_index
+from utils.map_data import (DEFAULT_MAX_POINTS, bounds_of, cluster_viewport, get_heatmap, get_map_config,
+                            get_map_dataset, limit_points)
+from utils.rollups import can_use_rollups, rollup_stats, rollup_trends
+from utils.replica import is_replica_mode
+from utils.server import get_server_info
+from utils.query import (DefectFilter, async_fetch_defects, count_matching, decode_cursor, fetch_defect_page,
+                         iter_defect_json, paginate_defects)
+from utils.spatial import parse_bbox
+from utils.thumbnails import attach_placeholders, fetch_thumbnail, get_thumbnail_renderer
+from utils.tiles import filter_hash, get_tile, get_tile_config, tile_etag, tile_version, valid_tile
 import requests
 
 defects_bp = Blueprint('defects', __name__)
@@ -12,134 +36,18 @@ defects_bp = Blueprint('defects', __name__)
 
 @defects_bp.route('/home')
 @login_required
-def home():
+@async_view
+async def home():
     """瑕疵列表頁面"""
     try:
-        # 輸出請求參數以便調試
-        print("Request args:", request.args)
-        print("Defect type:", request.args.get('defect_type'))
-        print("Road section:", request.args.get('road_section'))
-
-        # 獲取搜尋參數
-        params = {}
-
-        # 處理多個瑕疵類型
-        defect_types = request.args.getlist('defect_type')
-        if defect_types:
-            # 如果有多個瑕疵類型，需要分別查詢並合併結果
-            all_defects = []
-            for defect_type in defect_types:
-                type_params = params.copy()
-                if defect_type != 'all':
-                    try:
-                        type_params['defect_type'] = int(defect_type)
-                    except ValueError:
-                        current_app.logger.error(f'無效的瑕疵類型值: {defect_type}')
-                        continue
-                print(f"Searching for defect_type: {type_params.get('defect_type', 'all')}")
-
-                # 處理多個嚴重程度
-                severities = request.args.getlist('severity')
-                if severities:
-                    for severity in severities:
-                        severity_params = type_params.copy()
-                        if severity != 'all':
-                            try:
-                                severity_params['severity'] = int(severity)
-                            except ValueError:
-                                current_app.logger.error(f'無效的嚴重程度值: {severity}')
-                                continue
-                        print(f"Searching for severity: {severity_params.get('severity', 'all')}")
-
-                        # 處理多個城市參數
-                        cities = request.args.getlist('city')
-                        if cities:
-                            # 一次性獲取所有城市的數據
-                            city_params = severity_params.copy()
-                            if 'all' not in cities:
-                                city_params['city'] = cities
-                            print(f"Searching with params: {city_params}")
-                            
-                            # 調用 API 獲取數據
-                            result = call_road_defect_api('road-defects', params=city_params)
-                            if result.get('success') and result['data'].get('data'):
-                                all_defects.extend(result['data']['data'])
-                        else:
-                            # 如果沒有選擇城市，直接使用當前參數進行搜索
-                            result = call_road_defect_api('road-defects', params=severity_params)
-                            if result.get('success') and result['data'].get('data'):
-                                all_defects.extend(result['data']['data'])
-
-            # 如果有數據，返回合併後的結果
-            if all_defects:
-                print(f"Found {len(all_defects)} defects in total")
-                # 去除重複的瑕疵
-                unique_defects = []
-                seen_ids = set()
-                for defect in all_defects:
-                    if defect['id'] not in seen_ids:
-                        seen_ids.add(defect['id'])
-                        unique_defects.append(defect)
-                print(f"After removing duplicates: {len(unique_defects)} defects")
-                return render_template('defects/home.html',
-                                       defects={'data': unique_defects},
-                                       map_data=json.dumps(unique_defects))
-            else:
-                print("No defects found")
-                return render_template('defects/home.html',
-                                       error='沒有找到符合條件的瑕疵資料',
-                                       defects={'data': []},
-                                       map_data=json.dumps([]))
-        else:
-            # 如果沒有選擇城市，使用其他參數進行搜索
-            if request.args.get('district'):
-                params['district'] = request.args.get('district')
+        current_app.logger.debug(f"請求參數: {request.args}")
 
-            if request.args.get('road_section'):
-                params['road_section'] = request.args.get('road_section')
-                road_to_filter = request.args.get('road_section')
-            else:
-                road_to_filter = None
-
-            if request.args.get('start_time'):
-                params['start_time'] = request.args.get('start_time')
-
-            if request.args.get('end_time'):
-                params['end_time'] = request.args.get('end_time')
-
-            print(f"Searching with params (no city): {params}")
-            # 從 API 獲取瑕疵列表
-            api_result = call_road_defect_api('road-defects', params=params)
-            print("API result (no city):", api_result)
-
-            if api_result['success']:
-                api_response = api_result['data']
-
-                if not api_response.get('data'):
-                    return render_template('defects/home.html',
-                                           error='沒有找到符合條件的瑕疵資料',
-                                           defects={'data': []},
-                                           map_data=json.dumps([]))
-
-                # 如果指定了道路，進行過濾
-                if road_to_filter:
-                    filtered_data = [
-                        defect for defect in api_response.get('data', [])
-                        if defect.get('road_section') == road_to_filter
-                    ]
-                    api_response['data'] = filtered_data
-
-                # 準備地圖數據
-                map_data = json.dumps(api_response.get('data', []))
-                return render_template('defects/home.html',
-                                       defects=api_response,
-                                       map_data=map_data)
-            else:
-                # 處理 API 錯誤
-                return render_template('defects/home.html',
-                                       error=api_result['error'],
-                                       defects={'data': []},
-                                       map_data=json.dumps([]))
+        # 將搜尋參數標準化為單一查詢條件，由查詢規劃器決定上游請求
+        defect_filter = DefectFilter.from_args(request.args)
+        current_app.logger.debug(f"查詢條件: {defect_filter}")
+        result = await async_fetch_defects(defect_filter)
+        # 預覽圖與模板渲染不在事件迴圈上進行
+        return await run_sync(_render_home, result)
 
     except Exception as e:
         current_app.logger.error(f"未預期的錯誤: {str(e)}")
@@ -149,10 +57,72 @@ def home():
                                map_data=json.dumps([]))
 
 
+def _render_home(result):
+    """依查詢結果渲染瑕疵列表頁面"""
+    if not result['success']:
+        # 處理 API 錯誤
+        return render_template('defects/home.html',
+                               error=result['message'] or '無法獲取瑕疵資料',
+                               defects={'data': []},
+                               map_data=json.dumps([]))
+
+    defects = result['data']
+    if not defects:
+        current_app.logger.debug("沒有找到符合條件的瑕疵")
+        return render_template('defects/home.html',
+                               error='沒有找到符合條件的瑕疵資料',
+                               defects={'data': []},
+                               map_data=json.dumps([]))
+
+    warning = None
+    if result['failed']:
+        warning = f"{result['failed']} 個查詢條件未能取得資料，目前顯示部分結果"
+
+    # 只渲染第一頁，其餘由頁面以 /api/road-defects/list 的游標分頁載入
+    list_config = current_app.config.get('CURRENT_CONFIG', {}).get('defect_list', {})
+    page_size = list_config.get('home_page_size', 50)
+    page = paginate_defects(defects, None, page_size)
+
+    current_app.logger.debug(f"共找到 {len(defects)} 筆瑕疵")
+    # 附上已快取圖片的預覽圖，頁面不需等待圖片下載即可顯示
+    # 地圖只需要結果範圍，視窗內的瑕疵由 /api/road-defects/clusters 載入
+    return render_template('defects/home.html',
+                           defects={
+                               'data': attach_placeholders(page['data']),
+                               'total': page['total'],
+                               'next_cursor': page['next_cursor'],
+                               'page_size': page_size
+                           },
+                           warning=warning,
+                           map_data=json.dumps({'total': len(defects), 'bounds': bounds_of(defects)}))
+
+
 @defects_bp.route('/proxy-image/<int:defect_id>')
 def proxy_image(defect_id):
-    """代理圖片請求到外部 API"""
+    """代理圖片請求到外部 API
+
+    可選參數 w（寬度）、q（品質）、fmt（jpeg 或 webp）會返回縮圖。
+    """
     try:
+        # 啟用磁碟快取時由本地檔案回應（支援 ETag、304 與 Range）
+        image_cache = get_image_cache()
+        if image_cache is not None:
+            renderer = get_thumbnail_renderer()
+            if renderer is not None and any(k in request.args for k in ('w', 'q', 'fmt')):
+                options = renderer.normalize(
+                    request.args.get('w', type=int),
+                    request.args.get('q', type=int),
+                    request.args.get('fmt')
+                )
+                if options is None:
+                    return Response(status=400)
+                image = fetch_thumbnail(defect_id, *options)
+            else:
+                image = fetch_image(defect_id)
+            if image is None:
+                return Response(status=404)
+            return image_cache.make_response(image)
+
         # 使用 call_road_defect_api 獲取圖片
         result = call_road_defect_api(f'road-defects/{defect_id}/image', stream=True)
         
@@ -161,42 +131,148 @@ def proxy_image(defect_id):
             # 獲取內容類型
             content_type = response.headers.get('content-type', 'image/jpeg')
             
-            # 返回圖片數據
+            # 返回圖片數據（傳輸完成後連線會歸還連線池）
             return Response(
-                response.iter_content(chunk_size=8192),
+                iter_response_content(response, chunk_size=8192),
                 content_type=content_type
             )
         else:
             # 如果圖片不存在，返回 404
+            if result.get('response') is not None:
+                result['response'].close()
             return Response(status=404)
 
+    except ImageUnavailable as e:
+        # 上游暫時無法提供圖片，與沒有圖片（404）區分，瀏覽器之後會重新請求
+        current_app.logger.warning(str(e))
+        return Response(status=503 if e.status_code == 503 else 502)
     except Exception as e:
         print(f"代理圖片請求時發生錯誤: {str(e)}")
         return Response(status=500)
 
 
+def _local_result(data):
+    """以與上游代理相同的格式包裝本地聚合結果"""
+    return {
+        'success': True,
+        'data': {
+            'status': 'success',
+            'data': data
+        }
+    }
+
+
+def _aggregate_locally(defect_filter, compute, rollup=None):
+    """以每日彙總或本地資料聚合，沒有本地資料時返回 None
+
+    Args:
+        defect_filter: 查詢條件
+        compute: 以本地資料集計算結果的函數
+        rollup: 以每日彙總計算結果的函數，None 表示不使用彙總
+
+    Returns:
+        Optional[Response]: JSON 回應
+    """
+    if rollup is not None and can_use_rollups(defect_filter):
+        return jsonify(_local_result(rollup(defect_filter)))
+    dataset = get_local_dataset(defect_filter)
+    if dataset is None:
+        return None
+    return jsonify(_local_result(compute(*dataset)))
+
+
+def _has_local_data() -> bool:
+    """是否以欄式儲存或本地副本回應聚合請求"""
+    return get_defect_store() is not None or is_replica_mode()
+
+
+def _batched(chunks, size: int = 64 * 1024):
+    """將小片段合併為較大的區塊再輸出，減少寫入次數"""
+    buffer = []
+    buffered = 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        buffered += len(chunk)
+        if buffered >= size:
+            yield b''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield b''.join(buffer)
+
+
+def _stream_defects(fmt, total, records):
+    """逐筆輸出瑕疵列表
+
+    ndjson 為每行一筆瑕疵；json 與一般列表回應格式相同，但以分塊方式輸出。
+
+    Args:
+        fmt: ndjson 或 json
+        total: 總筆數（無法取得時為 None）
+        records: iter_defect_json 返回的每筆瑕疵 JSON
+    """
+
+    def generate_ndjson():
+        for record in records:
+            yield record + b'\n'
+
+    def generate_json():
+        yield b'{"status":"success","data":{"defects":['
+        for i, record in enumerate(records):
+            yield b',' + record if i else record
+        yield b']}}'
+
+    generate = generate_ndjson if fmt == 'ndjson' else generate_json
+    response = Response(stream_with_context(_batched(generate())),
+                        mimetype='application/x-ndjson' if fmt == 'ndjson' else 'application/json')
+    if total is not None:
+        response.headers['X-Total-Count'] = str(total)
+    return response
+
+
+def _export_job_response(job, status=200):
+    """以工作狀態建立響應，完成時附上下載連結"""
+    data = dict(job, status_url=url_for('defects.get_export_job', job_id=job['id']))
+    if job['status'] == 'completed':
+        data['download_url'] = url_for('defects.download_export', job_id=job['id'])
+    return jsonify({
+        'status': 'success',
+        'data': data
+    }), status
+
+
+def _owned_export_job(job_id):
+    """取得目前使用者建立的匯出工作，不存在或不屬於目前使用者時返回 None"""
+    job = get_export_jobs().get(job_id)
+    if job is None or job['owner'] != current_user.get_id():
+        return None
+    return job
+
+
+def _location_response(data):
+    """以地理位置快照建立響應，並附上快照存在時間"""
+    response = jsonify({
+        'status': 'success',
+        'data': data
+    })
+    age = get_location_index().age()
+    if age is not None:
+        response.headers['X-Data-Age'] = str(int(age))
+    return response
+
+
 @defects_bp.route('/api/locations/cities', methods=['GET'])
 @login_required
 def get_cities():
     """獲取所有唯一的城市列表"""
     try:
-        # 調用API獲取所有瑕疵記錄
-        api_result = call_road_defect_api('road-defects')
-        print("API Response for cities:", api_result)  # 添加調試日誌
-
-        if api_result.get('success'):  # 修改這裡，使用 'success' 而不是 'status'
-            # 從所有記錄中提取唯一的城市
-            cities = sorted(list(
-                set(defect.get('city', '') for defect in api_result['data'].get('data', []) if defect.get('city'))))
-            print("Extracted cities:", cities)  # 添加調試日誌
+        index = get_location_index()
+        if not index.ensure_loaded():
             return jsonify({
-                'status': 'success',
-                'data': cities
-            })
-        return jsonify({
-            'status': 'error',
-            'message': '無法獲取城市列表'
-        }), 500
+                'status': 'error',
+                'message': '無法獲取城市列表'
+            }), 500
+        return _location_response(index.cities())
     except Exception as e:
         print(f"Error in get_cities: {str(e)}")  # 添加調試日誌
         return jsonify({
@@ -210,50 +286,13 @@ def get_cities():
 def get_location_list():
     """獲取所有的地理位置數據，包括城市、行政區和街道"""
     try:
-        # 調用API獲取所有瑕疵記錄
-        api_result = call_road_defect_api('road-defects')
-
-        if not api_result.get('success'):
+        index = get_location_index()
+        if not index.ensure_loaded():
             return jsonify({
                 'status': 'error',
                 'message': '無法獲取地理位置數據'
             }), 500
-
-        # 創建層級結構數據
-        location_data = {}
-
-        # 從所有記錄中提取並組織地理位置數據
-        for defect in api_result['data'].get('data', []):
-            city = defect.get('city')
-            district = defect.get('district')
-            road = defect.get('road_section')
-
-            if not all([city, district, road]):
-                continue
-
-            # 初始化城市字典
-            if city not in location_data:
-                location_data[city] = {}
-
-            # 初始化行政區列表
-            if district not in location_data[city]:
-                location_data[city][district] = []
-
-            # 添加街道
-            if road not in location_data[city][district]:
-                location_data[city][district].append(road)
-
-        # 對每個層級的數據進行排序
-        sorted_data = {}
-        for city in sorted(location_data.keys()):
-            sorted_data[city] = {}
-            for district in sorted(location_data[city].keys()):
-                sorted_data[city][district] = sorted(location_data[city][district])
-
-        return jsonify({
-            'status': 'success',
-            'data': sorted_data
-        })
+        return _location_response(index.hierarchy())
 
     except Exception as e:
         print(f"Error in get_location_list: {str(e)}")
@@ -275,20 +314,13 @@ def get_districts():
                 'message': '必須指定城市'
             }), 400
 
-        # 調用API獲取所有瑕疵記錄
-        api_result = call_road_defect_api('road-defects', params={'city': city})
-        if api_result.get('success'):  # 修改這裡，使用 'success' 而不是 'status'
-            # 從所有記錄中提取唯一的行政區
-            districts = sorted(list(set(
-                defect.get('district', '') for defect in api_result['data'].get('data', []) if defect.get('district'))))
+        index = get_location_index()
+        if not index.ensure_loaded():
             return jsonify({
-                'status': 'success',
-                'data': districts
-            })
-        return jsonify({
-            'status': 'error',
-            'message': '無法獲取行政區列表'
-        }), 500
+                'status': 'error',
+                'message': '無法獲取行政區列表'
+            }), 500
+        return _location_response(index.districts(city))
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -309,20 +341,13 @@ def get_roads():
                 'message': '必須指定城市和行政區'
             }), 400
 
-        # 調用API獲取所有瑕疵記錄
-        api_result = call_road_defect_api('road-defects', params={'city': city, 'district': district})
-        if api_result.get('success'):  # 修改這裡，使用 'success' 而不是 'status'
-            # 從所有記錄中提取唯一的街道
-            roads = sorted(list(set(defect.get('road_section', '') for defect in api_result['data'].get('data', []) if
-                                    defect.get('road_section'))))
+        index = get_location_index()
+        if not index.ensure_loaded():
             return jsonify({
-                'status': 'success',
-                'data': roads
-            })
-        return jsonify({
-            'status': 'error',
-            'message': '無法獲取街道列表'
-        }), 500
+                'status': 'error',
+                'message': '無法獲取街道列表'
+            }), 500
+        return _location_response(index.roads(city, district))
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -332,29 +357,19 @@ def get_roads():
 
 @defects_bp.route('/api/road-defects/stats', methods=['GET'])
 @login_required
-def get_stats():
+@async_view
+async def get_stats():
     """獲取瑕疵統計數據"""
     try:
-        # 從請求中獲取參數
-        params = {}
-        if request.args.getlist('city[]'):
-            params['city'] = request.args.getlist('city[]')
-        if request.args.getlist('district[]'):
-            params['district'] = request.args.getlist('district[]')
-        if request.args.getlist('road_section[]'):
-            params['road_section'] = request.args.getlist('road_section[]')
-        if request.args.getlist('defect_type[]'):
-            params['defect_type'] = request.args.getlist('defect_type[]')
-        if request.args.getlist('severity[]'):
-            params['severity'] = request.args.getlist('severity[]')
-        if request.args.get('start_time'):
-            params['start_time'] = request.args.get('start_time')
-        if request.args.get('end_time'):
-            params['end_time'] = request.args.get('end_time')
-
-        # 調用外部 API
-        api_result = call_road_defect_api('road-defects/stats', params=params)
-        return jsonify(api_result)
+        defect_filter = DefectFilter.from_args(request.args)
+
+        # 優先使用每日彙總，其次為本地資料聚合，不需再請求上游
+        response = await run_sync(_aggregate_locally, defect_filter, compute_stats, rollup_stats)
+        if response is not None:
+            return response
+
+        api_result = await async_call_road_defect_api('road-defects/stats', params=defect_filter.to_params())
+        return await run_sync(jsonify, api_result)
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -364,27 +379,32 @@ def get_stats():
 
 @defects_bp.route('/api/road-defects/trends', methods=['GET'])
 @login_required
-def get_trends():
+@async_view
+async def get_trends():
     """獲取瑕疵趨勢數據"""
     try:
-        params = {}
-        if request.args.getlist('city[]'):
-            params['city'] = request.args.getlist('city[]')
-        if request.args.getlist('district[]'):
-            params['district'] = request.args.getlist('district[]')
-        if request.args.getlist('road_section[]'):
-            params['road_section'] = request.args.getlist('road_section[]')
-        if request.args.getlist('defect_type[]'):
-            params['defect_type'] = request.args.getlist('defect_type[]')
-        if request.args.getlist('severity[]'):
-            params['severity'] = request.args.getlist('severity[]')
-        if request.args.get('start_time'):
-            params['start_time'] = request.args.get('start_time')
-        if request.args.get('end_time'):
-            params['end_time'] = request.args.get('end_time')
-
-        api_result = call_road_defect_api('road-defects/trends', params=params)
-        return jsonify(api_result)
+        defect_filter = DefectFilter.from_args(request.args)
+        interval = request.args.get('interval', 'month')
+
+        # 優先使用每日彙總，其次為本地資料聚合，不需再請求上游；
+        # 本地聚合只支援 TREND_INTERVALS，其他區間直接交給上游處理
+        if interval in TREND_INTERVALS:
+            response = await run_sync(
+                _aggregate_locally,
+                defect_filter,
+                lambda *dataset: compute_trends(*dataset, interval=interval),
+                lambda rollup_filter: rollup_trends(rollup_filter, interval)
+            )
+            if response is not None:
+                return response
+        elif await run_sync(_has_local_data):
+            return jsonify({
+                'status': 'error',
+                'message': f'不支援的時間區間: {interval}'
+            }), 400
+
+        api_result = await async_call_road_defect_api('road-defects/trends', params=defect_filter.to_params())
+        return await run_sync(jsonify, api_result)
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -394,27 +414,19 @@ def get_trends():
 
 @defects_bp.route('/api/road-defects/distribution', methods=['GET'])
 @login_required
-def get_distribution():
+@async_view
+async def get_distribution():
     """獲取瑕疵地理分布統計"""
     try:
-        params = {}
-        if request.args.getlist('city[]'):
-            params['city'] = request.args.getlist('city[]')
-        if request.args.getlist('district[]'):
-            params['district'] = request.args.getlist('district[]')
-        if request.args.getlist('road_section[]'):
-            params['road_section'] = request.args.getlist('road_section[]')
-        if request.args.getlist('defect_type[]'):
-            params['defect_type'] = request.args.getlist('defect_type[]')
-        if request.args.getlist('severity[]'):
-            params['severity'] = request.args.getlist('severity[]')
-        if request.args.get('start_time'):
-            params['start_time'] = request.args.get('start_time')
-        if request.args.get('end_time'):
-            params['end_time'] = request.args.get('end_time')
-
-        api_result = call_road_defect_api('road-defects/distribution', params=params)
-        return jsonify(api_result)
+        defect_filter = DefectFilter.from_args(request.args)
+
+        # 有本地資料時直接聚合，不需再請求上游
+        response = await run_sync(_aggregate_locally, defect_filter, compute_distribution)
+        if response is not None:
+            return response
+
+        api_result = await async_call_road_defect_api('road-defects/distribution', params=defect_filter.to_params())
+        return await run_sync(jsonify, api_result)
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -424,27 +436,19 @@ def get_distribution():
 
 @defects_bp.route('/api/road-defects/road-analysis', methods=['GET'])
 @login_required
-def get_road_analysis():
+@async_view
+async def get_road_analysis():
     """獲取道路瑕疵分析"""
     try:
-        params = {}
-        if request.args.getlist('city[]'):
-            params['city'] = request.args.getlist('city[]')
-        if request.args.getlist('district[]'):
-            params['district'] = request.args.getlist('district[]')
-        if request.args.getlist('road_section[]'):
-            params['road_section'] = request.args.getlist('road_section[]')
-        if request.args.getlist('defect_type[]'):
-            params['defect_type'] = request.args.getlist('defect_type[]')
-        if request.args.getlist('severity[]'):
-            params['severity'] = request.args.getlist('severity[]')
-        if request.args.get('start_time'):
-            params['start_time'] = request.args.get('start_time')
-        if request.args.get('end_time'):
-            params['end_time'] = request.args.get('end_time')
-
-        api_result = call_road_defect_api('road-defects/road-analysis', params=params)
-        return jsonify(api_result)
+        defect_filter = DefectFilter.from_args(request.args)
+
+        # 有本地資料時直接聚合，不需再請求上游
+        response = await run_sync(_aggregate_locally, defect_filter, compute_road_analysis)
+        if response is not None:
+            return response
+
+        api_result = await async_call_road_defect_api('road-defects/road-analysis', params=defect_filter.to_params())
+        return await run_sync(jsonify, api_result)
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -452,45 +456,359 @@ def get_road_analysis():
         }), 500
 
 
-@defects_bp.route('/api/road-defects/list', methods=['GET'])
+@defects_bp.route('/api/road-defects/heatmap', methods=['GET'])
 @login_required
-def get_defect_list():
-    """獲取瑕疵列表數據"""
+def get_defect_heatmap():
+    """獲取瑕疵密度網格
+
+    可選參數 cell_size 為網格大小（度），其餘參數與 /api/road-defects/stats 相同。
+    每個網格返回中心座標、瑕疵數量與嚴重程度加權分數。
+    """
     try:
-        # 從請求中獲取參數
-        params = {}
-        if request.args.getlist('city[]'):
-            params['city'] = request.args.getlist('city[]')
-        if request.args.getlist('district[]'):
-            params['district'] = request.args.getlist('district[]')
-        if request.args.getlist('road_section[]'):
-            params['road_section'] = request.args.getlist('road_section[]')
-        if request.args.getlist('defect_type[]'):
-            params['defect_type'] = request.args.getlist('defect_type[]')
-        if request.args.getlist('severity[]'):
-            params['severity'] = request.args.getlist('severity[]')
-        if request.args.get('start_time'):
-            params['start_time'] = request.args.get('start_time')
-        if request.args.get('end_time'):
-            params['end_time'] = request.args.get('end_time')
-
-        # 調用外部 API
-        api_result = call_road_defect_api('road-defects', params=params)
-        
-        if api_result.get('success'):
+        cell_size = request.args.get('cell_size', type=float)
+        if cell_size is not None and not cell_size > 0:
             return jsonify({
-                'status': 'success',
-                'data': {
-                    'defects': api_result['data'].get('data', [])
-                }
-            })
-        else:
+                'status': 'error',
+                'message': 'cell_size 必須為正數'
+            }), 400
+
+        heatmap = get_heatmap(DefectFilter.from_args(request.args), cell_size)
+        if heatmap is None:
+            return jsonify({
+                'status': 'error',
+                'message': '無法獲取瑕疵列表數據'
+            }), 500
+        return jsonify({
+            'status': 'success',
+            'data': heatmap
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@defects_bp.route('/api/road-defects/within', methods=['GET'])
+@login_required
+def get_defects_within():
+    """獲取地圖視窗範圍內的瑕疵
+
+    參數 bbox 為「最小經度,最小緯度,最大經度,最大緯度」，zoom 為地圖縮放等級，
+    其餘參數與 /api/road-defects/list 相同。
+    """
+    try:
+        bbox = parse_bbox(request.args.get('bbox'))
+        if bbox is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'bbox 參數格式應為 最小經度,最小緯度,最大經度,最大緯度'
+            }), 400
+        zoom = request.args.get('zoom', type=int)
+
+        dataset = get_map_dataset(DefectFilter.from_args(request.args), bbox)
+        if dataset is None:
+            return jsonify({
+                'status': 'error',
+                'message': '無法獲取瑕疵列表數據'
+            }), 500
+        store, indices = dataset
+
+        max_points = get_map_config().get('max_points', DEFAULT_MAX_POINTS)
+        selected = limit_points(indices, max_points)
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'bbox': list(bbox),
+                'zoom': zoom,
+                'total': int(len(indices)),
+                'truncated': len(selected) < len(indices),
+                'defects': attach_placeholders(store.records(selected))
+            }
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@defects_bp.route('/api/road-defects/clusters', methods=['GET'])
+@login_required
+def get_defect_clusters():
+    """獲取地圖視窗範圍內依縮放等級聚合的瑕疵
+
+    參數與 /api/road-defects/within 相同。每個項目為群集（數量、中心、
+    嚴重程度分布與範圍）或單一瑕疵；縮放等級達 cluster_max_zoom 後只返回單一瑕疵，
+    數量超過 max_points 時平均抽樣並標記 truncated。
+    """
+    try:
+        bbox = parse_bbox(request.args.get('bbox'))
+        zoom = request.args.get('zoom', type=int)
+        if bbox is None or zoom is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'bbox 參數格式應為 最小經度,最小緯度,最大經度,最大緯度，且需提供 zoom'
+            }), 400
+
+        result = cluster_viewport(DefectFilter.from_args(request.args), bbox, zoom)
+        if result is None:
+            return jsonify({
+                'status': 'error',
+                'message': '無法獲取瑕疵列表數據'
+            }), 500
+
+        points = attach_placeholders([item['defect'] for item in result['items'] if item['type'] == 'point'])
+        return jsonify({
+            'status': 'success',
+            'data': {
+                'bbox': list(bbox),
+                'zoom': result['zoom'],
+                'clustered': result['clustered'],
+                'total': result['total'],
+                'truncated': result['truncated'],
+                'clusters': [item for item in result['items'] if item['type'] == 'cluster'],
+                'defects': points
+            }
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@defects_bp.route('/tiles/defects/<int:z>/<int:x>/<int:y>', methods=['GET'])
+@login_required
+def get_defect_tile(z, x, y):
+    """獲取瑕疵圖層的 GeoJSON 圖磚
+
+    查詢參數與 /home 相同。回應帶有 ETag 與 Cache-Control，瀏覽器可個別快取每個圖磚。
+    """
+    try:
+        if not valid_tile(z, x, y):
+            return Response(status=404)
+
+        defect_filter = DefectFilter.from_args(request.args)
+        version = tile_version(defect_filter)
+        if version is None:
             return jsonify({
                 'status': 'error',
                 'message': '無法獲取瑕疵列表數據'
             }), 500
+        # ETag 由資料版本組成，不需產生圖磚即可比對
+        etag = tile_etag(version, filter_hash(defect_filter), z, x, y)
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+        else:
+            body = get_tile(defect_filter, z, x, y)
+            if body is None:
+                return jsonify({
+                    'status': 'error',
+                    'message': '無法獲取瑕疵列表數據'
+                }), 500
+            response = Response(body, mimetype='application/geo+json')
+            response.set_etag(etag)
+            response.make_conditional(request)
+
+        # 圖磚內容需登入後才能取得，只允許瀏覽器快取
+        response.headers['Cache-Control'] = f"private, max-age={get_tile_config().get('max_age', 60)}"
+        return response
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
+
+
+def _defect_page_response(defect_filter):
+    """依 cursor 與 limit 參數返回一頁瑕疵列表"""
+    list_config = current_app.config.get('CURRENT_CONFIG', {}).get('defect_list', {})
+    limit = request.args.get('limit', list_config.get('default_limit', 500), type=int)
+    try:
+        after_id = decode_cursor(request.args.get('cursor'))
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    if limit is None or limit <= 0:
+        return jsonify({
+            'status': 'error',
+            'message': 'limit 必須為正整數'
+        }), 400
+
+    page = fetch_defect_page(defect_filter, after_id, min(limit, list_config.get('max_limit', 5000)))
+    if not page['success']:
+        return jsonify({
+            'status': 'error',
+            'message': '無法獲取瑕疵列表數據'
+        }), 500
+    response = jsonify({
+        'status': 'success',
+        'data': {
+            'defects': attach_placeholders(page['data']),
+            'next_cursor': page['next_cursor']
+        }
+    })
+    response.headers['X-Total-Count'] = str(page['total'])
+    return response
+
+
+def _defect_list_response(result):
+    """將完整的查詢結果包裝為瑕疵列表回應"""
+    if not result['success']:
+        return jsonify({
+            'status': 'error',
+            'message': '無法獲取瑕疵列表數據'
+        }), 500
+    response = jsonify({
+        'status': 'success',
+        'data': {
+            'defects': attach_placeholders(result['data'])
+        }
+    })
+    response.headers['X-Total-Count'] = str(len(result['data']))
+    return response
+
+
+@defects_bp.route('/api/road-defects/list', methods=['GET'])
+@login_required
+@async_view
+async def get_defect_list():
+    """獲取瑕疵列表數據
+
+    可選參數：
+    - cursor、limit：依 ID 順序分頁，回應包含 next_cursor，總筆數在 X-Total-Count 標頭
+    - stream=ndjson 或 stream=json：逐筆輸出全部結果（不附預覽圖）
+    """
+    try:
+        defect_filter = DefectFilter.from_args(request.args)
+
+        stream = request.args.get('stream')
+        if stream:
+            if stream not in ('ndjson', 'json'):
+                return jsonify({
+                    'status': 'error',
+                    'message': 'stream 參數必須為 ndjson 或 json'
+                }), 400
+            # 本地副本的記錄在輸出回應時才逐批讀取；上游模式在執行緒池中取得完整結果
+            total, records = await run_sync(iter_defect_json, defect_filter)
+            return _stream_defects(stream, total, records)
+
+        if 'cursor' in request.args or 'limit' in request.args:
+            return await run_sync(_defect_page_response, defect_filter)
+
+        # 依查詢計畫從上游取得資料
+        result = await async_fetch_defects(defect_filter)
+        return await run_sync(_defect_list_response, result)
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@defects_bp.route('/api/road-defects/export', methods=['GET'])
+@login_required
+def export_defects():
+    """匯出瑕疵資料
+
+    參數 format 為 csv、xlsx 或 parquet，其餘參數與 /api/road-defects/list 相同。
+    筆數不超過同步上限的 CSV 直接串流下載；其餘格式、較大的匯出或指定 async=1 時
+    建立背景工作並返回 202，完成後由 download_url 下載。
+    筆數以欄式儲存或本地副本計算；只能從上游取得資料時無法預先得知筆數，直接串流下載。
+    """
+    try:
+        fmt = request.args.get('format', 'csv').lower()
+        error = check_format(fmt)
+        if error:
+            return jsonify({
+                'status': 'error',
+                'message': error
+            }), 400
+
+        defect_filter = DefectFilter.from_args(request.args)
+        background = fmt not in STREAMING_FORMATS or request.args.get('async') in ('1', 'true')
+        if not background:
+            # 先以不解碼記錄的方式計算筆數，決定是否改為背景工作
+            count = count_matching(defect_filter)
+            if count is not None and count > get_export_config().get('sync_max_rows', 50000):
+                background = True
+        if background:
+            job = get_export_jobs().submit(defect_filter, fmt, current_user.get_id())
+            return _export_job_response(job, 202)
+
+        total, records = iter_defect_json(defect_filter)
+        filename = f"defects-{datetime.now().strftime('%Y%m%d-%H%M%S')}.{EXPORT_FORMATS[fmt][1]}"
+        response = Response(stream_with_context(iter_csv(iter_rows(records))), mimetype=EXPORT_FORMATS[fmt][0])
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        if total is not None:
+            response.headers['X-Total-Count'] = str(total)
+        return response
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+
+@defects_bp.route('/api/road-defects/export/jobs/<job_id>', methods=['GET'])
+@login_required
+def get_export_job(job_id):
+    """獲取背景匯出工作的狀態"""
+    job = _owned_export_job(job_id)
+    if job is None:
+        return jsonify({
+            'status': 'error',
+            'message': '找不到匯出工作'
+        }), 404
+    return _export_job_response(job)
+
+
+@defects_bp.route('/api/road-defects/export/jobs/<job_id>/download', methods=['GET'])
+@login_required
+def download_export(job_id):
+    """下載背景匯出工作產生的檔案"""
+    job = _owned_export_job(job_id)
+    if job is None or job['status'] != 'completed':
+        return jsonify({
+            'status': 'error',
+            'message': '匯出檔案不存在或尚未完成'
+        }), 404
+
+    created_at = datetime.fromtimestamp(job['created_at'])
+    return send_file(
+        get_export_jobs().file_path(job),
+        mimetype=EXPORT_FORMATS[job['format']][0],
+        as_attachment=True,
+        download_name=f"defects-{created_at.strftime('%Y%m%d-%H%M%S')}.{EXPORT_FORMATS[job['format']][1]}"
+    )
+
+
+@defects_bp.route('/api/cache/stats', methods=['GET'])
+@login_required
+def get_cache_stats():
+    """獲取上游 API 響應快取的命中統計"""
+    cache = get_response_cache()
+    image_cache = get_image_cache()
+    data = dict(cache.stats(), enabled=True) if cache is not None else {'enabled': False}
+    data['images'] = dict(image_cache.stats(), enabled=True) if image_cache is not None else {'enabled': False}
+    return jsonify({
+        'status': 'success',
+        'data': data
+    })
+
+
+@defects_bp.route('/api/server/status', methods=['GET'])
+@login_required
+def get_server_status():
+    """獲取服務模式、worker 數、目前處理請求的 worker 與上游斷路器狀態"""
+    guard = get_upstream_guard()
+    data = get_server_info()
+    data['upstream'] = guard.stats() if guard is not None else None
+    return jsonify({
+        'status': 'success',
+        'data': data
+    })
@@ -0,0 +1,127 @@
+"""
+登入吞吐量基準測試
+
+以多個執行緒同時向 /login 送出正確的帳號密碼，統計每秒登入數與每個 CPU 核心秒的登入數。
+使用暫存的 SQLite 資料庫，不會修改設定中的資料庫；背景工作不會啟動，不會請求上游 API。
+
+    python scripts/bench_login.py --threads 16 --duration 10
+    python scripts/bench_login.py --inline          # 在請求執行緒中雜湊並同步寫入最後登入時間（對照組）
+    python scripts/bench_login.py --method pbkdf2:sha256:600000
+"""
+import argparse
+import copy
+import os
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# 添加專案根目錄到 Python 路徑
+root_dir = Path(__file__).parent.parent
+sys.path.append(str(root_dir))
+
+from app import create_app, current_config
+from config.database import db
+from models.user import User
+
+BENCH_USERNAME = 'bench-user'
+BENCH_PASSWORD = 'bench-password'
+
+
+def build_app(database_path: str, method: str = None, inline: bool = False):
+    """建立使用暫存資料庫的應用程式"""
+    config = copy.deepcopy(current_config)
+    config['database'] = {'url': f'sqlite:///{database_path}', 'echo': False}
+    if method:
+        config.setdefault('passwords', {})['method'] = method
+    app = create_app(config)
+    app.config['TESTING'] = True
+    app.config['PERIODIC_TASKS'] = False
+    if inline:
+        app.extensions['password_hasher'] = None
+        app.extensions['login_recorder'] = None
+
+    with app.app_context():
+        if User.get_by_username(BENCH_USERNAME) is None:
+            User.create(BENCH_USERNAME, BENCH_PASSWORD)
+    return app
+
+
+def run(app, threads: int, duration: float) -> dict:
+    """在指定時間內持續登入
+
+    Args:
+        app: Flask 應用程式實例
+        threads: 同時登入的執行緒數
+        duration: 測試時間（秒）
+
+    Returns:
+        dict: 登入數、失敗數、耗時與 CPU 時間
+    """
+    counts = [0] * threads
+    failures = [0] * threads
+    deadline = time.monotonic() + duration
+
+    def worker(index: int):
+        client = app.test_client()
+        while time.monotonic() < deadline:
+            response = client.post('/login', data={'username': BENCH_USERNAME, 'password': BENCH_PASSWORD})
+            if response.status_code == 302:
+                counts[index] += 1
+            else:
+                failures[index] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    started_at = time.monotonic()
+    cpu_started_at = time.process_time()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return {
+        'logins': sum(counts),
+        'failures': sum(failures),
+        'elapsed': time.monotonic() - started_at,
+        'cpu_time': time.process_time() - cpu_started_at
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='登入吞吐量基準測試')
+    parser.add_argument('--threads', type=int, default=8, help='同時登入的執行緒數')
+    parser.add_argument('--duration', type=float, default=10, help='測試時間（秒）')
+    parser.add_argument('--method', default=None, help='密碼雜湊方法，例如 pbkdf2:sha256:260000')
+    parser.add_argument('--inline', action='store_true', help='在請求執行緒中雜湊並同步寫入最後登入時間')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = build_app(os.path.join(directory, 'bench.db'), method=args.method, inline=args.inline)
+        hasher = app.extensions.get('password_hasher')
+        print("\n=== 登入吞吐量基準測試 ===")
+        print(f"模式: {'請求執行緒' if args.inline else f'雜湊執行緒池（{hasher.workers} 個執行緒）'}")
+        print(f"雜湊方法: {hasher.method if hasher else '預設'}")
+        print(f"執行緒數: {args.threads}")
+        print(f"CPU 核心數: {os.cpu_count()}")
+
+        run(app, 1, 1)  # 預熱
+        result = run(app, args.threads, args.duration)
+
+        logins = result['logins']
+        print(f"登入數: {logins}（失敗 {result['failures']}）")
+        print(f"每秒登入數: {logins / result['elapsed']:.1f}")
+        if result['cpu_time'] > 0:
+            print(f"每核心每秒登入數: {logins / result['cpu_time']:.1f}")
+        print("=====================\n")
+
+        # 暫存資料庫刪除前寫入累積的最後登入時間，結束時的 atexit 寫入即無資料可寫
+        recorder = app.extensions.get('login_recorder')
+        if recorder is not None:
+            with app.app_context():
+                recorder.flush()
+                db.session.remove()
+                db.engine.dispose()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+"""
+瑕疵圖片預先下載腳本
+"""
+import sys
+from pathlib import Path
+
+# 添加專案根目錄到 Python 路徑
+root_dir = Path(__file__).parent.parent
+sys.path.append(str(root_dir))
+
+from app import app
+from utils.prefetch import prefetch_images
+from utils.timeutil import parse_time
+
+def main(since: str = None):
+    """預先下載新瑕疵的原圖與縮圖到圖片磁碟快取
+    
+    Args:
+        since: 起始的拍攝時間（ISO 8601），預設為上次的高水位標記
+    """
+    with app.app_context():
+        print(f"正在預先下載 {since} 之後的瑕疵圖片..." if since else "正在預先下載新瑕疵的圖片...")
+        result = prefetch_images(since=parse_time(since))
+        print(f"下載完成，本次處理 {result['defects']} 筆，失敗 {result['failed']} 筆")
+        print(f"高水位標記: {result['high_water_mark']}")
+
+if __name__ == '__main__':
+    # 解析命令列參數
+    since = None
+    if '--since' in sys.argv:
+        since = sys.argv[sys.argv.index('--since') + 1]
+    main(since)
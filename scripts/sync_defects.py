@@ -0,0 +1,38 @@
+"""
+瑕疵資料本地副本同步腳本
+"""
+import sys
+from pathlib import Path
+
+# 添加專案根目錄到 Python 路徑
+root_dir = Path(__file__).parent.parent
+sys.path.append(str(root_dir))
+
+from app import app
+from utils.replica import replica_lock, sync_defects
+from utils.rollups import rebuild_rollups
+
+def main(full: bool = False, rebuild: bool = False):
+    """從上游同步瑕疵資料到本地副本
+    
+    Args:
+        full: 是否忽略高水位標記進行完整同步（並移除上游已刪除的記錄）
+        rebuild: 是否以本地副本重建每日彙總
+    """
+    with app.app_context():
+        print("正在完整同步瑕疵資料..." if full else "正在增量同步瑕疵資料...")
+        state = sync_defects(full=full)
+        print(f"同步完成，本次處理 {state['last_count']} 筆")
+        print(f"高水位標記: {state['high_water_mark']}")
+
+        if rebuild:
+            print("正在重建每日彙總...")
+            with replica_lock():
+                count = rebuild_rollups()
+            print(f"重建完成，共 {count} 筆彙總")
+
+if __name__ == '__main__':
+    # 解析命令列參數
+    full = '--full' in sys.argv
+    rebuild = '--rebuild-rollups' in sys.argv
+    main(full, rebuild)
@@ -2,6 +2,7 @@ let map;
 // 初始化變數和快取
 let markers = new Map();
 let markerClusterGroup;
+let serverClusterLayer;
 let isMapVisible = true;
 let userLocationMarker = null;
 let userLocationCircle = null;
@@ -350,6 +351,9 @@ async function initMap() {
         });
 
         map.addLayer(markerClusterGroup);
+
+        // 伺服器端聚合的群集圖層
+        serverClusterLayer = L.layerGroup().addTo(map);
         
         // 初始化地圖控制
         initMapControls();
@@ -359,14 +363,28 @@ async function initMap() {
 
         updateLoadingProgress(80);
 
-        // 載入初始資料
+        // 載入初始資料：頁面只嵌入搜尋結果的範圍，視窗內的瑕疵依地圖範圍載入
         const mapDataElement = document.getElementById('map-data');
         if (mapDataElement && mapDataElement.textContent) {
             try {
                 updateLoadingProgress(85);
                 const mapData = JSON.parse(mapDataElement.textContent);
                 updateLoadingProgress(90);
-                await updateMapMarkers(mapData);
+                if (Array.isArray(mapData)) {
+                    await updateMapMarkers(mapData);
+                } else {
+                    if (mapData.bounds) {
+                        const [minLon, minLat, maxLon, maxLat] = mapData.bounds;
+                        map.fitBounds([[minLat, minLon], [maxLat, maxLon]], {
+                            padding: [50, 50],
+                            maxZoom: 16
+                        });
+                    }
+                    if (mapData.total > 0) {
+                        await loadViewportDefects();
+                        map.on('moveend', scheduleViewportLoad);
+                    }
+                }
                 updateLoadingProgress(95);
             } catch (error) {
                 console.error('解析地圖資料時出錯:', error);
@@ -446,6 +464,51 @@ function createClusterIcon(cluster) {
     });
 }
 
+// 創建伺服器端聚合的群集圖標
+function createServerClusterIcon(cluster) {
+    // 使用群集內最高嚴重程度的顏色
+    let maxSeverity = 0;
+    cluster.by_severity.forEach((count, severity) => {
+        if (count > 0) maxSeverity = severity;
+    });
+
+    const color = severityColors[maxSeverity];
+    let size = 'small';
+
+    if (cluster.count > 50) size = 'large';
+    else if (cluster.count > 20) size = 'medium';
+
+    return L.divIcon({
+        html: `<div style="background-color: ${color};">
+                 <span>${cluster.count}</span>
+               </div>`,
+        className: `marker-cluster marker-cluster-${size}`,
+        iconSize: L.point(40, 40)
+    });
+}
+
+// 更新伺服器端聚合的群集
+function updateServerClusters(clusters) {
+    serverClusterLayer.clearLayers();
+    clusters.forEach(cluster => {
+        const marker = L.marker([cluster.latitude, cluster.longitude], {
+            icon: createServerClusterIcon(cluster)
+        });
+        marker.bindTooltip(Object.entries(severityNames)
+            .map(([value, name]) => `${name}：${cluster.by_severity[value] || 0}`)
+            .join('<br>'));
+        // 點擊後放大到群集範圍
+        marker.on('click', () => {
+            const [minLon, minLat, maxLon, maxLat] = cluster.bounds;
+            map.fitBounds([[minLat, minLon], [maxLat, maxLon]], {
+                padding: [50, 50],
+                maxZoom: 18
+            });
+        });
+        serverClusterLayer.addLayer(marker);
+    });
+}
+
 // 添加圖例
 function addLegend() {
     const legend = L.control({ position: 'bottomright' });
@@ -589,16 +652,34 @@ function createCustomIcon(defectType, severity = 1) { // 預設為中等嚴重
 }
 
 // 更新地圖上的瑕疵標記
-async function updateMapMarkers(defects) {
+async function updateMapMarkers(defects, options = {}) {
+    // replace：清除全部標記後重建；false 時只增減差異，保留已開啟的彈出視窗
+    // fitBounds：調整地圖視圖以顯示所有標記
+    const { replace = true, fitBounds = true } = options;
+
     // 確保 defects 是一個有效的陣列
     if (!Array.isArray(defects)) {
         console.error('更新地圖標記時接收到無效的資料:', defects);
         return;
     }
 
-    // 清除現有的標記
-    markerClusterGroup.clearLayers();
-    markers.clear();
+    if (replace) {
+        // 清除現有的標記
+        markerClusterGroup.clearLayers();
+        markers.clear();
+    } else {
+        // 移除不在新資料中的標記
+        const ids = new Set(defects.map(defect => defect && defect.id));
+        const stale = [];
+        markers.forEach((marker, id) => {
+            if (!ids.has(id)) {
+                stale.push(marker);
+                markers.delete(id);
+            }
+        });
+        markerClusterGroup.removeLayers(stale);
+        defects = defects.filter(defect => defect && !markers.has(defect.id));
+    }
 
     // 如果沒有資料，提前返回
     if (defects.length === 0) {
@@ -664,11 +745,12 @@ async function updateMapMarkers(defects) {
                             <p><strong>報告時間：</strong>${defect.capture_time ? new Date(defect.capture_time).toLocaleString('zh-TW') : '未知'}</p>
                             ${defect.has_image ? `
                                 <div class="popup-image-container">
-                                    <img src="data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7"
-                                         data-src="/proxy-image/${defect.id}"
+                                    <img src="${defect.image_placeholder || 'data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7'}"
+                                         data-src="/proxy-image/${defect.id}?w=400"
+                                         data-full-src="/proxy-image/${defect.id}"
                                          alt="瑕疵圖片" 
-                                         class="popup-image lazy"
-                                         onclick="showImagePreview(this.dataset.src)">
+                                         class="popup-image lazy${defect.image_placeholder ? ' has-placeholder' : ''}"
+                                         onclick="showImagePreview(this.dataset.fullSrc || this.dataset.src)">
                                 </div>
                             ` : ''}
                             <div class="mt-2">
@@ -716,7 +798,7 @@ async function updateMapMarkers(defects) {
     }
 
     // 調整地圖視圖以顯示所有標記
-    if (markers.size > 0) {
+    if (fitBounds && markers.size > 0) {
         try {
             const bounds = markerClusterGroup.getBounds();
             map.fitBounds(bounds, {
@@ -729,12 +811,81 @@ async function updateMapMarkers(defects) {
     }
 }
 
+// 地圖視窗範圍內瑕疵的載入狀態
+let viewportRequest = null;
+let viewportTimer = null;
+let pendingHighlightId = null;
+
+// 依目前的地圖範圍與搜尋條件載入瑕疵（縮小時由伺服器聚合為群集）
+async function loadViewportDefects() {
+    if (!map) return;
+
+    const basePath = window.BASE_PATH || '';
+    const params = new URLSearchParams(window.location.search);
+    params.set('bbox', map.getBounds().toBBoxString());
+    params.set('zoom', map.getZoom());
+
+    // 取消尚未完成的前一次請求
+    if (viewportRequest) {
+        viewportRequest.abort();
+    }
+    const controller = new AbortController();
+    viewportRequest = controller;
+
+    try {
+        const response = await fetch(`${basePath}/api/road-defects/clusters?${params.toString()}`, {
+            credentials: 'include',
+            signal: controller.signal
+        });
+        if (!response.ok) {
+            throw new Error(`API 請求失敗: ${response.status}`);
+        }
+        const result = await response.json();
+        if (result.status !== 'success') {
+            throw new Error(result.message || '無法載入地圖資料');
+        }
+
+        updateServerClusters(result.data.clusters);
+        await updateMapMarkers(result.data.defects, { replace: false, fitBounds: false });
+
+        // 從列表點選的瑕疵在載入後開啟彈出視窗
+        if (pendingHighlightId !== null && markers.has(pendingHighlightId)) {
+            markers.get(pendingHighlightId).openPopup();
+            pendingHighlightId = null;
+        }
+    } catch (error) {
+        if (error.name !== 'AbortError') {
+            console.error('載入地圖範圍內的瑕疵時發生錯誤:', error);
+        }
+    } finally {
+        if (viewportRequest === controller) {
+            viewportRequest = null;
+        }
+    }
+}
+
+// 地圖移動結束後延遲載入，避免連續拖曳時重複請求
+function scheduleViewportLoad() {
+    if (viewportTimer) {
+        clearTimeout(viewportTimer);
+    }
+    viewportTimer = setTimeout(loadViewportDefects, 300);
+}
+
 // 高亮顯示特定瑕疵的標記
 function highlightMarker(defectId) {
     const marker = markers.get(defectId);
     if (marker) {
         map.setView(marker.getLatLng(), 18);
         marker.openPopup();
+        return;
+    }
+
+    // 標記不在目前的視窗範圍內：移動到列表中記錄的座標，載入後再開啟
+    const element = document.querySelector(`.defect-image-container[data-defect-id="${defectId}"]`);
+    if (element && element.dataset.latitude && element.dataset.longitude) {
+        pendingHighlightId = defectId;
+        map.setView([parseFloat(element.dataset.latitude), parseFloat(element.dataset.longitude)], 18);
     }
 }
 
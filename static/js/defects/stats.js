@@ -2,6 +2,9 @@
 let severityChart = null;
 let defectTypeChart = null;
 
+// 瑕疵列表每頁筆數（其餘資料以游標分頁載入）
+const STATS_PAGE_SIZE = 100;
+
 // 初始化圖表
 function initCharts() {
     const severityCtx = document.getElementById('severityChart').getContext('2d');
@@ -166,15 +169,19 @@ async function fetchStatsData(params = {}) {
         const statsUrl = `/api/road-defects/stats?${searchParams.toString()}`;
         console.log('發送統計請求到:', statsUrl);
 
-        // 發送瑕疵列表請求
-        const listUrl = `/api/road-defects/list?${searchParams.toString()}`;
+        // 發送瑕疵列表請求（只取第一頁，其餘由「載入更多」依游標載入）
+        const listUrl = `/api/road-defects/list?${searchParams.toString()}&limit=${STATS_PAGE_SIZE}`;
         console.log('發送列表請求到:', listUrl);
 
+        // 發送熱點網格請求（伺服器端聚合，只返回非空網格）
+        const heatmapUrl = `/api/road-defects/heatmap?${searchParams.toString()}`;
+
         try {
-            // 同時發送兩個請求
-            const [statsResponse, listResponse] = await Promise.all([
+            // 同時發送三個請求
+            const [statsResponse, listResponse, heatmapResponse] = await Promise.all([
                 fetch(statsUrl),
-                fetch(listUrl)
+                fetch(listUrl),
+                fetch(heatmapUrl)
             ]);
 
             if (!statsResponse.ok || !listResponse.ok) {
@@ -185,6 +192,8 @@ async function fetchStatsData(params = {}) {
                 statsResponse.json(),
                 listResponse.json()
             ]);
+            // 熱點網格失敗時不影響其他統計
+            const heatmapResult = heatmapResponse.ok ? await heatmapResponse.json() : null;
 
             console.log('收到的統計數據:', statsResult);
             console.log('收到的列表數據:', listResult);
@@ -240,6 +249,7 @@ async function fetchStatsData(params = {}) {
                                 </div>
                             </div>
                         </div>
+                        ${renderHotspots(heatmapResult)}
                         <div class="table-container mb-4" style="max-height: 300px; margin-bottom: 10px;">
                             <div class="table-responsive" style="height: auto; max-height: 300px; overflow-y: auto;">
 
@@ -258,26 +268,20 @@ async function fetchStatsData(params = {}) {
                                             <th style="position: sticky; top: 0; background: white; z-index: 1;">行政區</th>
                                         </tr>
                                     </thead>
-                                    <tbody>
-                                        ${listResult.data.defects.map(defect => `
-                                            <tr>
-                                                <td>${defect.id}</td>
-                                                <td>${getDefectTypeName(defect.defect_type.value)}</td>
-                                                <td>${getSeverityName(defect.severity.value)}</td>
-                                                <td>${defect.latitude.toFixed(4)}</td>
-                                                <td>${defect.longitude.toFixed(4)}</td>
-                                                <td>${new Date(defect.capture_time).toLocaleString()}</td>
-                                                <td>${defect.device_id}</td>
-                                                <td>${defect.city}</td>
-                                                <td>${defect.district}</td>
-                                            </tr>
-                                        `).join('')}
+                                    <tbody id="statsDefectRows">
+                                        ${renderDefectRows(listResult.data.defects)}
                                     </tbody>
                                 </table>
                             </div>
                         </div>
+                        <div class="d-flex align-items-center mb-4">
+                            <span id="statsDefectCount" class="me-3"></span>
+                            <button type="button" id="statsLoadMore" class="btn btn-outline-secondary btn-sm">載入更多</button>
+                        </div>
                     `;
                     defectList.innerHTML = summaryHtml;
+                    setupLoadMore(listUrl, listResult.data.defects.length,
+                                  listResponse.headers.get('X-Total-Count'), listResult.data.next_cursor);
                 }
             } else {
                 console.error('數據格式無效:', statsResult);
@@ -299,6 +303,91 @@ async function fetchStatsData(params = {}) {
     }
 }
 
+// 產生瑕疵列表的表格列
+function renderDefectRows(defects) {
+    return defects.map(defect => `
+        <tr>
+            <td>${defect.id}</td>
+            <td>${getDefectTypeName(defect.defect_type.value)}</td>
+            <td>${getSeverityName(defect.severity.value)}</td>
+            <td>${defect.latitude.toFixed(4)}</td>
+            <td>${defect.longitude.toFixed(4)}</td>
+            <td>${new Date(defect.capture_time).toLocaleString()}</td>
+            <td>${defect.device_id}</td>
+            <td>${defect.city}</td>
+            <td>${defect.district}</td>
+        </tr>
+    `).join('');
+}
+
+// 依游標載入下一頁瑕疵並附加到列表
+function setupLoadMore(listUrl, loaded, total, nextCursor) {
+    const button = document.getElementById('statsLoadMore');
+    const counter = document.getElementById('statsDefectCount');
+    let cursor = nextCursor;
+
+    const update = () => {
+        counter.textContent = total ? `已顯示 ${loaded} / ${total} 筆` : `已顯示 ${loaded} 筆`;
+        button.style.display = cursor ? '' : 'none';
+    };
+    update();
+
+    button.addEventListener('click', async () => {
+        button.disabled = true;
+        try {
+            const response = await fetch(`${listUrl}&cursor=${encodeURIComponent(cursor)}`);
+            if (!response.ok) {
+                throw new Error(`HTTP error! list: ${response.status}`);
+            }
+            const result = await response.json();
+            document.getElementById('statsDefectRows')
+                .insertAdjacentHTML('beforeend', renderDefectRows(result.data.defects));
+            loaded += result.data.defects.length;
+            cursor = result.data.next_cursor;
+            update();
+        } catch (error) {
+            console.error('載入更多瑕疵失敗:', error);
+            alert('載入更多瑕疵失敗: ' + error.message);
+        } finally {
+            button.disabled = false;
+        }
+    });
+}
+
+// 顯示嚴重程度加權分數最高的網格
+function renderHotspots(heatmapResult, limit = 5) {
+    if (!heatmapResult || heatmapResult.status !== 'success' || heatmapResult.data.cells.length === 0) {
+        return '';
+    }
+    const heatmap = heatmapResult.data;
+    const hotspots = [...heatmap.cells].sort((a, b) => b[3] - a[3] || b[2] - a[2]).slice(0, limit);
+    return `
+        <div class="stats-hotspots mb-4">
+            <h6>熱點區域（網格 ${heatmap.cell_size}°）</h6>
+            <table class="table table-sm">
+                <thead>
+                    <tr>
+                        <th>緯度</th>
+                        <th>經度</th>
+                        <th>瑕疵數量</th>
+                        <th>加權分數</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    ${hotspots.map(([latitude, longitude, count, score]) => `
+                        <tr>
+                            <td>${latitude.toFixed(4)}</td>
+                            <td>${longitude.toFixed(4)}</td>
+                            <td>${count}</td>
+                            <td>${score}</td>
+                        </tr>
+                    `).join('')}
+                </tbody>
+            </table>
+        </div>
+    `;
+}
+
 // 當文檔載入完成時
 document.addEventListener('DOMContentLoaded', async () => {
     // 初始化圖表
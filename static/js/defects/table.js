@@ -7,7 +7,7 @@ if (typeof window.imageCache === 'undefined') {
 
 // 初始化 Intersection Observer
 document.addEventListener('DOMContentLoaded', () => {
-    const imageObserver = new IntersectionObserver((entries, observer) => {
+    const imageObserver = window.imageObserver = new IntersectionObserver((entries, observer) => {
         entries.forEach(entry => {
             if (entry.isIntersecting) {
                 const img = entry.target;
@@ -28,6 +28,7 @@ document.addEventListener('DOMContentLoaded', () => {
     // 觀察所有懶加載圖片
     document.querySelectorAll('img.lazy').forEach(img => {
         if (img) {
+            img.classList.add('observed');
             imageObserver.observe(img);
         }
     });
@@ -107,6 +108,133 @@ async function loadImage(img) {
 // 將函數導出到全局窗口對象以便與 home.js 共享
 window.loadImage = loadImage;
 
+// 跳脫 HTML 特殊字元
+function escapeHtml(value) {
+    return String(value ?? '').replace(/[&<>"']/g, char => ({
+        '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+    })[char]);
+}
+
+const DEFECT_TYPE_ICONS = ['fas fa-grip-lines', 'fas fa-grip-lines-vertical', 'fas fa-border-all', 'far fa-circle'];
+const SEVERITY_COLORS = ['#4CAF50', '#FFC107', '#F44336'];
+const BLANK_IMAGE = 'data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7';
+
+// 產生單一瑕疵項目（與 templates/defects/_table.html 相同的結構）
+function renderDefectItem(defect) {
+    const id = Number(defect.id);
+    const typeName = escapeHtml(defect.defect_type && defect.defect_type.name);
+    const severity = defect.severity || {};
+    let image;
+    if (defect.has_image) {
+        const placeholder = defect.image_placeholder;
+        image = `
+            ${placeholder ? '' : `
+            <div class="image-placeholder">
+                <div class="spinner-border spinner-border-sm text-primary" role="status">
+                    <span class="visually-hidden">載入中...</span>
+                </div>
+            </div>`}
+            <img src="${escapeHtml(placeholder || BLANK_IMAGE)}"
+                 data-src="/proxy-image/${id}?w=200"
+                 data-full-src="/proxy-image/${id}"
+                 data-defect-id="${id}"
+                 class="defect-image lazy${placeholder ? ' has-placeholder' : ''}"
+                 alt="${typeName}"
+                 loading="lazy"
+                 onclick="showImagePreview(this.dataset.fullSrc || this.dataset.src)">`;
+    } else {
+        image = `
+            <div class="no-image" data-defect-id="${id}">
+                <i class="bi bi-image"></i>
+                <span>無圖片</span>
+            </div>`;
+    }
+    const captureTime = new Date(defect.capture_time).toLocaleString('zh-TW', {
+        year: 'numeric', month: '2-digit', day: '2-digit', hour: '2-digit', minute: '2-digit', hour12: false
+    });
+    return `
+        <div class="defect-item">
+            <div class="defect-image-container" data-defect-id="${id}" data-latitude="${escapeHtml(defect.latitude)}" data-longitude="${escapeHtml(defect.longitude)}">
+                ${image}
+            </div>
+            <div class="defect-info">
+                <div class="defect-header">
+                    <div class="defect-type">
+                        <i class="${DEFECT_TYPE_ICONS[defect.defect_type && defect.defect_type.value] || 'fas fa-question-circle'}"></i>
+                        ${typeName}
+                    </div>
+                    <div class="defect-id">#${id}</div>
+                </div>
+                <div class="defect-severity">
+                    <i class="fas fa-exclamation-triangle" style="color: #FFD700;"></i>
+                    <span>嚴重程度：<span style="color: #333;">${escapeHtml(severity.name)}</span><span class="severity-dot" style="background-color: ${SEVERITY_COLORS[severity.value] || '#F44336'};"></span></span>
+                </div>
+                <div class="defect-location">
+                    <i class="bi bi-geo-alt"></i>
+                    ${escapeHtml(defect.city)} ${escapeHtml(defect.district)} ${escapeHtml(defect.road_section)}
+                </div>
+                <div class="defect-footer">
+                    <div class="defect-time">
+                        <i class="bi bi-clock"></i>
+                        ${captureTime}
+                    </div>
+                    <button class="btn btn-sm btn-info" onclick="">
+                        <i class="bi bi-eye"></i> 詳情
+                    </button>
+                </div>
+                <div class="defect-actions" style="display: none;">
+                    <button class="btn btn-sm btn-warning" onclick="editDefect(${id})">
+                        <i class="bi bi-pencil"></i> 編輯
+                    </button>
+                    <button class="btn btn-sm btn-success" onclick="updateStatus(${id})">
+                        <i class="bi bi-check2"></i> 更新
+                    </button>
+                </div>
+            </div>
+        </div>
+    `;
+}
+
+// 依游標載入下一頁瑕疵並附加到列表（查詢條件與目前頁面相同）
+async function loadMoreDefects(button) {
+    const params = new URLSearchParams(window.location.search);
+    params.set('limit', button.dataset.pageSize);
+    params.set('cursor', button.dataset.nextCursor);
+
+    button.disabled = true;
+    try {
+        const response = await fetch(`/api/road-defects/list?${params.toString()}`);
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const result = await response.json();
+        const list = document.querySelector('.defect-list');
+        const defects = result.data.defects;
+        list.insertAdjacentHTML('beforeend', defects.map(renderDefectItem).join(''));
+        if (window.imageObserver) {
+            list.querySelectorAll('img.lazy:not(.observed)').forEach(img => {
+                img.classList.add('observed');
+                window.imageObserver.observe(img);
+            });
+        }
+
+        const loaded = Number(button.dataset.loaded) + defects.length;
+        button.dataset.loaded = loaded;
+        const container = button.closest('.defect-list-more');
+        container.querySelector('.defect-list-count').textContent = `已顯示 ${loaded} / ${button.dataset.total} 筆`;
+        if (result.data.next_cursor) {
+            button.dataset.nextCursor = result.data.next_cursor;
+        } else {
+            button.style.display = 'none';
+        }
+    } catch (error) {
+        console.error('載入更多瑕疵失敗:', error);
+        alert('載入更多瑕疵失敗: ' + error.message);
+    } finally {
+        button.disabled = false;
+    }
+}
+
 // 重新整理列表
 function refreshList() {
     // 清除圖片緩存
@@ -0,0 +1,62 @@
+"""
+測試共用設定
+"""
+import sys
+from pathlib import Path
+
+import pytest
+from flask import Flask
+
+# 添加專案根目錄到 Python 路徑
+root_dir = Path(__file__).parent.parent
+sys.path.append(str(root_dir))
+
+
+class FakeClock:
+    """取代模組中的 time 模組，手動推進時間"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(request, monkeypatch):
+    """以 FakeClock 取代指定模組的 time
+
+    模組名稱以間接參數傳入（parametrize(..., indirect=True)），
+    未指定時使用測試模組的 CLOCK_MODULE。
+    """
+    module = getattr(request, 'param', None) or request.module.CLOCK_MODULE
+    clock = FakeClock()
+    monkeypatch.setattr(f'{module}.time', clock)
+    return clock
+
+
+@pytest.fixture
+def app(tmp_path):
+    """不載入 config.json 與背景工作的最小應用程式（已推入應用程式上下文）"""
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config['TESTING'] = True
+    app.config['CURRENT_CONFIG'] = {}
+    with app.app_context():
+        yield app
+
+
+@pytest.fixture
+def database(app):
+    """在暫存的 SQLite 資料庫中建立所有資料表"""
+    from config.database import db, init_db
+    import models.defect  # noqa: F401  註冊資料表
+    import models.user  # noqa: F401
+
+    app.config['CURRENT_CONFIG']['database'] = {'url': 'sqlite:///test.db', 'echo': False}
+    init_db(app)
+    yield db
+    db.session.remove()
+    db.engine.dispose()
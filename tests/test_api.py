@@ -0,0 +1,40 @@
+"""
+同步上游 API 客戶端的快取行為
+"""
+import pytest
+from utils import api
+from utils.cache import MemoryCacheBackend, ResponseCache
+
+
+@pytest.fixture
+def upstream(app, monkeypatch):
+    """以計數的假請求取代實際發送，並啟用響應快取"""
+    app.extensions['road_defect_cache'] = ResponseCache(MemoryCacheBackend(), ttls={'road-defects': 30})
+    app.extensions['road_defect_single_flight'] = None
+    calls = []
+
+    def send_request(client, endpoint, method, params, data, stream, cache=None):
+        calls.append(params)
+        payload = {'data': [{'id': len(calls)}]}
+        if cache is not None:
+            cache.set(endpoint, params, payload)
+        return {'success': True, 'data': payload}
+
+    monkeypatch.setattr(api, '_send_request', send_request)
+    return calls
+
+
+def test_cached_reads_skip_the_upstream(upstream):
+    first = api.call_road_defect_api('road-defects', params={'city': '台北市'})
+    second = api.call_road_defect_api('road-defects', params={'city': '台北市'})
+    assert first == second
+    assert len(upstream) == 1
+
+
+def test_use_cache_false_always_reaches_the_upstream(app, upstream):
+    api.call_road_defect_api('road-defects')
+    fresh = api.call_road_defect_api('road-defects', use_cache=False)
+    assert fresh['data'] == {'data': [{'id': 2}]}
+    assert len(upstream) == 2
+    # 直接請求的結果不寫入快取
+    assert app.extensions['road_defect_cache'].get('road-defects') == {'data': [{'id': 1}]}
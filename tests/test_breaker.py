@@ -0,0 +1,162 @@
+"""
+上游斷路器與自適應並行上限
+"""
+import pytest
+from utils.breaker import (
+    CLOSED, HALF_OPEN, OPEN, AdaptiveConcurrencyLimiter, CircuitBreaker, UpstreamGuard, UpstreamUnavailable,
+    endpoint_key
+)
+
+# clock fixture 以 FakeClock 取代此模組中的 time
+CLOCK_MODULE = 'utils.breaker'
+
+
+def make_breaker(**overrides):
+    options = dict(window=30, minimum_calls=4, failure_rate=0.5, slow_call_duration=3,
+                   slow_call_rate=0.8, open_duration=15, half_open_calls=2)
+    options.update(overrides)
+    return CircuitBreaker(**options)
+
+
+def test_endpoint_key_collapses_numeric_ids():
+    assert endpoint_key('/road-defects/123') == 'road-defects/*'
+    assert endpoint_key('road-defects/123/image/') == 'road-defects/*/image'
+    assert endpoint_key('road-defects/stats') == 'road-defects/stats'
+
+
+class TestCircuitBreaker:
+    def test_stays_closed_below_minimum_calls(self, clock):
+        breaker = make_breaker()
+        for _ in range(3):
+            breaker.record(False, 0.1)
+        assert breaker.state == CLOSED
+
+    def test_opens_on_failure_rate(self, clock):
+        breaker = make_breaker()
+        for success in (True, False, True, False):
+            breaker.record(success, 0.1)
+        assert breaker.state == OPEN
+        assert not breaker.allow()
+        assert breaker.stats()['rejected'] == 1
+
+    def test_opens_on_slow_call_rate(self, clock):
+        breaker = make_breaker()
+        for _ in range(4):
+            breaker.record(True, 5)
+        assert breaker.state == OPEN
+
+    def test_old_calls_leave_the_window(self, clock):
+        breaker = make_breaker()
+        for _ in range(3):
+            breaker.record(False, 0.1)
+        clock.now += 31
+        breaker.record(False, 0.1)
+        assert breaker.state == CLOSED
+        assert breaker.stats()['calls'] == 1
+
+    def test_half_open_probes_close_the_breaker(self, clock):
+        breaker = make_breaker()
+        breaker._open(clock.now)
+        clock.now += 15
+        assert breaker.allow()
+        assert breaker.state == HALF_OPEN
+        assert breaker.allow()
+        assert not breaker.allow()  # 探測名額已用完
+        breaker.record(True, 0.1)
+        assert breaker.state == HALF_OPEN
+        breaker.record(True, 0.1)
+        assert breaker.state == CLOSED
+        assert breaker.allow()
+
+    def test_failed_probe_reopens(self, clock):
+        breaker = make_breaker()
+        breaker._open(clock.now)
+        clock.now += 15
+        assert breaker.allow()
+        breaker.record(False, 0.1)
+        assert breaker.state == OPEN
+        assert breaker.opened_at == clock.now
+        assert not breaker.allow()
+
+    def test_cancel_returns_the_probe(self, clock):
+        breaker = make_breaker(half_open_calls=1)
+        breaker._open(clock.now)
+        clock.now += 15
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.cancel()
+        assert breaker.allow()
+
+
+class TestAdaptiveConcurrencyLimiter:
+    def test_limits_inflight_requests(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, queue_timeout=0)
+        assert limiter.acquire()
+        assert limiter.try_acquire()
+        assert not limiter.try_acquire()
+        assert not limiter.acquire()
+        assert limiter.stats() == {'limit': 2, 'inflight': 2, 'rejected': 1}
+
+    def test_additive_increase_when_saturated(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=5, latency_target=1)
+        for _ in range(4):
+            limiter.acquire()
+        limiter.release(True, 0.1)
+        assert limiter.limit == pytest.approx(4.25)
+        assert limiter.inflight == 3
+
+    def test_no_increase_while_idle(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=4, latency_target=1)
+        limiter.acquire()
+        limiter.release(True, 0.1)
+        assert limiter.limit == 4
+
+    def test_multiplicative_decrease_on_failure_or_slow_call(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=10, latency_target=1, backoff_ratio=0.5)
+        limiter.acquire()
+        limiter.release(False, 0.1)
+        assert limiter.limit == 5
+        limiter.acquire()
+        limiter.release(True, 2)
+        assert limiter.limit == 2.5
+
+    def test_limit_stays_within_bounds(self):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, min_limit=1, max_limit=3, backoff_ratio=0.1)
+        limiter.acquire()
+        limiter.release(False, 0.1)
+        assert limiter.limit == 1
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=3, max_limit=3)
+        for _ in range(3):
+            limiter.acquire()
+        limiter.release(True, 0.1)
+        assert limiter.limit == 3
+
+
+class TestUpstreamGuard:
+    def test_open_breaker_rejects_without_taking_a_slot(self, clock):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1, queue_timeout=0)
+        guard = UpstreamGuard(breaker_config={'minimum_calls': 1}, limiter=limiter)
+        guard.breaker_for('road-defects/1')._open(clock.now)
+        with pytest.raises(UpstreamUnavailable):
+            guard.acquire('road-defects/2')
+        assert limiter.inflight == 0
+
+    def test_release_records_the_result(self, clock):
+        guard = UpstreamGuard(breaker_config={'minimum_calls': 1}, limiter=AdaptiveConcurrencyLimiter(initial_limit=1))
+        permit = guard.acquire('road-defects')
+        clock.now += 0.5
+        permit.release(False)
+        assert guard.breaker_for('road-defects').state == OPEN
+        assert guard.limiter.inflight == 0
+
+    def test_full_limiter_returns_the_half_open_probe(self, clock):
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=1, queue_timeout=0)
+        guard = UpstreamGuard(breaker_config={'half_open_calls': 1, 'open_duration': 15}, limiter=limiter)
+        breaker = guard.breaker_for('road-defects')
+        breaker._open(clock.now)
+        clock.now += 15
+        limiter.acquire()
+        with pytest.raises(UpstreamUnavailable):
+            guard.acquire('road-defects')
+        assert breaker.state == HALF_OPEN
+        assert breaker._probes == 0
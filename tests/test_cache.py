@@ -0,0 +1,102 @@
+"""
+上游 API 響應快取
+"""
+import pytest
+from utils.cache import MemoryCacheBackend, ResponseCache, SQLiteCacheBackend, make_cache_key
+
+# clock fixture 以 FakeClock 取代此模組中的 time
+CLOCK_MODULE = 'utils.cache'
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def backend(request, tmp_path, clock):
+    if request.param == 'sqlite':
+        return SQLiteCacheBackend(str(tmp_path / 'api_cache.db'))
+    return MemoryCacheBackend()
+
+
+class TestMakeCacheKey:
+    def test_param_order_does_not_matter(self):
+        assert make_cache_key('road-defects', {'city': '台北市', 'severity': 2}) == \
+            make_cache_key('road-defects', {'severity': 2, 'city': '台北市'})
+
+    def test_list_order_does_not_matter(self):
+        assert make_cache_key('road-defects', {'severity': [3, 1, 2]}) == \
+            make_cache_key('road-defects', {'severity': (1, 2, 3)})
+
+    def test_none_params_are_dropped(self):
+        assert make_cache_key('road-defects', {'city': None}) == make_cache_key('road-defects')
+
+    def test_endpoint_slashes_are_ignored(self):
+        assert make_cache_key('/road-defects/', {}) == make_cache_key('road-defects', None)
+
+    def test_different_values_differ(self):
+        assert make_cache_key('road-defects', {'severity': [1]}) != make_cache_key('road-defects', {'severity': [2]})
+        assert make_cache_key('road-defects', {'severity': 1}) != make_cache_key('road-defects/stats', {'severity': 1})
+
+
+class TestBackends:
+    def test_expired_entries_are_dropped(self, backend, clock):
+        backend.set('key', b'value', ttl=10)
+        assert backend.get('key') == b'value'
+        clock.now += 11
+        assert backend.get('key') is None
+        assert backend.size()['entries'] == 0
+
+    def test_least_recently_used_entries_are_evicted(self, backend, clock):
+        backend.max_bytes = 10
+        backend.set('a', b'aaaa', ttl=60)
+        clock.now += 1
+        backend.set('b', b'bbbb', ttl=60)
+        clock.now += 1
+        assert backend.get('a') == b'aaaa'
+        clock.now += 1
+        backend.set('c', b'cccc', ttl=60)
+        assert backend.get('b') is None
+        assert backend.get('a') == b'aaaa'
+        assert backend.get('c') == b'cccc'
+        assert backend.size()['bytes'] == 8
+
+    def test_values_larger_than_the_limit_are_not_stored(self, backend):
+        backend.max_bytes = 4
+        backend.set('a', b'too large', ttl=60)
+        assert backend.get('a') is None
+
+
+class TestResponseCache:
+    def test_ttl_is_chosen_per_endpoint(self):
+        cache = ResponseCache(MemoryCacheBackend(), ttls={'road-defects': 30, 'road-defects/*': 300})
+        assert cache.ttl_for('/road-defects') == 30
+        assert cache.ttl_for('road-defects/stats') == 300
+        assert cache.ttl_for('locations/cities') == 0
+
+    def test_uncached_endpoints_are_not_stored(self, clock):
+        cache = ResponseCache(MemoryCacheBackend(), ttls={'road-defects': 30})
+        cache.set('locations/cities', None, {'data': []})
+        assert cache.get('locations/cities') is None
+        assert cache.stats()['stores'] == 0
+
+    def test_hit_until_ttl_expires(self, clock):
+        cache = ResponseCache(MemoryCacheBackend(), ttls={'road-defects': 30})
+        cache.set('road-defects', {'severity': [2, 1]}, {'data': [1]})
+        assert cache.get('road-defects', {'severity': [1, 2]}) == {'data': [1]}
+        clock.now += 31
+        assert cache.get('road-defects', {'severity': [1, 2]}) is None
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'], stats['stores']) == (1, 1, 1)
+
+    def test_stale_entries_are_kept_for_stale_ttl(self, clock):
+        cache = ResponseCache(MemoryCacheBackend(), ttls={'road-defects': 30}, stale_ttl=60)
+        cache.set('road-defects', None, {'data': [1]})
+        clock.now += 45
+        assert cache.get('road-defects') is None
+        assert cache.get_stale('road-defects') == {'data': [1]}
+        clock.now += 46
+        assert cache.get_stale('road-defects') is None
+        assert cache.stats()['stale_hits'] == 1
+
+    def test_without_stale_ttl_nothing_outlives_the_ttl(self, clock):
+        cache = ResponseCache(MemoryCacheBackend(), ttls={'road-defects': 30})
+        cache.set('road-defects', None, {'data': [1]})
+        clock.now += 31
+        assert cache.get_stale('road-defects') is None
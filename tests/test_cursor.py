@@ -0,0 +1,49 @@
+"""
+游標分頁
+"""
+import base64
+import pytest
+from utils.query import decode_cursor, encode_cursor, paginate_defects
+
+
+@pytest.mark.parametrize('last_id', [0, 1, 42, 2 ** 40])
+def test_cursor_round_trip(last_id):
+    cursor = encode_cursor(last_id)
+    assert '=' not in cursor
+    assert decode_cursor(cursor) == last_id
+
+
+@pytest.mark.parametrize('cursor', [None, ''])
+def test_empty_cursor_is_first_page(cursor):
+    assert decode_cursor(cursor) is None
+
+
+@pytest.mark.parametrize('cursor', [
+    'not-a-cursor',
+    base64.urlsafe_b64encode(b'page:3').decode('ascii'),
+    base64.urlsafe_b64encode(b'id:abc').decode('ascii'),
+    base64.urlsafe_b64encode('id:１'.encode('utf-8')).decode('ascii'),
+])
+def test_invalid_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_paginate_walks_every_record_once_in_id_order():
+    defects = [{'id': i} for i in (5, 3, 9, 1, 7, 2, 8)]
+    seen = []
+    after_id = None
+    while True:
+        page = paginate_defects(defects, after_id, limit=3)
+        assert page['total'] == 7
+        seen.extend(d['id'] for d in page['data'])
+        if page['next_cursor'] is None:
+            break
+        after_id = decode_cursor(page['next_cursor'])
+    assert seen == [1, 2, 3, 5, 7, 8, 9]
+
+
+def test_last_full_page_has_no_cursor():
+    page = paginate_defects([{'id': 1}, {'id': 2}], None, limit=2)
+    assert [d['id'] for d in page['data']] == [1, 2]
+    assert page['next_cursor'] is None
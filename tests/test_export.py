@@ -0,0 +1,91 @@
+"""
+瑕疵資料匯出格式
+"""
+import csv
+import io
+import json
+import pytest
+from utils.export import EXPORT_COLUMNS, check_format, iter_csv, iter_rows, write_csv, write_parquet, write_xlsx
+
+HEADER = [name for name, _ in EXPORT_COLUMNS]
+
+RECORDS = [
+    {
+        'id': 1,
+        'defect_type': {'value': 2, 'name': '坑洞'},
+        'severity': {'value': 1, 'name': '中'},
+        'capture_time': '2024-01-01T08:00:00+00:00',
+        'latitude': 25.04,
+        'longitude': 121.51,
+        'city': '台北市',
+        'district': '中正區',
+        'road_section': '中山南路, 一段',
+        'device_id': 'cam-1',
+        'has_image': True
+    },
+    {'id': 2, 'defect_type': 0, 'severity': None, 'city': '新北市'}
+]
+
+
+def rows():
+    return iter_rows(json.dumps(record, ensure_ascii=False).encode('utf-8') for record in RECORDS)
+
+
+def test_rows_flatten_enum_fields():
+    first, second = list(rows())
+    row = dict(zip(HEADER, first))
+    assert row['defect_type'] == 2
+    assert row['defect_type_name'] == '坑洞'
+    assert row['severity_name'] == '中'
+    assert dict(zip(HEADER, second))['defect_type'] == 0
+    assert dict(zip(HEADER, second))['defect_type_name'] is None
+
+
+def test_csv_has_bom_header_and_quoted_values():
+    content = b''.join(iter_csv(rows())).decode('utf-8')
+    assert content.startswith('\ufeff')
+    parsed = list(csv.reader(io.StringIO(content[1:])))
+    assert parsed[0] == HEADER
+    assert dict(zip(HEADER, parsed[1]))['road_section'] == '中山南路, 一段'
+    assert len(parsed) == 3
+
+
+def test_csv_is_streamed_in_batches():
+    chunks = list(iter_csv(iter([[i] for i in range(5)]), batch_size=2))
+    # 標題、兩筆、兩筆、一筆
+    assert [chunk.count(b'\n') for chunk in chunks] == [1, 2, 2, 1]
+
+
+def test_write_csv(tmp_path):
+    path = tmp_path / 'defects.csv'
+    write_csv(rows(), str(path))
+    assert path.read_bytes() == b''.join(iter_csv(rows()))
+
+
+def test_write_xlsx(tmp_path):
+    openpyxl = pytest.importorskip('openpyxl')
+    path = tmp_path / 'defects.xlsx'
+    write_xlsx(rows(), str(path))
+    sheet = openpyxl.load_workbook(path, read_only=True)['defects']
+    values = [list(row) for row in sheet.iter_rows(values_only=True)]
+    assert values[0] == HEADER
+    assert values[1][:3] == [1, 2, '坑洞']
+    assert len(values) == 3
+
+
+def test_write_parquet_in_row_groups(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = tmp_path / 'defects.parquet'
+    records = [dict(RECORDS[0], id=i) for i in range(5)]
+    write_parquet(iter_rows(json.dumps(r).encode('utf-8') for r in records), str(path), row_group_size=2)
+    parquet = pq.ParquetFile(str(path))
+    assert parquet.metadata.num_row_groups == 3
+    table = parquet.read()
+    assert table.column_names == HEADER
+    assert table.column('id').to_pylist() == [0, 1, 2, 3, 4]
+    assert table.column('has_image').to_pylist() == [True] * 5
+
+
+def test_check_format():
+    assert check_format('csv') is None
+    assert 'format' in check_format('pdf')
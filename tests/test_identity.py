@@ -0,0 +1,92 @@
+"""
+登入使用者快取
+"""
+import pytest
+from models.user import User
+from utils.identity import IdentityCache, init_identity_cache, load_user_by_id
+
+# clock fixture 以 FakeClock 取代此模組中的 time
+CLOCK_MODULE = 'utils.identity'
+
+
+class TestIdentityCache:
+    def test_entries_expire_after_ttl(self, clock):
+        cache = IdentityCache(ttl=60)
+        cache.set(1, {'id': 1})
+        clock.now += 59
+        assert cache.get(1) == {'id': 1}
+        clock.now += 2
+        assert cache.get(1) is None
+        assert cache.stats()['size'] == 0
+
+    def test_least_recently_used_user_is_evicted(self, clock):
+        cache = IdentityCache(max_size=2)
+        cache.set(1, {'id': 1})
+        cache.set(2, {'id': 2})
+        cache.get(1)
+        cache.set(3, {'id': 3})
+        assert cache.get(2) is None
+        assert cache.get(1) == {'id': 1}
+        assert cache.get(3) == {'id': 3}
+
+    def test_invalidate(self, clock):
+        cache = IdentityCache()
+        cache.set(1, {'id': 1})
+        cache.invalidate(1)
+        cache.invalidate(2)
+        assert cache.get(1) is None
+        assert cache.stats() == {'size': 0, 'hits': 0, 'misses': 1, 'hit_rate': 0.0}
+
+
+@pytest.fixture
+def cache(app, database):
+    app.config['CURRENT_CONFIG']['identity_cache'] = {'enabled': True, 'ttl': 60}
+    return init_identity_cache(app)
+
+
+@pytest.fixture
+def user(database):
+    user = User(username='alice', password_hash='pbkdf2:sha256:1$salt$hash')
+    database.session.add(user)
+    database.session.commit()
+    return user
+
+
+def test_disabled_cache_reads_the_database(app, database, user):
+    assert init_identity_cache(app) is None
+    assert load_user_by_id(str(user.id)).username == 'alice'
+
+
+def test_loaded_user_is_served_from_the_cache(database, cache, user):
+    user_id = user.id
+    database.session.remove()
+    assert load_user_by_id(user_id).username == 'alice'
+    database.session.remove()
+    loaded = load_user_by_id(user_id)
+    assert loaded.username == 'alice'
+    assert loaded in database.session
+    assert cache.stats()['hits'] == 1
+
+
+def test_invalid_or_missing_ids_return_none(cache, user):
+    assert load_user_by_id('abc') is None
+    assert load_user_by_id(user.id + 1) is None
+    assert cache.stats()['size'] == 0
+
+
+def test_orm_update_invalidates_the_snapshot(database, cache, user):
+    load_user_by_id(user.id)
+    user.username = 'bob'
+    database.session.commit()
+    assert cache.get(user.id) is None
+    database.session.remove()
+    assert load_user_by_id(user.id).username == 'bob'
+
+
+def test_orm_delete_invalidates_the_snapshot(database, cache, user):
+    user_id = user.id
+    load_user_by_id(user_id)
+    database.session.delete(user)
+    database.session.commit()
+    assert load_user_by_id(user_id) is None
+
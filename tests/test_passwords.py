@@ -0,0 +1,75 @@
+"""
+密碼雜湊與最後登入時間批次寫入
+"""
+from datetime import datetime, timedelta
+import pytest
+from models.user import User
+from utils.identity import init_identity_cache, load_user_by_id
+from utils.passwords import LoginRecorder, PasswordHasher, normalize_method
+
+FAST_METHOD = 'pbkdf2:sha256:1000'
+
+
+def test_normalize_method_adds_default_iterations():
+    assert normalize_method('pbkdf2:sha256').startswith('pbkdf2:sha256:')
+    assert normalize_method(FAST_METHOD) == FAST_METHOD
+
+
+def test_hash_and_verify_in_the_pool():
+    hasher = PasswordHasher(method=FAST_METHOD, workers=2)
+    try:
+        password_hash = hasher.hash('secret')
+        assert password_hash.startswith(FAST_METHOD + '$')
+        assert hasher.verify(password_hash, 'secret')
+        assert not hasher.verify(password_hash, 'wrong')
+    finally:
+        hasher.close()
+
+
+def test_needs_rehash_when_parameters_change():
+    old = PasswordHasher(method='pbkdf2:sha256:500', workers=1)
+    new = PasswordHasher(method=FAST_METHOD, workers=1)
+    try:
+        password_hash = old.hash('secret')
+        assert not old.needs_rehash(password_hash)
+        assert new.needs_rehash(password_hash)
+        # 舊參數的雜湊仍可驗證
+        assert new.verify(password_hash, 'secret')
+    finally:
+        old.close()
+        new.close()
+
+
+@pytest.fixture
+def users(database):
+    users = [User(username=name, password_hash='x') for name in ('alice', 'bob')]
+    database.session.add_all(users)
+    database.session.commit()
+    return users
+
+
+def test_flush_writes_the_latest_login_per_user(database, users):
+    alice, bob = users
+    first = datetime(2024, 1, 1, 8, 0)
+    recorder = LoginRecorder()
+    recorder.record(alice.id, first)
+    recorder.record(alice.id, first + timedelta(hours=1))
+    recorder.record(bob.id, first)
+    assert recorder.flush() == 2
+    assert recorder.flush() == 0
+    database.session.expire_all()
+    assert alice.last_login_at == first + timedelta(hours=1)
+    assert bob.last_login_at == first
+
+
+def test_flush_invalidates_cached_users(app, database, users):
+    app.config['CURRENT_CONFIG']['identity_cache'] = {'enabled': True}
+    cache = init_identity_cache(app)
+    user_id = users[0].id
+    load_user_by_id(user_id)
+    recorder = LoginRecorder()
+    recorder.record(user_id)
+    recorder.flush()
+    assert cache.get(user_id) is None
+    database.session.remove()
+    assert load_user_by_id(user_id).last_login_at is not None
@@ -0,0 +1,98 @@
+"""
+圖片下載失敗的處理與預先下載的高水位標記
+"""
+from datetime import datetime
+import pytest
+from models.defect import SyncState
+from utils import image_cache as image_cache_module
+from utils import prefetch
+from utils.image_cache import ImageCache, ImageUnavailable, fetch_image
+
+
+class FakeResponse:
+    """串流響應"""
+
+    headers = {'content-type': 'image/jpeg'}
+
+    def iter_content(self, chunk_size):
+        yield b'jpeg-bytes'
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def upstream(app, monkeypatch, tmp_path):
+    """以圖片 ID 對應的狀態碼（或例外訊息）取代上游圖片端點"""
+    app.extensions['image_cache'] = ImageCache(str(tmp_path / 'image_cache'))
+    app.extensions['road_defect_single_flight'] = None
+    app.extensions['thumbnail_renderer'] = None
+    statuses = {}
+
+    def call_road_defect_api(endpoint, stream=False):
+        status = statuses.get(int(endpoint.split('/')[1]), 200)
+        if status == 200:
+            return {'success': True, 'status_code': 200, 'response': FakeResponse()}
+        if isinstance(status, str):
+            return {'success': False, 'message': status}
+        return {'success': False, 'status_code': status, 'response': FakeResponse()}
+
+    monkeypatch.setattr(image_cache_module, 'call_road_defect_api', call_road_defect_api)
+    return statuses
+
+
+def test_fetch_image_stores_the_upstream_image(upstream):
+    image = fetch_image(1)
+    assert image is not None
+    assert open(image.path, 'rb').read() == b'jpeg-bytes'
+
+
+def test_fetch_image_returns_none_only_for_404(upstream):
+    upstream.update({1: 404, 2: 500, 3: '上游端點暫時無法使用（斷路器斷開）'})
+    assert fetch_image(1) is None
+    with pytest.raises(ImageUnavailable) as error:
+        fetch_image(2)
+    assert error.value.status_code == 500
+    with pytest.raises(ImageUnavailable):
+        fetch_image(3)
+
+
+def test_prefetch_one_reports_transient_failures(upstream):
+    upstream.update({1: 404, 2: 503})
+    limiter = prefetch.RateLimiter(0)
+    assert prefetch._prefetch_one(1, [], limiter)
+    assert not prefetch._prefetch_one(2, [], limiter)
+    assert prefetch._prefetch_one(3, [], limiter)
+
+
+@pytest.fixture
+def new_defects(app, database, monkeypatch):
+    app.config['CURRENT_CONFIG']['image_prefetch'] = {'overlap_minutes': 60, 'rate': 0}
+    defects = [
+        {'id': 1, 'has_image': True, 'capture_time': '2024-01-01T08:00:00Z'},
+        {'id': 2, 'has_image': True, 'capture_time': '2024-01-01T09:00:00Z'},
+        {'id': 3, 'has_image': True, 'capture_time': '2024-01-01T10:00:00Z'}
+    ]
+    requested = []
+
+    def fetch_defects(defect_filter):
+        requested.append(defect_filter.start_time)
+        return {'success': True, 'data': defects}
+
+    monkeypatch.setattr(prefetch, 'fetch_defects', fetch_defects)
+    monkeypatch.setattr(prefetch, 'get_placeholders', lambda ids: {})
+    return requested
+
+
+def test_high_water_mark_stops_at_the_first_failure(upstream, new_defects):
+    upstream[2] = 502
+    result = prefetch.prefetch_images(since=datetime(2024, 1, 1))
+    assert result['failed'] == 1
+    assert SyncState.get(prefetch.SYNC_STATE_NAME).high_water_mark == datetime(2024, 1, 1, 9)
+
+
+def test_next_run_starts_an_overlap_before_the_high_water_mark(upstream, new_defects):
+    prefetch.prefetch_images(since=datetime(2024, 1, 1))
+    assert SyncState.get(prefetch.SYNC_STATE_NAME).high_water_mark == datetime(2024, 1, 1, 10)
+    prefetch.prefetch_images()
+    assert new_defects[-1] == '2024-01-01T09:00:00+00:00'
@@ -0,0 +1,102 @@
+"""
+查詢條件標準化與上游查詢計畫
+"""
+import pytest
+from werkzeug.datastructures import MultiDict
+from utils.query import DefectFilter, plan_defect_query
+
+
+@pytest.fixture(autouse=True)
+def _app_context(app):
+    # 無效值會寫入 current_app.logger
+    yield
+
+
+class TestDefectFilter:
+    def test_single_value_becomes_tuple(self):
+        assert DefectFilter(city='台北市').city == ('台北市',)
+
+    def test_values_are_deduplicated_and_sorted(self):
+        assert DefectFilter(city=['新北市', '台北市', '新北市']).city == ('台北市', '新北市')
+
+    @pytest.mark.parametrize('values', [None, [], '', 'all', ['all'], ['台北市', 'all']])
+    def test_all_or_empty_means_unrestricted(self, values):
+        assert DefectFilter(city=values).city is None
+
+    def test_int_fields_are_cast_and_invalid_values_dropped(self):
+        defect_filter = DefectFilter(severity=['2', 1, 'high'], defect_type='x')
+        assert defect_filter.severity == (1, 2)
+        assert defect_filter.defect_type is None
+
+    def test_empty_time_is_none(self):
+        assert DefectFilter(start_time='', end_time='2024-01-01 00:00:00').as_dict() == {
+            'end_time': '2024-01-01 00:00:00'
+        }
+
+    def test_from_args_accepts_both_list_styles(self):
+        args = MultiDict([('city', '台北市'), ('city[]', '新北市'), ('severity[]', '2'), ('start_time', '2024-01-01')])
+        defect_filter = DefectFilter.from_args(args)
+        assert defect_filter.city == ('台北市', '新北市')
+        assert defect_filter.severity == (2,)
+        assert defect_filter.start_time == '2024-01-01'
+
+    def test_equal_filters_share_hash_regardless_of_order(self):
+        a = DefectFilter(city=['新北市', '台北市'], severity=[2, 1])
+        b = DefectFilter(severity=['1', '2'], city=['台北市', '新北市'])
+        assert a == b
+        assert hash(a) == hash(b)
+        assert a != DefectFilter(city=['台北市'])
+
+    def test_to_params_uses_lists(self):
+        params = DefectFilter(city='台北市', severity=[1, 2], end_time='2024-01-01').to_params()
+        assert params == {'city': ['台北市'], 'severity': [1, 2], 'end_time': '2024-01-01'}
+
+    def test_matches_plain_and_enum_values(self):
+        defect_filter = DefectFilter(severity=[2], road_section='中山路')
+        defect = {'severity': {'value': 2, 'name': '中'}, 'road_section': '中山路'}
+        assert defect_filter.matches(defect)
+        assert not defect_filter.matches(dict(defect, road_section='民生路'))
+        assert defect_filter.matches(dict(defect, road_section='民生路'), fields=('severity',))
+
+
+class TestPlanDefectQuery:
+    def test_unrestricted_filter_is_one_request(self):
+        plan = plan_defect_query(DefectFilter())
+        assert plan.requests == [{}]
+        assert plan.local_fields == ('road_section',)
+
+    def test_multi_value_params_are_pushed_down(self):
+        plan = plan_defect_query(DefectFilter(city=['台北市', '新北市'], severity=[1, 2, 3]))
+        assert plan.requests == [{'city': ['台北市', '新北市'], 'severity': [1, 2, 3]}]
+
+    def test_single_values_are_sent_as_scalars(self):
+        plan = plan_defect_query(DefectFilter(city='台北市', severity=2), multi_value_params=())
+        assert plan.requests == [{'city': '台北市', 'severity': 2}]
+
+    def test_expands_fields_the_upstream_cannot_combine(self):
+        plan = plan_defect_query(
+            DefectFilter(defect_type=[0, 1], severity=[1, 2, 3]),
+            multi_value_params=('city',)
+        )
+        assert len(plan.requests) == 6
+        assert {(r['defect_type'], r['severity']) for r in plan.requests} == {
+            (t, s) for t in (0, 1) for s in (1, 2, 3)
+        }
+        assert plan.local_fields == ('road_section',)
+
+    def test_fields_over_the_fanout_limit_are_filtered_locally(self):
+        plan = plan_defect_query(
+            DefectFilter(defect_type=[0, 1], severity=[1, 2, 3]),
+            multi_value_params=(),
+            max_fanout=4
+        )
+        # 值較少的欄位先展開，另一個欄位超過上限改為本地過濾且不送往上游
+        assert plan.requests == [{'defect_type': 0}, {'defect_type': 1}]
+        assert plan.local_fields == ('road_section', 'severity')
+
+    def test_time_range_is_sent_with_every_request(self):
+        plan = plan_defect_query(
+            DefectFilter(severity=[1, 2], start_time='2024-01-01'),
+            multi_value_params=()
+        )
+        assert all(r['start_time'] == '2024-01-01' for r in plan.requests)
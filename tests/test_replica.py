@@ -0,0 +1,94 @@
+"""
+瑕疵資料本地副本同步
+"""
+from datetime import date, timedelta
+import pytest
+from models.defect import Defect, DefectDailyRollup, SyncState
+from utils import replica
+
+
+def record(defect_id, capture_time, severity=1):
+    return {
+        'id': defect_id,
+        'capture_time': capture_time,
+        'severity': {'value': severity, 'name': str(severity)},
+        'defect_type': {'value': 0, 'name': '0'},
+        'city': '台北市',
+        'district': '中正區'
+    }
+
+
+@pytest.fixture
+def upstream(app, database, monkeypatch):
+    """以可修改的記錄列表取代上游，記錄每次同步的參數"""
+    app.config['CURRENT_CONFIG']['defect_replica'] = {
+        'enabled': True, 'overlap_minutes': 60, 'reconcile_interval': 3600, 'rollups': True
+    }
+    records = {
+        1: record(1, '2024-01-01T08:00:00Z'),
+        2: record(2, '2024-01-02T08:00:00Z'),
+        3: record(3, '2024-01-03T08:00:00Z')
+    }
+    calls = []
+
+    def call_road_defect_api(endpoint, params=None, use_cache=True):
+        assert use_cache is False
+        calls.append(params)
+        return {'success': True, 'data': {'data': list(records.values())}}
+
+    monkeypatch.setattr(replica, 'call_road_defect_api', call_road_defect_api)
+    return records, calls
+
+
+def rollup_counts():
+    """每日彙總的數量（跨所有嚴重程度）"""
+    counts = {}
+    for row in DefectDailyRollup.query:
+        counts[row.day] = counts.get(row.day, 0) + row.count
+    return counts
+
+
+def test_first_sync_is_a_full_reconcile(upstream):
+    records, calls = upstream
+    state = replica.sync_defects()
+    assert calls == [None]
+    assert state['reconciled_at'] is not None
+    assert state['high_water_mark'] == '2024-01-03T08:00:00'
+    assert Defect.query.count() == 3
+
+
+def test_incremental_sync_overlaps_the_high_water_mark(upstream):
+    records, calls = upstream
+    replica.sync_defects()
+    del records[1]
+    replica.sync_defects()
+    assert calls[1] == {'start_time': '2024-01-03T07:00:00+00:00'}
+    # 增量同步不會移除記錄
+    assert Defect.query.count() == 3
+
+
+def test_reconcile_updates_old_records_and_removes_deleted_ones(database, upstream):
+    records, calls = upstream
+    replica.sync_defects()
+    records[1] = record(1, '2024-01-02T09:00:00Z', severity=2)
+    del records[3]
+
+    state = SyncState.get(replica.SYNC_STATE_NAME)
+    state.reconciled_at -= timedelta(hours=2)
+    database.session.commit()
+    replica.sync_defects()
+
+    assert calls[1] is None
+    assert sorted(defect.id for defect in Defect.query) == [1, 2]
+    assert Defect.query.get(1).severity == 2
+    assert rollup_counts() == {date(2024, 1, 2): 2}
+
+
+def test_full_sync_can_be_forced(upstream):
+    records, calls = upstream
+    replica.sync_defects()
+    records.clear()
+    replica.sync_defects(full=True)
+    assert calls[1] is None
+    assert Defect.query.count() == 0
+    assert rollup_counts() == {}
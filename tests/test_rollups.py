@@ -0,0 +1,106 @@
+"""
+每日彙總與週、月趨勢
+"""
+from datetime import date
+import pytest
+from models.defect import Defect, DefectDailyRollup
+from utils.query import DefectFilter
+from utils.rollups import RollupDays, bucket_start, rebuild_rollups, recompute_rollups, rollup_stats, rollup_trends
+
+
+def make_defect(defect_id, capture_time, severity=1, defect_type=0, city='台北市', district='中正區'):
+    return Defect.from_record({
+        'id': defect_id,
+        'capture_time': capture_time,
+        'severity': {'value': severity, 'name': str(severity)},
+        'defect_type': {'value': defect_type, 'name': str(defect_type)},
+        'city': city,
+        'district': district,
+        'road_section': '中山路'
+    })
+
+
+@pytest.fixture
+def defects(database):
+    rows = [
+        make_defect(1, '2024-01-29T08:00:00Z', severity=0),            # 週一
+        make_defect(2, '2024-01-31T23:59:59Z', severity=1),            # 同一週、一月
+        make_defect(3, '2024-02-01T00:00:00Z', severity=2),            # 同一週、二月
+        make_defect(4, '2024-02-05T12:00:00Z', defect_type=3),         # 下一週
+        make_defect(5, '2024-02-05T13:00:00Z', city='新北市', district='板橋區'),
+        make_defect(6, None)                                           # 沒有拍攝時間不列入彙總
+    ]
+    database.session.add_all(rows)
+    database.session.commit()
+    rebuild_rollups()
+    return rows
+
+
+@pytest.mark.parametrize('day, interval, expected', [
+    (date(2024, 2, 1), 'day', date(2024, 2, 1)),
+    (date(2024, 2, 1), 'week', date(2024, 1, 29)),
+    (date(2024, 1, 29), 'week', date(2024, 1, 29)),
+    (date(2024, 2, 4), 'week', date(2024, 1, 29)),
+    (date(2024, 2, 29), 'month', date(2024, 2, 1)),
+])
+def test_bucket_start(day, interval, expected):
+    assert bucket_start(day, interval) == expected
+
+
+def test_daily_rollups_group_by_key(defects):
+    rows = DefectDailyRollup.query.order_by(DefectDailyRollup.day, DefectDailyRollup.city).all()
+    assert [(r.day, r.city, r.count) for r in rows] == [
+        (date(2024, 1, 29), '台北市', 1),
+        (date(2024, 1, 31), '台北市', 1),
+        (date(2024, 2, 1), '台北市', 1),
+        (date(2024, 2, 5), '台北市', 1),
+        (date(2024, 2, 5), '新北市', 1),
+    ]
+
+
+def test_monthly_trends(defects):
+    trends = rollup_trends(DefectFilter(), 'month')
+    assert [(t['period'], t['total_defects']) for t in trends] == [('2024-01', 2), ('2024-02', 3)]
+    assert trends[0]['by_severity'] == [1, 1, 0]
+    assert trends[1]['by_type'] == [2, 0, 0, 1]
+    assert trends[0]['start'] == '2024-01-01T00:00:00+00:00'
+
+
+def test_weekly_trends_cross_month_boundaries(defects):
+    trends = rollup_trends(DefectFilter(), 'week')
+    assert [(t['period'], t['total_defects']) for t in trends] == [('2024-01-29', 3), ('2024-02-05', 2)]
+    assert trends[0]['by_severity'] == [1, 1, 1]
+
+
+def test_trends_apply_location_filter(defects):
+    trends = rollup_trends(DefectFilter(city='新北市'), 'month')
+    assert [(t['period'], t['total_defects']) for t in trends] == [('2024-02', 1)]
+
+
+def test_partial_days_are_read_from_records(defects):
+    defect_filter = DefectFilter(start_time='2024-01-31T12:00:00Z', end_time='2024-02-05T12:30:00Z')
+    stats = rollup_stats(defect_filter)
+    # 1/31 23:59:59、2/1 整天、2/5 12:00
+    assert stats['severity_stats']['total'] == 3
+    assert stats['time_range'] == {
+        'earliest': '2024-01-31T23:59:59+00:00',
+        'latest': '2024-02-05T12:00:00+00:00'
+    }
+
+
+def test_recomputing_changed_days_matches_a_full_rebuild(database, defects):
+    moved = Defect.query.get(4)
+    days = RollupDays()
+    days.add(moved)
+    moved.update_from_record(dict(moved.to_dict(), capture_time='2024-01-30T10:00:00Z'))
+    days.add(moved)
+    days.apply()
+    days.apply()  # 重複套用不會重複計算
+    database.session.commit()
+    incremental = sorted((r.day, r.city, r.defect_type, r.severity, r.count) for r in DefectDailyRollup.query)
+
+    recompute_rollups()
+    database.session.commit()
+    rebuilt = sorted((r.day, r.city, r.defect_type, r.severity, r.count) for r in DefectDailyRollup.query)
+    assert incremental == rebuilt
+    assert [t['total_defects'] for t in rollup_trends(DefectFilter(), 'week')] == [4, 1]
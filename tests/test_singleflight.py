@@ -0,0 +1,104 @@
+"""
+相同上游請求的合併（single-flight）
+"""
+import threading
+import time
+import pytest
+from utils.singleflight import SingleFlight
+
+
+def run_concurrently(flight: SingleFlight, key: str, fn, callers: int):
+    """讓多個執行緒同時以相同鍵呼叫，等所有等待者加入後才放行發起者"""
+    release = threading.Event()
+    results = [None] * callers
+    errors = [None] * callers
+
+    def leader_fn():
+        release.wait(5)
+        return fn()
+
+    def worker(index):
+        try:
+            results[index] = flight.do(key, leader_fn)
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    # 發起者以外的呼叫者都已開始等待
+    for _ in range(500):
+        with flight._lock:
+            call = flight._calls.get(key)
+            if call is not None and call.waiters == callers - 1:
+                break
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        return {'data': [1, 2]}
+
+    results, errors = run_concurrently(flight, 'road-defects?{}', fn, callers=8)
+    assert len(calls) == 1
+    assert errors == [None] * 8
+    assert all(result is results[0] for result in results)
+    assert flight.coalesced == 7
+
+
+def test_errors_are_raised_to_every_waiter():
+    flight = SingleFlight()
+
+    def fn():
+        raise RuntimeError('upstream down')
+
+    results, errors = run_concurrently(flight, 'road-defects?{}', fn, callers=4)
+    assert all(isinstance(e, RuntimeError) for e in errors)
+
+
+def test_sequential_calls_are_not_coalesced():
+    flight = SingleFlight()
+    assert flight.do('a', lambda: 1) == 1
+    assert flight.do('a', lambda: 2) == 2
+    assert flight.coalesced == 0
+    assert flight._calls == {}
+
+
+def test_failed_call_does_not_block_the_next_one():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        flight.do('a', fail)
+    assert flight.do('a', lambda: 'ok') == 'ok'
+
+
+def test_cross_process_recheck_skips_the_call(tmp_path):
+    flight = SingleFlight(lock_dir=str(tmp_path / 'locks'))
+    if flight.lock_dir is None:
+        pytest.skip('此平台不支援 fcntl')
+    calls = []
+    assert flight.do('a', lambda: calls.append(1), recheck=lambda: 'cached') == 'cached'
+    assert flight.do('b', lambda: 'fresh', recheck=lambda: None) == 'fresh'
+    assert calls == []
+
+
+def test_lock_files_are_bounded_by_stripes(tmp_path):
+    lock_dir = tmp_path / 'locks'
+    flight = SingleFlight(lock_dir=str(lock_dir), lock_stripes=4)
+    if flight.lock_dir is None:
+        pytest.skip('此平台不支援 fcntl')
+    for i in range(50):
+        assert flight.do(f'road-defects?{{"id": {i}}}', lambda: i) == i
+    assert len(list(lock_dir.iterdir())) <= 4
+    assert flight.lock_path('a') == flight.lock_path('a')
@@ -0,0 +1,91 @@
+"""
+列表回應的圖片預覽圖
+"""
+import io
+import time
+import pytest
+from utils.image_cache import ImageCache
+from utils.thumbnails import ThumbnailRenderer, attach_placeholders, get_placeholders
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def jpeg_bytes() -> bytes:
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), (200, 80, 40)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def images(app, tmp_path):
+    """五張已快取的原圖，列表回應最多附上三筆預覽圖"""
+    image_cache = ImageCache(str(tmp_path / 'image_cache'))
+    renderer = ThumbnailRenderer(widths=[100], workers=1, placeholder_limit=3)
+    app.extensions['image_cache'] = image_cache
+    app.extensions['thumbnail_renderer'] = renderer
+    data = jpeg_bytes()
+    for defect_id in range(1, 6):
+        image_cache.store(str(defect_id), [data], 'image/jpeg')
+    yield image_cache, renderer
+    renderer.close()
+
+
+def wait_until(predicate, timeout: float = 10):
+    """等待完成回呼執行（回呼在 Future 完成後才於行程池的管理執行緒中執行）"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def defects():
+    return [{'id': defect_id, 'has_image': True} for defect_id in range(1, 6)]
+
+
+def test_missing_placeholders_are_generated_in_the_background(images):
+    image_cache, renderer = images
+    # 尚未產生的預覽圖不會在請求中等待
+    assert get_placeholders([1, 2]) == {}
+    generated = get_placeholders([1, 2], timeout=30)
+    assert set(generated) == {1, 2}
+    assert generated[1].startswith('data:image/jpeg;base64,')
+    wait_until(lambda: not renderer._pending)
+    assert image_cache.read_meta('1')['placeholder'] == generated[1]
+    assert get_placeholders([1, 2]) == generated
+
+
+def test_only_the_first_page_is_read(images, monkeypatch):
+    image_cache, renderer = images
+    get_placeholders(range(1, 6), timeout=30)
+    wait_until(lambda: not renderer._pending)
+    renderer._placeholders.clear()
+
+    reads = []
+    read_meta = image_cache.read_meta
+    monkeypatch.setattr(image_cache, 'read_meta', lambda key: reads.append(key) or read_meta(key))
+    attached = attach_placeholders(defects())
+    assert reads == ['1', '2', '3']
+    assert [('image_placeholder' in d) for d in attached] == [True, True, True, False, False]
+
+
+def test_attach_returns_new_dicts(images):
+    image_cache, renderer = images
+    get_placeholders([1], timeout=30)
+    wait_until(lambda: not renderer._pending)
+    original = defects()
+    attached = attach_placeholders(original)
+    assert 'image_placeholder' in attached[0]
+    assert 'image_placeholder' not in original[0]
+
+
+def test_pending_renders_are_not_submitted_twice(images):
+    image_cache, renderer = images
+    path = image_cache.blob_path(image_cache.read_meta('1')['digest'])
+    saved = []
+    first = renderer.submit_placeholder('1', path, saved.append)
+    second = renderer.submit_placeholder('1', path, saved.append)
+    assert first is second
+    first.result(timeout=30)
+    wait_until(lambda: saved)
+    assert saved == [first.result()]
+    assert renderer.recall('1') == first.result()
@@ -0,0 +1,285 @@
+"""
+瑕疵統計聚合引擎
+
+以本地瑕疵資料（欄式儲存或本地副本）計算統計、趨勢、地理分布與道路分析，
+輸出格式與上游 API 相同，不需再向上游發送請求。
+"""
+import numpy as np
+from typing import Dict, Any, List, Optional, Tuple
+from utils.defect_store import DefectStore, MISSING_TIME, get_defect_store
+from utils.replica import is_replica_mode, query_defects
+from utils.timeutil import format_time
+
+# 前端圖表預設的類別數量（輕微/中等/嚴重；橫向/縱向/龜裂/坑洞）
+SEVERITY_LEVELS = 3
+DEFECT_TYPES = 4
+
+# 道路分析預設列出的道路與熱點數量
+DEFAULT_TOP_N = 10
+
+# 支援的趨勢時間區間
+TREND_INTERVALS = ('day', 'week', 'month')
+
+SECONDS_PER_DAY = 86400
+
+
+def get_local_dataset(defect_filter) -> Optional[Tuple[DefectStore, np.ndarray]]:
+    """取得符合條件的本地資料
+
+    Args:
+        defect_filter: 查詢條件（DefectFilter）
+
+    Returns:
+        Optional[Tuple[DefectStore, np.ndarray]]: 欄式資料與選取的索引，沒有本地資料時返回 None
+    """
+    store = get_defect_store()
+    if store is not None:
+        return store, store.select(defect_filter)
+    if is_replica_mode():
+        store = DefectStore(query_defects(defect_filter))
+        return store, np.arange(store.size)
+    return None
+
+
+def _counts(values: np.ndarray, minlength: int) -> List[int]:
+    """計算非負整數值的出現次數"""
+    values = values[values >= 0]
+    return np.bincount(values, minlength=minlength).tolist()
+
+
+def _distribution(values: np.ndarray) -> Dict[str, int]:
+    """以字串鍵表示的分布（與前端的 Object.entries 用法一致）"""
+    values = values[values >= 0]
+    keys, counts = np.unique(values, return_counts=True)
+    return {str(k): int(c) for k, c in zip(keys, counts)}
+
+
+def _group(codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """依多個編碼欄位分組
+
+    Args:
+        codes: 形狀為 (列數, 欄位數) 的編碼陣列
+
+    Returns:
+        Tuple: 不重複的組合，以及每一列所屬組合的索引
+    """
+    if len(codes) == 0:
+        return np.empty((0, codes.shape[1]), dtype=codes.dtype), np.empty(0, dtype=np.int64)
+    groups, inverse = np.unique(codes, axis=0, return_inverse=True)
+    return groups, inverse.reshape(-1)
+
+
+def _from_epoch(seconds):
+    """epoch 秒數轉換為不含時區的 UTC datetime"""
+    return np.datetime64(int(seconds), 's').item()
+
+
+def compute_stats(store: DefectStore, indices: np.ndarray) -> Dict[str, Any]:
+    """計算基本統計
+
+    Returns:
+        Dict: severity_stats、defect_type_stats 與 time_range
+    """
+    severity = store.severity[indices]
+    defect_type = store.defect_type[indices]
+    times = store.capture_time[indices]
+    times = times[times != MISSING_TIME]
+
+    return {
+        'severity_stats': {
+            'total': int(len(indices)),
+            'by_severity': _counts(severity, SEVERITY_LEVELS)
+        },
+        'defect_type_stats': {
+            'total': int(len(indices)),
+            'by_type': _counts(defect_type, DEFECT_TYPES)
+        },
+        'time_range': {
+            'earliest': format_time(_from_epoch(times.min())) if len(times) else None,
+            'latest': format_time(_from_epoch(times.max())) if len(times) else None
+        }
+    }
+
+
+def bucket_times(times: np.ndarray, interval: str) -> np.ndarray:
+    """將 epoch 秒數對齊到時間區間的起點（以天為單位）
+
+    Args:
+        times: epoch 秒數
+        interval: day、week 或 month
+
+    Returns:
+        np.ndarray: 各區間起點的 datetime64[D]
+    """
+    days = times // SECONDS_PER_DAY
+    if interval == 'week':
+        # 1970-01-01 為星期四，對齊到星期一
+        days = days - (days + 3) % 7
+    buckets = days.astype('datetime64[D]')
+    if interval == 'month':
+        buckets = buckets.astype('datetime64[M]').astype('datetime64[D]')
+    return buckets
+
+
+def format_bucket(bucket: np.datetime64, interval: str) -> str:
+    """區間的顯示標籤"""
+    if interval == 'month':
+        return str(bucket.astype('datetime64[M]'))
+    return str(bucket)
+
+
+def compute_trends(store: DefectStore, indices: np.ndarray, interval: str = 'month') -> List[Dict[str, Any]]:
+    """依時間區間計算趨勢
+
+    Returns:
+        List[Dict]: 依時間排序的各區間統計
+    """
+    times = store.capture_time[indices]
+    valid = times != MISSING_TIME
+    indices = indices[valid]
+    buckets = bucket_times(times[valid], interval)
+
+    keys, inverse = np.unique(buckets, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    severity = store.severity[indices]
+    defect_type = store.defect_type[indices]
+
+    trends = []
+    for i, key in enumerate(keys):
+        in_bucket = inverse == i
+        label = format_bucket(key, interval)
+        trends.append({
+            'period': label,
+            # 前端以 month 欄位作為圖表標籤
+            'month': label,
+            'start': format_time(key.astype('datetime64[s]').item()),
+            'total_defects': int(in_bucket.sum()),
+            'by_severity': _counts(severity[in_bucket], SEVERITY_LEVELS),
+            'by_type': _counts(defect_type[in_bucket], DEFECT_TYPES)
+        })
+    return trends
+
+
+def compute_distribution(store: DefectStore, indices: np.ndarray) -> Dict[str, Dict[str, Any]]:
+    """依城市與行政區計算地理分布
+
+    Returns:
+        Dict: {城市: {行政區: {total_defects, severity_distribution, defect_type_distribution}}}
+    """
+    city = store.columns['city']
+    district = store.columns['district']
+    codes = np.stack([city.codes[indices], district.codes[indices]], axis=1)
+    groups, inverse = _group(codes)
+    severity = store.severity[indices]
+    defect_type = store.defect_type[indices]
+
+    distribution = {}
+    for i, (city_code, district_code) in enumerate(groups):
+        city_name = city.categories[city_code]
+        district_name = district.categories[district_code]
+        if not city_name or not district_name:
+            continue
+        in_group = inverse == i
+        distribution.setdefault(city_name, {})[district_name] = {
+            'total_defects': int(in_group.sum()),
+            'severity_distribution': _distribution(severity[in_group]),
+            'defect_type_distribution': _distribution(defect_type[in_group])
+        }
+    return {c: dict(sorted(distribution[c].items())) for c in sorted(distribution)}
+
+
+def compute_road_analysis(store: DefectStore, indices: np.ndarray, top_n: int = DEFAULT_TOP_N) -> Dict[str, Any]:
+    """依道路計算瑕疵數量與嚴重程度熱點
+
+    Returns:
+        Dict: top_roads（瑕疵最多的道路）與 hotspots（平均嚴重程度最高的位置）
+    """
+    columns = [store.columns[f] for f in DefectStore.CATEGORICAL_FIELDS]
+    codes = np.stack([column.codes[indices] for column in columns], axis=1)
+    groups, inverse = _group(codes)
+    severity = store.severity[indices]
+
+    counts = np.bincount(inverse, minlength=len(groups))
+    valid_severity = severity >= 0
+    severity_sum = np.bincount(inverse[valid_severity], weights=severity[valid_severity], minlength=len(groups))
+    severity_count = np.bincount(inverse[valid_severity], minlength=len(groups))
+    severity_index = np.divide(severity_sum, severity_count,
+                               out=np.zeros(len(groups)), where=severity_count > 0)
+
+    roads = []
+    for i, group in enumerate(groups):
+        city_name, district_name, road_name = (column.categories[code] for column, code in zip(columns, group))
+        if not road_name:
+            continue
+        roads.append({
+            'index': i,
+            'city': city_name,
+            'district': district_name,
+            'road_name': road_name,
+            'location': ' '.join(part for part in (city_name, district_name, road_name) if part),
+            'defect_count': int(counts[i]),
+            'severity_index': float(severity_index[i])
+        })
+
+    top_roads = sorted(roads, key=lambda r: (-r['defect_count'], r['location']))[:top_n]
+    hotspots = sorted(roads, key=lambda r: (-r['severity_index'], -r['defect_count'], r['location']))[:top_n]
+
+    return {
+        'top_roads': [
+            {
+                'road_name': road['road_name'],
+                'city': road['city'],
+                'district': road['district'],
+                'defect_count': road['defect_count'],
+                'severity_distribution': _distribution(severity[inverse == road['index']])
+            }
+            for road in top_roads
+        ],
+        'hotspots': [
+            {
+                'location': road['location'],
+                'severity_index': round(road['severity_index'], 4),
+                'defect_count': road['defect_count']
+            }
+            for road in hotspots
+        ]
+    }
+
+
+def compute_heatmap(store: DefectStore, indices: np.ndarray, cell_size: float,
+                    severity_weights: List[float]) -> Dict[str, Any]:
+    """依固定大小的經緯度網格計算瑕疵密度
+
+    Args:
+        store: 欄式資料
+        indices: 選取的資料列
+        cell_size: 網格大小（度）
+        severity_weights: 各嚴重程度的權重，未知嚴重程度以 0 計算
+
+    Returns:
+        Dict: 非空網格的中心座標、數量與嚴重程度加權分數
+    """
+    lat = store.latitude[indices]
+    lon = store.longitude[indices]
+    valid = np.isfinite(lat) & np.isfinite(lon)
+    lat, lon, severity = lat[valid], lon[valid], store.severity[indices][valid]
+
+    cells = np.stack([np.floor(lat / cell_size), np.floor(lon / cell_size)], axis=1).astype(np.int64)
+    groups, inverse = _group(cells)
+    weights = np.asarray(severity_weights, dtype=np.float64)
+    scores = np.where((severity >= 0) & (severity < len(weights)),
+                      weights[np.clip(severity, 0, len(weights) - 1)], 0.0)
+    counts = np.bincount(inverse, minlength=len(groups))
+    score_sums = np.bincount(inverse, weights=scores, minlength=len(groups))
+
+    return {
+        'cell_size': cell_size,
+        'total': int(counts.sum()),
+        'max_count': int(counts.max()) if len(groups) else 0,
+        'max_score': float(score_sums.max()) if len(groups) else 0.0,
+        'columns': ['latitude', 'longitude', 'count', 'score'],
+        'cells': [
+            [round((row + 0.5) * cell_size, 6), round((col + 0.5) * cell_size, 6), int(count), float(score)]
+            for (row, col), count, score in zip(groups.tolist(), counts.tolist(), score_sums.tolist())
+        ]
+    }
@@ -2,93 +2,404 @@
 API 調用工具函數
 """
 import json
+from concurrent.futures import ThreadPoolExecutor, wait
+from fnmatch import fnmatch
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from flask import current_app, request
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
+from utils.breaker import UpstreamUnavailable, get_upstream_guard, is_failure_status
+from utils.cache import get_response_cache, make_cache_key
+from utils.singleflight import get_single_flight
+
+# 對方的 API URL
+DEFAULT_BASE_URL = 'http://140.134.37.59:5002/api/v1'
+
+
+class RoadDefectApiClient:
+    """道路瑕疵 API 客戶端
+
+    以單一 requests.Session 維持 keep-alive 連線池，
+    並提供逐端點的連線/讀取逾時與指數退避重試。
+    """
+
+    def __init__(
+        self,
+        base_url: str = DEFAULT_BASE_URL,
+        timeout: float = 5,
+        connect_timeout: float = 3,
+        endpoint_timeouts: Optional[Dict[str, Any]] = None,
+        pool_connections: int = 4,
+        pool_maxsize: int = 16,
+        max_retries: int = 2,
+        backoff_factor: float = 0.3,
+        fanout_workers: int = 8,
+        fanout_budget: float = 15
+    ):
+        """
+        Args:
+            base_url: API 基礎 URL
+            timeout: 預設讀取逾時（秒）
+            connect_timeout: 預設連線逾時（秒）
+            endpoint_timeouts: 端點樣式（fnmatch）對應的逾時設定
+            pool_connections: 連線池數量
+            pool_maxsize: 每個連線池的最大連線數
+            max_retries: 最大重試次數（僅限冪等方法）
+            backoff_factor: 重試退避係數
+            fanout_workers: 並行子查詢的最大執行緒數
+            fanout_budget: 單一請求中並行子查詢的時間預算（秒）
+        """
+        self.base_url = base_url.rstrip('/')
+        self.default_timeout = (connect_timeout, timeout)
+        self.endpoint_timeouts = {
+            pattern: self._normalize_timeout(value, connect_timeout)
+            for pattern, value in (endpoint_timeouts or {}).items()
+        }
+        self.pool_maxsize = pool_maxsize
+        self.fanout_budget = fanout_budget
+        # 並行數不超過連線池大小，避免執行緒阻塞在取得連線上
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, min(fanout_workers, pool_maxsize)),
+            thread_name_prefix='road-defect-api'
+        )
+
+        retry = Retry(
+            total=max_retries,
+            connect=max_retries,
+            read=max_retries,
+            status=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=True,
+            max_retries=retry
+        )
+
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update({'Connection': 'keep-alive'})
+
+    @staticmethod
+    def _normalize_timeout(value: Any, connect_timeout: float) -> Tuple[float, float]:
+        """將設定值轉換為 (連線逾時, 讀取逾時)"""
+        if isinstance(value, (list, tuple)):
+            return float(value[0]), float(value[1])
+        return connect_timeout, float(value)
+
+    @classmethod
+    def from_config(cls, api_config: Dict[str, Any]) -> 'RoadDefectApiClient':
+        """根據 config.json 中的 road_defect_api 區段建立客戶端
+
+        Args:
+            api_config: road_defect_api 設定
+
+        Returns:
+            RoadDefectApiClient: 客戶端實例
+        """
+        return cls(
+            timeout=api_config.get('timeout', 5),
+            connect_timeout=api_config.get('connect_timeout', 3),
+            endpoint_timeouts=api_config.get('endpoint_timeouts'),
+            pool_connections=api_config.get('pool_connections', 4),
+            pool_maxsize=api_config.get('pool_maxsize', 16),
+            max_retries=api_config.get('max_retries', 2),
+            backoff_factor=api_config.get('backoff_factor', 0.3),
+            fanout_workers=api_config.get('fanout_workers', 8),
+            fanout_budget=api_config.get('fanout_budget', 15)
+        )
+
+    def url_for(self, endpoint: str) -> str:
+        """組合完整的 API URL"""
+        return f"{self.base_url}/{endpoint.lstrip('/')}"
+
+    def timeout_for(self, endpoint: str) -> Tuple[float, float]:
+        """取得指定端點的逾時設定"""
+        endpoint = endpoint.strip('/')
+        for pattern, timeout in self.endpoint_timeouts.items():
+            if fnmatch(endpoint, pattern):
+                return timeout
+        return self.default_timeout
+
+    def request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+        """透過共用連線池發送請求
+
+        Args:
+            method: HTTP 方法
+            endpoint: API 端點，不包含基礎 URL
+            **kwargs: 傳遞給 requests.Session.request 的其他參數
+
+        Returns:
+            requests.Response: API 響應
+        """
+        kwargs.setdefault('timeout', self.timeout_for(endpoint))
+        return self.session.request(method=method, url=self.url_for(endpoint), **kwargs)
+
+    def close(self):
+        """關閉執行緒池與所有連線"""
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+def init_api_client(app) -> RoadDefectApiClient:
+    """為應用程式（每個 worker）建立共用的 API 客戶端
+
+    Args:
+        app: Flask 應用程式實例
+
+    Returns:
+        RoadDefectApiClient: 客戶端實例
+    """
+    api_config = app.config.get('CURRENT_CONFIG', {}).get('road_defect_api', {})
+    client = RoadDefectApiClient.from_config(api_config)
+    app.extensions['road_defect_api'] = client
+    return client
+
+
+def get_api_client() -> RoadDefectApiClient:
+    """取得目前應用程式的 API 客戶端"""
+    client = current_app.extensions.get('road_defect_api')
+    if client is None:
+        client = init_api_client(current_app)
+    return client
+
+
+def iter_response_content(response: requests.Response, chunk_size: int = 8192):
+    """逐塊輸出串流響應內容，結束後釋放連線回連線池
+
+    Args:
+        response: 以 stream=True 取得的響應
+        chunk_size: 每塊大小
+
+    Yields:
+        bytes: 響應內容
+    """
+    try:
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            yield chunk
+    finally:
+        response.close()
+
+
+def is_client_error(result: Dict[str, Any]) -> bool:
+    """失敗結果是否為上游回報的請求錯誤（4xx，429 除外）"""
+    status_code = result.get('status_code')
+    return status_code is not None and not is_failure_status(status_code)
+
+
+def _send_request(
+    client: RoadDefectApiClient,
+    endpoint: str,
+    method: str,
+    params: Optional[Dict[str, Any]],
+    data: Optional[Dict[str, Any]],
+    stream: bool,
+    cache=None
+) -> Dict[str, Any]:
+    """實際發送請求並解析響應"""
+    # 記錄 API 請求
+    current_app.logger.info(f"正在請求 API: {client.url_for(endpoint)}")
+    if params:
+        current_app.logger.info(f"參數: {json.dumps(params, ensure_ascii=False, indent=2)}")
+    if data:
+        current_app.logger.info(f"資料: {json.dumps(data, ensure_ascii=False, indent=2)}")
+
+    # 透過共用連線池發送請求；斷路器斷開或並行數已達上限時拋出 UpstreamUnavailable
+    guard = get_upstream_guard()
+    permit = guard.acquire(endpoint) if guard is not None else None
+    try:
+        response = client.request(
+            method,
+            endpoint,
+            params=params,
+            json=data if data else None,
+            stream=stream
+        )
+    except Exception:
+        if permit is not None:
+            permit.release(success=False)
+        raise
+    # 串流響應在取得標頭後即歸還名額
+    if permit is not None:
+        permit.release(success=not is_failure_status(response.status_code))
+
+    current_app.logger.debug(f"API 響應狀態碼: {response.status_code}")
+
+    # 如果是流式響應，直接返回
+    if stream:
+        return {
+            'success': response.ok,
+            'status_code': response.status_code,
+            'response': response
+        }
+
+    # 解析響應
+    if response.ok:
+        payload = response.json()
+        if cache is not None:
+            cache.set(endpoint, params, payload)
+        return {
+            'success': True,
+            'data': payload
+        }
+    else:
+        error_message = '未知錯誤'
+        try:
+            error_data = response.json()
+            error_message = error_data.get('message', error_data.get('error', '未知錯誤'))
+        except:
+            error_message = response.text or '未知錯誤'
+
+        current_app.logger.warning(f"API 錯誤: {error_message}")
+        return {
+            'success': False,
+            'message': error_message,
+            'status_code': response.status_code
+        }
+
 
 def call_road_defect_api(
     endpoint: str,
     method: str = 'GET',
     params: Optional[Dict[str, Any]] = None,
     data: Optional[Dict[str, Any]] = None,
-    stream: bool = False
+    stream: bool = False,
+    use_cache: bool = True
 ) -> Dict[str, Any]:
     """
     調用道路瑕疵 API
-    
+
+    GET 非串流請求會先查詢響應快取，並與同時進行的相同請求合併，
+    此時返回的資料由多個呼叫者共用，應視為唯讀。
+
     Args:
         endpoint: API 端點，不包含基礎 URL
         method: HTTP 方法，預設為 GET
         params: URL 參數
         data: POST 資料
         stream: 是否以串流方式獲取響應
-        
+        use_cache: 是否使用響應快取、過期快取與請求合併，False 時一律直接請求上游
+
     Returns:
         Dict: API 響應內容和狀態碼
     """
     try:
-        # 輸出 API 請求參數以便調試
-        print(f"Calling API endpoint: {endpoint}")
-        print(f"Method: {method}")
-        print(f"Params: {params}")
-        print(f"Data: {data}")
-        
-        # 使用對方的 API URL
-        base_url = 'http://140.134.37.59:5002/api/v1'
-        api_url = f"{base_url}/{endpoint.lstrip('/')}"
-        print(f"Full API URL: {api_url}")
-        
-        # 記錄 API 請求
-        current_app.logger.info(f"正在請求 API: {api_url}")
-        if params:
-            current_app.logger.info(f"參數: {json.dumps(params, ensure_ascii=False, indent=2)}")
-        if data:
-            current_app.logger.info(f"資料: {json.dumps(data, ensure_ascii=False, indent=2)}")
-        
-        # 發送請求
-        response = requests.request(
-            method=method,
-            url=api_url,
-            params=params,
-            json=data if data else None,
-            stream=stream
-        )
-        
-        # 輸出響應狀態
-        print(f"API Response status: {response.status_code}")
-        
-        # 如果是流式響應，直接返回
-        if stream:
-            return {
-                'success': response.ok,
-                'status_code': response.status_code,
-                'response': response
-            }
+        client = get_api_client()
+        current_app.logger.debug(f"請求 API 端點: {method} {client.url_for(endpoint)} params={params}")
 
-        # 解析響應
-        if response.ok:
+        if method.upper() != 'GET' or stream or not use_cache:
+            return _send_request(client, endpoint, method, params, data, stream)
+
+        # 僅快取有設定 TTL 的請求
+        cache = get_response_cache()
+        if cache is not None and cache.ttl_for(endpoint) <= 0:
+            cache = None
+
+        def read_cache():
+            cached = cache.get(endpoint, params) if cache is not None else None
+            if cached is None:
+                return None
+            current_app.logger.debug(f"API 快取命中: {endpoint}")
             return {
                 'success': True,
-                'data': response.json()
+                'data': cached
             }
-        else:
-            error_message = '未知錯誤'
+
+        cached_result = read_cache()
+        if cached_result is not None:
+            return cached_result
+
+        def fetch():
             try:
-                error_data = response.json()
-                error_message = error_data.get('message', error_data.get('error', '未知錯誤'))
-            except:
-                error_message = response.text or '未知錯誤'
-            
-            print(f"API Error: {error_message}")
-            return {
-                'success': False,
-                'message': error_message,
-                'status_code': response.status_code
-            }
+                result = _send_request(client, endpoint, method, params, data, stream, cache)
+            except Exception as e:
+                current_app.logger.warning(f"API 呼叫錯誤: {str(e)}")
+                result = {
+                    'success': False,
+                    'message': str(e)
+                }
+                if isinstance(e, UpstreamUnavailable):
+                    result['status_code'] = 503
+            if not result['success'] and cache is not None and not is_client_error(result):
+                # 上游無法使用時改用過期的快取資料
+                stale = cache.get_stale(endpoint, params)
+                if stale is not None:
+                    current_app.logger.debug(f"API 使用過期快取: {endpoint}")
+                    return {
+                        'success': True,
+                        'data': stale,
+                        'stale': True
+                    }
+            return result
+
+        # 合併同時進行的相同請求
+        flight = get_single_flight()
+        if flight is None:
+            return fetch()
+        return flight.do(
+            make_cache_key(endpoint, params),
+            fetch,
+            recheck=read_cache if cache is not None else None
+        )
 
     except Exception as e:
-        print(f"API Call Error: {str(e)}")
+        current_app.logger.warning(f"API 呼叫錯誤: {str(e)}")
         return {
             'success': False,
             'message': str(e)
-        } 
\ No newline at end of file
+        }
+
+
+def call_road_defect_api_many(
+    calls: List[Dict[str, Any]],
+    budget: Optional[float] = None
+) -> List[Dict[str, Any]]:
+    """
+    並行調用多個道路瑕疵 API 子查詢
+
+    Args:
+        calls: 每個子查詢傳給 call_road_defect_api 的參數
+        budget: 整體時間預算（秒），預設使用客戶端設定
+
+    Returns:
+        List[Dict]: 依 calls 順序排列的響應；逾時的子查詢以失敗結果表示
+    """
+    if not calls:
+        return []
+
+    client = get_api_client()
+    app = current_app._get_current_object()
+    budget = client.fanout_budget if budget is None else budget
+
+    def run(call):
+        with app.app_context():
+            return call_road_defect_api(**call)
+
+    # 只有一個子查詢時不需要切換執行緒
+    if len(calls) == 1:
+        return [call_road_defect_api(**calls[0])]
+
+    futures = [client.executor.submit(run, call) for call in calls]
+    done, not_done = wait(futures, timeout=budget)
+
+    results = []
+    for future in futures:
+        if future in done:
+            results.append(future.result())
+        else:
+            future.cancel()
+            results.append({
+                'success': False,
+                'message': f'子查詢超過時間預算（{budget} 秒）',
+                'timeout': True
+            })
+
+    if not_done:
+        current_app.logger.warning(f"{len(not_done)}/{len(calls)} 個子查詢逾時，僅返回部分結果")
+    return results
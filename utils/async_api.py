@@ -0,0 +1,363 @@
+"""
+非同步道路瑕疵 API 客戶端
+
+每個 worker 行程啟動一個專用的事件迴圈執行緒，以 httpx.AsyncClient 發送上游請求：
+所有請求共用同一個 keep-alive 連線池，等待上游時不佔用執行緒，
+同時進行的相同 GET 請求在事件迴圈內合併為一次。
+
+非同步視圖的協程在 ASGI 伺服器的事件迴圈上執行，透過 run_coroutine_threadsafe
+將請求交給上游事件迴圈並等待結果。協程中只 await 上游請求，
+資料庫查詢、聚合、JSON 解析與模板渲染等阻塞工作以 run_sync 交給執行緒池，
+不會佔住事件迴圈。未安裝 httpx 或未啟用時改在執行緒中呼叫同步客戶端，
+返回格式與 call_road_defect_api 相同。
+
+Flask 2.0 經由 WsgiToAsgi 轉接，呼叫非同步視圖的請求執行緒會在 AsyncToSync 中
+阻塞到協程完成，每個請求仍佔用一個執行緒（見 asgi.py）。非同步客戶端減少的是
+單一請求內上游子查詢所需的執行緒，而不是每個 worker 可同時處理的請求數。
+"""
+import asyncio
+import functools
+import os
+import threading
+from asgiref.sync import sync_to_async
+from flask import current_app
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from config.database import db
+from utils.api import call_road_defect_api, get_api_client, is_client_error
+from utils.breaker import UpstreamUnavailable, get_upstream_guard, is_failure_status
+from utils.cache import get_response_cache, make_cache_key
+
+try:
+    import httpx
+except ImportError:  # 選用套件，未安裝時使用同步客戶端
+    httpx = None
+
+# 重試的上游狀態碼（與同步客戶端相同）
+RETRY_STATUSES = (502, 503, 504)
+
+
+class AsyncRoadDefectApiClient:
+    """在專用事件迴圈上執行的非同步 API 客戶端
+
+    URL 與逾時設定沿用同步客戶端，兩者的設定始終一致。
+    """
+
+    def __init__(self, max_connections: int = 100, max_retries: int = 2, backoff_factor: float = 0.3):
+        """
+        Args:
+            max_connections: 連線池的最大連線數
+            max_retries: 最大重試次數（僅限 GET）
+            backoff_factor: 重試退避係數
+        """
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._client = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """確保目前行程的事件迴圈執行緒已啟動（fork 後重新建立）"""
+        if self._pid == os.getpid():
+            return self._loop
+        with self._lock:
+            if self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name='road-defect-api-async', daemon=True)
+                thread.start()
+                self._client = None
+                self._inflight = {}
+                self._loop = loop
+                self._pid = os.getpid()
+        return self._loop
+
+    def _get_client(self):
+        """取得連線池（只在事件迴圈執行緒中呼叫）"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections
+            ))
+        return self._client
+
+    async def _send(self, method: str, url: str, timeout, params, data) -> Any:
+        """發送請求，連線錯誤與 502/503/504 以指數退避重試"""
+        client = self._get_client()
+        connect_timeout, read_timeout = timeout
+        retries = self.max_retries if method == 'GET' else 0
+        for attempt in range(retries + 1):
+            try:
+                response = await client.request(
+                    method, url,
+                    params=params,
+                    json=data if data else None,
+                    timeout=httpx.Timeout(read_timeout, connect=connect_timeout)
+                )
+                if response.status_code not in RETRY_STATUSES or attempt == retries:
+                    return response
+            except httpx.TransportError:
+                if attempt == retries:
+                    raise
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+
+    async def _shared(self, key: str, make: Callable[[], Awaitable[Any]]) -> Any:
+        """合併同時進行的相同請求（只在事件迴圈執行緒中呼叫）"""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(make())
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(future)
+
+    async def request(self, method: str, url: str, timeout, params=None, data=None) -> Any:
+        """在上游事件迴圈中發送請求，可從任何事件迴圈 await
+
+        Returns:
+            httpx.Response: API 響應
+        """
+        loop = self._ensure_loop()
+        method = method.upper()
+        if method == 'GET':
+            coroutine = self._shared(
+                make_cache_key(url, params),
+                functools.partial(self._send, method, url, timeout, params, data)
+            )
+        else:
+            coroutine = self._send(method, url, timeout, params, data)
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+    def close(self):
+        if self._loop is not None and self._pid == os.getpid():
+            if self._client is not None:
+                asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+        self._pid = None
+
+
+async def run_sync(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """在執行緒池中執行阻塞的工作並等待結果
+
+    請求與應用程式上下文會一併帶入執行緒；資料庫 session 以執行緒區分，
+    結束時移除，不會留給下一個使用同一執行緒的請求。
+
+    Args:
+        fn: 要執行的同步函數
+        *args: 位置參數
+        **kwargs: 關鍵字參數
+
+    Returns:
+        Any: fn 的返回值
+    """
+    def call():
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            db.session.remove()
+
+    return await sync_to_async(call, thread_sensitive=False)()
+
+
+def _parse_response(response) -> Dict[str, Any]:
+    """解析響應為與 call_road_defect_api 相同的格式"""
+    current_app.logger.debug(f"API 響應狀態碼: {response.status_code}")
+    if response.is_success:
+        return {
+            'success': True,
+            'data': response.json()
+        }
+
+    try:
+        error_data = response.json()
+        error_message = error_data.get('message', error_data.get('error', '未知錯誤'))
+    except ValueError:
+        error_message = response.text or '未知錯誤'
+    current_app.logger.warning(f"API 錯誤: {error_message}")
+    return {
+        'success': False,
+        'message': error_message,
+        'status_code': response.status_code
+    }
+
+
+async def async_call_road_defect_api(
+    endpoint: str,
+    method: str = 'GET',
+    params: Optional[Dict[str, Any]] = None,
+    data: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """非同步調用道路瑕疵 API（不支援串流）
+
+    GET 請求同樣先查詢響應快取，成功的結果寫入快取；上游無法使用時改用過期的快取資料。
+
+    Args:
+        endpoint: API 端點，不包含基礎 URL
+        method: HTTP 方法，預設為 GET
+        params: URL 參數
+        data: POST 資料
+
+    Returns:
+        Dict: 與 call_road_defect_api 相同格式的響應
+    """
+    client = get_async_api_client()
+    if client is None:
+        return await run_sync(call_road_defect_api, endpoint, method=method, params=params, data=data)
+
+    current_app.logger.debug(f"非同步請求 API 端點: {endpoint}")
+    cache = get_response_cache() if method.upper() == 'GET' else None
+    if cache is not None and cache.ttl_for(endpoint) <= 0:
+        cache = None
+
+    def read_cache():
+        cached = cache.get(endpoint, params)
+        if cached is None:
+            return None
+        current_app.logger.debug(f"API 快取命中: {endpoint}")
+        return {
+            'success': True,
+            'data': cached
+        }
+
+    def finish(response):
+        result = _parse_response(response)
+        if result['success'] and cache is not None:
+            cache.set(endpoint, params, result['data'])
+        return result
+
+    def read_stale():
+        stale = cache.get_stale(endpoint, params)
+        if stale is None:
+            return None
+        current_app.logger.debug(f"API 使用過期快取: {endpoint}")
+        return {
+            'success': True,
+            'data': stale,
+            'stale': True
+        }
+
+    try:
+        # 快取讀寫與 JSON 解析在執行緒池中進行，事件迴圈上只等待上游請求
+        if cache is not None:
+            cached = await run_sync(read_cache)
+            if cached is not None:
+                return cached
+
+        api_client = get_api_client()
+        guard = get_upstream_guard()
+        permit = await guard.acquire_async(endpoint) if guard is not None else None
+        try:
+            response = await client.request(
+                method,
+                api_client.url_for(endpoint),
+                api_client.timeout_for(endpoint),
+                params=params,
+                data=data
+            )
+        except BaseException:
+            if permit is not None:
+                permit.release(success=False)
+            raise
+        if permit is not None:
+            permit.release(success=not is_failure_status(response.status_code))
+        result = await run_sync(finish, response)
+    except Exception as e:
+        current_app.logger.warning(f"API 呼叫錯誤: {str(e)}")
+        result = {
+            'success': False,
+            'message': str(e)
+        }
+        if isinstance(e, UpstreamUnavailable):
+            result['status_code'] = 503
+
+    if not result['success'] and cache is not None and not is_client_error(result):
+        # 上游無法使用時改用過期的快取資料
+        stale = await run_sync(read_stale)
+        if stale is not None:
+            return stale
+    return result
+
+
+async def async_call_road_defect_api_many(
+    calls: List[Dict[str, Any]],
+    budget: Optional[float] = None
+) -> List[Dict[str, Any]]:
+    """並行調用多個道路瑕疵 API 子查詢（非同步版本的 call_road_defect_api_many）
+
+    Args:
+        calls: 每個子查詢傳給 async_call_road_defect_api 的參數
+        budget: 整體時間預算（秒），預設使用客戶端設定
+
+    Returns:
+        List[Dict]: 依 calls 順序排列的響應；逾時的子查詢以失敗結果表示
+    """
+    if not calls:
+        return []
+
+    budget = get_api_client().fanout_budget if budget is None else budget
+    tasks = [asyncio.ensure_future(async_call_road_defect_api(**call)) for call in calls]
+    done, not_done = await asyncio.wait(tasks, timeout=budget)
+
+    results = []
+    for task in tasks:
+        if task in done:
+            results.append(task.result())
+        else:
+            task.cancel()
+            results.append({
+                'success': False,
+                'message': f'子查詢超過時間預算（{budget} 秒）',
+                'timeout': True
+            })
+
+    if not_done:
+        current_app.logger.warning(f"{len(not_done)}/{len(calls)} 個子查詢逾時，僅返回部分結果")
+    return results
+
+
+def async_view(fn: Callable[..., Awaitable[Any]]) -> Callable[..., Any]:
+    """將非同步視圖包裝為同步函數
+
+    Flask-Login 0.5 的 login_required 不支援協程，放在 login_required 之下使用：
+
+        @login_required
+        @async_view
+        async def view(): ...
+
+    在 ASGI 下協程於伺服器的事件迴圈上執行，視圖中的阻塞工作必須以 run_sync 執行。
+    呼叫端的請求執行緒會阻塞等待協程完成，因此每個請求仍佔用一個執行緒。
+    """
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return current_app.ensure_sync(fn)(*args, **kwargs)
+    return wrapper
+
+
+def init_async_api_client(app) -> Optional[AsyncRoadDefectApiClient]:
+    """根據設定建立非同步 API 客戶端
+
+    Args:
+        app: Flask 應用程式實例
+
+    Returns:
+        Optional[AsyncRoadDefectApiClient]: 客戶端，未啟用或未安裝 httpx 時返回 None
+    """
+    api_config = app.config.get('CURRENT_CONFIG', {}).get('road_defect_api', {})
+    async_config = api_config.get('async', {})
+    if not async_config.get('enabled', False) or httpx is None:
+        app.extensions['road_defect_api_async'] = None
+        return None
+
+    client = AsyncRoadDefectApiClient(
+        max_connections=async_config.get('max_connections', 100),
+        max_retries=api_config.get('max_retries', 2),
+        backoff_factor=api_config.get('backoff_factor', 0.3)
+    )
+    app.extensions['road_defect_api_async'] = client
+    return client
+
+
+def get_async_api_client() -> Optional[AsyncRoadDefectApiClient]:
+    """取得目前應用程式的非同步 API 客戶端"""
+    return current_app.extensions.get('road_defect_api_async')
@@ -3,8 +3,8 @@
 """
 from functools import wraps
 from flask import request, jsonify
-from road_defect_management.utils.jwt import verify_token
-from road_defect_management.models.user import User
+from utils.identity import load_user_by_id
+from utils.jwt import verify_token
 
 def login_required(f):
     """檢查使用者是否已登入的裝飾器
@@ -36,7 +36,7 @@ def login_required(f):
             }), 401
             
         user_id = payload.get('user_id')
-        user = User.query.get(user_id)
+        user = load_user_by_id(user_id)
         if not user:
             return jsonify({
                 'message': '使用者不存在'
@@ -0,0 +1,156 @@
+"""
+背景排程工具
+
+以 daemon 執行緒在應用程式上下文中週期性執行工作。
+執行緒在每個 worker 行程的第一個請求時才啟動，
+因此在預先載入應用程式後 fork 的 worker 中也能正常運作。
+
+會寫入共用資源（資料庫、磁碟、上游 API）的工作以 leader=True 註冊：
+所有 worker 競爭同一個檔案鎖，只有持有鎖的 worker 執行工作，
+其餘 worker 改為執行 follower（例如讀取 leader 發布的快照）或略過。
+持有鎖的 worker 結束後由下一個執行到的 worker 接手。
+"""
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 不支援 fcntl，只有單一行程，一律視為 leader
+    fcntl = None
+
+
+class PeriodicTask:
+    """週期性背景工作"""
+
+    def __init__(
+        self,
+        app,
+        name: str,
+        interval: float,
+        fn: Callable[[], None],
+        leader: bool = False,
+        follower: Optional[Callable[[], None]] = None
+    ):
+        """
+        Args:
+            app: Flask 應用程式實例
+            name: 工作名稱（用於日誌與執行緒名稱）
+            interval: 執行間隔（秒）
+            fn: 要執行的函數，會在應用程式上下文中呼叫
+            leader: 是否只在取得 leader 鎖的行程中執行 fn
+            follower: 未取得 leader 鎖的行程改為執行的函數，None 表示略過
+        """
+        self.app = app
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.leader = leader
+        self.follower = follower
+        self.last_run_at = None
+        self.last_error = None
+        self._pid = None
+        self._leader_file = None
+        self._leader_pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+    def ensure_started(self):
+        """確保目前行程中的背景執行緒已啟動（app.config['PERIODIC_TASKS'] 為 False 時不啟動）"""
+        if self._pid == os.getpid() or not self.app.config.get('PERIODIC_TASKS', True):
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._stop.clear()
+            thread = threading.Thread(target=self._loop, name=f'task-{self.name}', daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def trigger(self):
+        """要求背景執行緒立即執行一次"""
+        self._wakeup.set()
+
+    def stop(self):
+        """停止背景執行緒"""
+        self._stop.set()
+        self._wakeup.set()
+
+    def is_leader(self) -> bool:
+        """目前行程是否負責執行工作（取得鎖後持有到行程結束）"""
+        if not self.leader or fcntl is None:
+            return True
+        if self._leader_pid == os.getpid():
+            return True
+        lock_dir = os.path.join(self.app.instance_path, 'locks')
+        os.makedirs(lock_dir, exist_ok=True)
+        lock_file = open(os.path.join(lock_dir, f'task-{self.name}.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._leader_file = lock_file
+        self._leader_pid = os.getpid()
+        return True
+
+    def run_once(self):
+        """在目前執行緒中執行一次工作"""
+        with self.app.app_context():
+            try:
+                fn = self.fn if self.is_leader() else self.follower
+                if fn is None:
+                    return
+                fn()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                self.app.logger.error(f"背景工作 {self.name} 執行失敗: {str(e)}")
+            finally:
+                self.last_run_at = time.time()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.run_once()
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def status(self) -> Dict:
+        """取得工作狀態"""
+        return {
+            'name': self.name,
+            'interval': self.interval,
+            'running': self._pid == os.getpid(),
+            'leader': self._leader_pid == os.getpid() if self.leader else None,
+            'last_run_at': self.last_run_at,
+            'last_error': self.last_error
+        }
+
+
+def register_periodic_task(
+    app,
+    name: str,
+    interval: float,
+    fn: Callable[[], None],
+    leader: bool = False,
+    follower: Optional[Callable[[], None]] = None
+) -> PeriodicTask:
+    """註冊週期性背景工作，於每個 worker 的第一個請求時啟動
+
+    Args:
+        app: Flask 應用程式實例
+        name: 工作名稱
+        interval: 執行間隔（秒）
+        fn: 要執行的函數
+        leader: 是否只在一個 worker 中執行 fn
+        follower: 其餘 worker 執行的函數
+
+    Returns:
+        PeriodicTask: 背景工作
+    """
+    task = PeriodicTask(app, name, interval, fn, leader=leader, follower=follower)
+    app.extensions.setdefault('periodic_tasks', {})[name] = task
+    app.before_request(task.ensure_started)
+    return task
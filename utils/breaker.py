@@ -0,0 +1,343 @@
+"""
+上游 API 斷路器與自適應並行上限
+
+上游變慢時避免所有 worker 執行緒堆積在等待上游：
+1. 斷路器（逐端點）：最近一段時間內失敗或過慢的比例超過門檻即斷開，
+   斷開期間直接拒絕請求；經過冷卻時間後進入半開狀態，放行少量探測請求，
+   探測成功則恢復，失敗則再次斷開
+2. 自適應並行上限（AIMD）：限制同時進行的上游請求數，
+   請求成功且未超過延遲目標時逐步提高上限，失敗或過慢時按比例降低上限
+
+被拒絕的請求拋出 UpstreamUnavailable，由呼叫端改用快取資料或立即返回錯誤。
+"""
+import asyncio
+import re
+import threading
+import time
+from collections import deque
+from flask import current_app
+from typing import Any, Dict, Optional
+
+# 斷路器狀態
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class UpstreamUnavailable(Exception):
+    """斷路器斷開或並行數已達上限，請求未送出"""
+
+
+def endpoint_key(endpoint: str) -> str:
+    """將端點中的數字 ID 替換為 *，同類端點共用一個斷路器"""
+    return re.sub(r'(?<=/)\d+(?=/|$)', '*', '/' + endpoint.strip('/'))[1:]
+
+
+class CircuitBreaker:
+    """單一端點的斷路器"""
+
+    def __init__(
+        self,
+        window: float = 30,
+        minimum_calls: int = 10,
+        failure_rate: float = 0.5,
+        slow_call_duration: float = 3,
+        slow_call_rate: float = 0.8,
+        open_duration: float = 15,
+        half_open_calls: int = 2
+    ):
+        """
+        Args:
+            window: 統計失敗率的時間窗（秒）
+            minimum_calls: 時間窗內至少需要的請求數，不足時不斷開
+            failure_rate: 失敗比例門檻
+            slow_call_duration: 超過此時間（秒）視為過慢
+            slow_call_rate: 過慢比例門檻
+            open_duration: 斷開後等待多久（秒）進入半開狀態
+            half_open_calls: 半開狀態放行的探測請求數，全部成功才恢復
+        """
+        self.window = window
+        self.minimum_calls = minimum_calls
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self.opened_at = None
+        self.rejected = 0
+        self._calls = deque()  # (完成時間, 是否失敗, 是否過慢)
+        self._probes = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """是否放行一個請求（半開狀態下會佔用一個探測名額）"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.open_duration:
+                self.state = HALF_OPEN
+                self._probes = 0
+                self._probe_successes = 0
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and self._probes < self.half_open_calls:
+                self._probes += 1
+                return True
+            self.rejected += 1
+            return False
+
+    def cancel(self):
+        """放行後未實際送出請求，歸還半開狀態的探測名額"""
+        with self._lock:
+            if self.state == HALF_OPEN and self._probes > 0:
+                self._probes -= 1
+
+    def record(self, success: bool, elapsed: float):
+        """記錄請求結果
+
+        Args:
+            success: 是否成功（連線錯誤、逾時與 5xx 視為失敗）
+            elapsed: 耗時（秒）
+        """
+        slow = elapsed >= self.slow_call_duration
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                if not success or slow:
+                    self._open(now)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_calls:
+                        self.state = CLOSED
+                        self._calls.clear()
+                return
+            if self.state == OPEN:
+                return
+
+            self._calls.append((now, not success, slow))
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+            total = len(self._calls)
+            if total < self.minimum_calls:
+                return
+            failures = sum(1 for _, failed, _ in self._calls if failed)
+            slow_calls = sum(1 for _, _, is_slow in self._calls if is_slow)
+            if failures / total >= self.failure_rate or slow_calls / total >= self.slow_call_rate:
+                self._open(now)
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self._calls.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'state': self.state,
+                'calls': len(self._calls),
+                'rejected': self.rejected
+            }
+
+
+class AdaptiveConcurrencyLimiter:
+    """以 AIMD 調整的上游並行請求上限"""
+
+    def __init__(
+        self,
+        initial_limit: int = 8,
+        min_limit: int = 1,
+        max_limit: int = 32,
+        latency_target: float = 2,
+        backoff_ratio: float = 0.9,
+        queue_timeout: float = 0.5
+    ):
+        """
+        Args:
+            initial_limit: 初始上限
+            min_limit: 最小上限
+            max_limit: 最大上限
+            latency_target: 延遲目標（秒），超過時視為壅塞
+            backoff_ratio: 壅塞時上限乘上的比例
+            queue_timeout: 達到上限時最多等待多久（秒）
+        """
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.backoff_ratio = backoff_ratio
+        self.queue_timeout = queue_timeout
+        self.inflight = 0
+        self.rejected = 0
+        self._condition = threading.Condition()
+
+    def try_acquire(self) -> bool:
+        """不等待，嘗試取得一個名額"""
+        with self._condition:
+            if self.inflight < int(self.limit):
+                self.inflight += 1
+                return True
+            return False
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """取得一個名額，達到上限時最多等待 timeout 秒
+
+        Returns:
+            bool: 是否取得名額
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._condition:
+            if not self._condition.wait_for(lambda: self.inflight < int(self.limit), timeout=timeout):
+                self.rejected += 1
+                return False
+            self.inflight += 1
+            return True
+
+    def reject(self):
+        """記錄一次未取得名額（非同步呼叫端自行等待後放棄時使用）"""
+        with self._condition:
+            self.rejected += 1
+
+    def release(self, success: bool, elapsed: float):
+        """歸還名額並調整上限
+
+        Args:
+            success: 是否成功
+            elapsed: 耗時（秒）
+        """
+        with self._condition:
+            if not success or elapsed > self.latency_target:
+                self.limit = max(self.min_limit, self.limit * self.backoff_ratio)
+            elif self.inflight * 2 >= self.limit:
+                # 只有在上限確實被使用時才提高，避免閒置時無限增長
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.inflight -= 1
+            self._condition.notify()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                'limit': int(self.limit),
+                'inflight': self.inflight,
+                'rejected': self.rejected
+            }
+
+
+class UpstreamPermit:
+    """已放行的上游請求，完成後必須呼叫 release"""
+
+    def __init__(self, guard: 'UpstreamGuard', breaker: Optional[CircuitBreaker], limited: bool):
+        self.guard = guard
+        self.breaker = breaker
+        self.limited = limited
+        self.started_at = time.monotonic()
+
+    def release(self, success: bool):
+        """記錄結果並歸還並行名額"""
+        elapsed = time.monotonic() - self.started_at
+        if self.breaker is not None:
+            self.breaker.record(success, elapsed)
+        if self.limited:
+            self.guard.limiter.release(success, elapsed)
+
+
+class UpstreamGuard:
+    """組合逐端點斷路器與共用的並行上限"""
+
+    def __init__(self, breaker_config: Optional[Dict[str, Any]] = None, limiter: Optional[AdaptiveConcurrencyLimiter] = None):
+        """
+        Args:
+            breaker_config: 斷路器參數，None 表示不啟用斷路器
+            limiter: 並行上限，None 表示不限制
+        """
+        self.breaker_config = breaker_config
+        self.limiter = limiter
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def breaker_for(self, endpoint: str) -> Optional[CircuitBreaker]:
+        """取得端點的斷路器"""
+        if self.breaker_config is None:
+            return None
+        key = endpoint_key(endpoint)
+        breaker = self.breakers.get(key)
+        if breaker is None:
+            with self._lock:
+                breaker = self.breakers.setdefault(key, CircuitBreaker(**self.breaker_config))
+        return breaker
+
+    def _check_breaker(self, endpoint: str) -> Optional[CircuitBreaker]:
+        breaker = self.breaker_for(endpoint)
+        if breaker is not None and not breaker.allow():
+            raise UpstreamUnavailable(f'上游端點 {endpoint_key(endpoint)} 暫時無法使用（斷路器斷開）')
+        return breaker
+
+    def _reject(self, breaker: Optional[CircuitBreaker]):
+        if breaker is not None:
+            breaker.cancel()
+        raise UpstreamUnavailable('上游請求數已達並行上限')
+
+    def acquire(self, endpoint: str) -> UpstreamPermit:
+        """放行一個上游請求
+
+        Raises:
+            UpstreamUnavailable: 斷路器斷開或並行數已達上限
+        """
+        breaker = self._check_breaker(endpoint)
+        if self.limiter is not None and not self.limiter.acquire():
+            self._reject(breaker)
+        return UpstreamPermit(self, breaker, self.limiter is not None)
+
+    async def acquire_async(self, endpoint: str) -> UpstreamPermit:
+        """非同步版本的 acquire，等待名額時不阻塞事件迴圈"""
+        breaker = self._check_breaker(endpoint)
+        if self.limiter is not None:
+            deadline = time.monotonic() + self.limiter.queue_timeout
+            while not self.limiter.try_acquire():
+                if time.monotonic() >= deadline:
+                    self.limiter.reject()
+                    self._reject(breaker)
+                await asyncio.sleep(0.01)
+        return UpstreamPermit(self, breaker, self.limiter is not None)
+
+    def stats(self) -> Dict[str, Any]:
+        """取得斷路器與並行上限的狀態"""
+        return {
+            'breakers': {key: breaker.stats() for key, breaker in list(self.breakers.items())},
+            'concurrency': self.limiter.stats() if self.limiter is not None else None
+        }
+
+
+def is_failure_status(status_code: int) -> bool:
+    """上游響應是否應計為失敗（5xx 與 429）"""
+    return status_code >= 500 or status_code == 429
+
+
+def init_upstream_guard(app) -> Optional[UpstreamGuard]:
+    """根據設定建立上游斷路器與並行上限
+
+    Args:
+        app: Flask 應用程式實例
+
+    Returns:
+        Optional[UpstreamGuard]: 兩者皆未啟用時返回 None
+    """
+    api_config = app.config.get('CURRENT_CONFIG', {}).get('road_defect_api', {})
+    breaker_config = dict(api_config.get('circuit_breaker', {}))
+    limit_config = dict(api_config.get('concurrency_limit', {}))
+    breaker_enabled = breaker_config.pop('enabled', False)
+    limit_enabled = limit_config.pop('enabled', False)
+    if not breaker_enabled and not limit_enabled:
+        app.extensions['road_defect_guard'] = None
+        return None
+
+    guard = UpstreamGuard(
+        breaker_config=breaker_config if breaker_enabled else None,
+        limiter=AdaptiveConcurrencyLimiter(**limit_config) if limit_enabled else None
+    )
+    app.extensions['road_defect_guard'] = guard
+    return guard
+
+
+def get_upstream_guard() -> Optional[UpstreamGuard]:
+    """取得目前應用程式的上游斷路器與並行上限"""
+    return current_app.extensions.get('road_defect_guard')
@@ -0,0 +1,319 @@
+"""
+上游 API 響應快取
+
+提供標準化的快取鍵、逐端點 TTL、以位元組數為上限的 LRU 淘汰，
+以及可替換的儲存後端：
+1. memory：單一 worker 內的記憶體快取
+2. sqlite：同一主機上所有 gunicorn worker 共用的 SQLite 檔案
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatch
+from flask import current_app
+from typing import Dict, Any, Optional, Tuple
+
+
+def _canonical(value: Any) -> Any:
+    """將參數值轉換為與順序無關的標準形式"""
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in sorted(value.items())}
+    if isinstance(value, (list, tuple, set)):
+        return sorted((_canonical(v) for v in value), key=lambda v: json.dumps(v, sort_keys=True))
+    return value
+
+
+def make_cache_key(endpoint: str, params: Optional[Dict[str, Any]] = None) -> str:
+    """根據端點與排序後的參數建立快取鍵
+
+    Args:
+        endpoint: API 端點
+        params: URL 參數
+
+    Returns:
+        str: 快取鍵
+    """
+    canonical_params = _canonical({k: v for k, v in (params or {}).items() if v is not None})
+    return f"{endpoint.strip('/')}?{json.dumps(canonical_params, ensure_ascii=False, sort_keys=True)}"
+
+
+class MemoryCacheBackend:
+    """單一 worker 內的 LRU 記憶體快取後端"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024):
+        """
+        Args:
+            max_bytes: 快取內容的總位元組上限
+        """
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + ttl, value)
+            self.total_bytes += len(value)
+            while self.total_bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def _remove(self, key: str):
+        _, value = self._entries.pop(key)
+        self.total_bytes -= len(value)
+
+    def size(self) -> Dict[str, int]:
+        return {'entries': len(self._entries), 'bytes': self.total_bytes}
+
+
+class SQLiteCacheBackend:
+    """同一主機上多個 worker 共用的 SQLite 快取後端"""
+
+    def __init__(self, path: str, max_bytes: int = 256 * 1024 * 1024):
+        """
+        Args:
+            path: SQLite 檔案路徑
+            max_bytes: 快取內容的總位元組上限
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS api_cache ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, '
+                'expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_api_cache_accessed_at ON api_cache (accessed_at)')
+
+    def _connect(self) -> sqlite3.Connection:
+        """取得目前執行緒（與行程）專用的連線"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key: str) -> Optional[bytes]:
+        conn = self._connect()
+        now = time.time()
+        row = conn.execute('SELECT value, expires_at FROM api_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] <= now:
+            conn.execute('DELETE FROM api_cache WHERE key = ?', (key,))
+            return None
+        conn.execute('UPDATE api_cache SET accessed_at = ? WHERE key = ?', (now, key))
+        return bytes(row[0])
+
+    def set(self, key: str, value: bytes, ttl: float):
+        if len(value) > self.max_bytes:
+            return
+        conn = self._connect()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO api_cache (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)',
+                (key, value, len(value), now + ttl, now)
+            )
+            conn.execute('DELETE FROM api_cache WHERE expires_at <= ?', (now,))
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM api_cache').fetchone()[0]
+            # 依最近存取時間淘汰，直到總大小低於上限
+            while total > self.max_bytes:
+                row = conn.execute('SELECT key, size FROM api_cache ORDER BY accessed_at LIMIT 1').fetchone()
+                if row is None:
+                    break
+                conn.execute('DELETE FROM api_cache WHERE key = ?', (row[0],))
+                total -= row[1]
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def delete(self, key: str):
+        self._connect().execute('DELETE FROM api_cache WHERE key = ?', (key,))
+
+    def clear(self):
+        self._connect().execute('DELETE FROM api_cache')
+
+    def size(self) -> Dict[str, int]:
+        row = self._connect().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM api_cache').fetchone()
+        return {'entries': row[0], 'bytes': row[1]}
+
+
+class ResponseCache:
+    """上游 API 響應快取（逐端點 TTL）
+
+    每筆資料在 TTL 之後再保留 stale_ttl 秒，上游無法使用時可讀取這些過期資料。
+    """
+
+    def __init__(self, backend, ttls: Optional[Dict[str, float]] = None, stale_ttl: float = 0):
+        """
+        Args:
+            backend: 儲存後端
+            ttls: 端點樣式（fnmatch）對應的 TTL（秒），未列出的端點不快取
+            stale_ttl: 過期資料的保留時間（秒）
+        """
+        self.backend = backend
+        self.ttls = ttls or {}
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.stores = 0
+        self._lock = threading.Lock()
+
+    def ttl_for(self, endpoint: str) -> float:
+        """取得指定端點的 TTL，0 表示不快取"""
+        endpoint = endpoint.strip('/')
+        if endpoint in self.ttls:
+            return self.ttls[endpoint]
+        for pattern, ttl in self.ttls.items():
+            if fnmatch(endpoint, pattern):
+                return ttl
+        return 0
+
+    def _read(self, endpoint: str, params: Optional[Dict[str, Any]]) -> Tuple[Optional[float], Any]:
+        """讀取 (到期時間, 資料)，未命中時返回 (None, None)"""
+        value = self.backend.get(make_cache_key(endpoint, params))
+        if value is None:
+            return None, None
+        expires_at, _, payload = value.partition(b'\n')
+        try:
+            return float(expires_at), json.loads(payload)
+        except ValueError:
+            return None, None
+
+    def get(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Optional[Any]:
+        """讀取快取的響應資料
+
+        Args:
+            endpoint: API 端點
+            params: URL 參數
+
+        Returns:
+            Optional[Any]: 快取的響應資料，未命中或已過期則返回 None
+        """
+        expires_at, data = self._read(endpoint, params)
+        with self._lock:
+            if expires_at is None or expires_at < time.time():
+                self.misses += 1
+                return None
+            self.hits += 1
+        return data
+
+    def get_stale(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Optional[Any]:
+        """讀取快取的響應資料，包含已過期但仍在保留時間內的資料"""
+        expires_at, data = self._read(endpoint, params)
+        if expires_at is None:
+            return None
+        with self._lock:
+            self.stale_hits += 1
+        return data
+
+    def set(self, endpoint: str, params: Optional[Dict[str, Any]], data: Any, ttl: Optional[float] = None):
+        """寫入響應資料
+
+        Args:
+            endpoint: API 端點
+            params: URL 參數
+            data: 響應資料（需可序列化為 JSON）
+            ttl: TTL（秒），預設依端點設定
+        """
+        ttl = self.ttl_for(endpoint) if ttl is None else ttl
+        if ttl <= 0:
+            return
+        # 以第一行記錄到期時間，後端保留到過期資料的保留時間結束
+        value = f'{time.time() + ttl:.3f}\n'.encode('ascii') + json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.backend.set(make_cache_key(endpoint, params), value, ttl + self.stale_ttl)
+        with self._lock:
+            self.stores += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """取得快取統計"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                'backend': type(self.backend).__name__,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_hits': self.stale_hits,
+                'stores': self.stores,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+        stats.update(self.backend.size())
+        return stats
+
+
+def init_response_cache(app) -> Optional[ResponseCache]:
+    """根據設定建立響應快取
+
+    Args:
+        app: Flask 應用程式實例
+
+    Returns:
+        Optional[ResponseCache]: 快取實例，未啟用時返回 None
+    """
+    api_config = app.config.get('CURRENT_CONFIG', {}).get('road_defect_api', {})
+    cache_config = api_config.get('cache', {})
+    if not cache_config.get('enabled', False):
+        app.extensions['road_defect_cache'] = None
+        return None
+
+    backend_name = cache_config.get('backend', 'memory')
+    max_bytes = cache_config.get('max_bytes', 64 * 1024 * 1024)
+    if backend_name == 'sqlite':
+        path = cache_config.get('path', 'api_cache.db')
+        if not os.path.isabs(path):
+            path = os.path.join(app.instance_path, path)
+        backend = SQLiteCacheBackend(path, max_bytes=max_bytes)
+    elif backend_name == 'memory':
+        backend = MemoryCacheBackend(max_bytes=max_bytes)
+    else:
+        raise ValueError(f'不支援的快取後端: {backend_name}')
+
+    cache = ResponseCache(
+        backend,
+        ttls=cache_config.get('ttl', {}),
+        stale_ttl=cache_config.get('stale_ttl', 0)
+    )
+    app.extensions['road_defect_cache'] = cache
+    return cache
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """取得目前應用程式的響應快取"""
+    return current_app.extensions.get('road_defect_cache')
@@ -0,0 +1,426 @@
+"""
+瑕疵資料欄式記憶體儲存
+
+將瑕疵記錄轉換為 NumPy 欄位陣列：城市、行政區與道路以字典編碼，
+類型、嚴重程度與拍攝時間以整數欄位儲存，查詢條件以向量化布林遮罩計算。
+原始記錄以 JSON 位元組保存，每 RECORD_BLOCK_SIZE 筆以 zlib 壓縮為一個區塊，
+只在輸出選取的資料列時才解壓縮所在的區塊。
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+import zlib
+import numpy as np
+from flask import current_app
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple
+from utils.api import call_road_defect_api
+from utils.background import register_periodic_task
+from utils.replica import is_replica_mode, load_all_records
+from utils.spatial import BBox, GridIndex
+from utils.timeutil import parse_time
+
+# 缺少數值時的填充值
+MISSING_INT = -1
+MISSING_TIME = np.iinfo(np.int64).min
+
+_EPOCH = parse_time('1970-01-01T00:00:00+00:00')
+
+# 原始記錄每個壓縮區塊的筆數
+RECORD_BLOCK_SIZE = 256
+
+
+def _enum_value(value: Any) -> int:
+    """取得 {'value': ..., 'name': ...} 格式欄位的數值"""
+    if isinstance(value, dict):
+        value = value.get('value')
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return MISSING_INT
+
+
+def _to_float(value: Any) -> float:
+    """轉換為浮點數，缺少或無法轉換時為 NaN"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _to_epoch(value: Any) -> int:
+    """將時間轉換為 UTC epoch 秒數"""
+    parsed = parse_time(value)
+    if parsed is None:
+        return MISSING_TIME
+    return int((parsed - _EPOCH).total_seconds())
+
+
+class CategoricalColumn:
+    """字典編碼的字串欄位"""
+
+    def __init__(self, values: List[Optional[str]]):
+        """
+        Args:
+            values: 每一列的字串值（可為 None）
+        """
+        self.categories: List[Optional[str]] = []
+        self.lookup: Dict[Optional[str], int] = {}
+        codes = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            code = self.lookup.get(value)
+            if code is None:
+                code = self.lookup[value] = len(self.categories)
+                self.categories.append(value)
+            codes[i] = code
+        self.codes = codes
+
+    def codes_for(self, values: Iterable[str]) -> np.ndarray:
+        """取得指定值的編碼，不存在的值會被忽略"""
+        return np.array([self.lookup[v] for v in values if v in self.lookup], dtype=np.int32)
+
+    def isin(self, values: Iterable[str]) -> np.ndarray:
+        """向量化的成員檢查"""
+        return np.isin(self.codes, self.codes_for(values))
+
+    def decode(self, codes: np.ndarray) -> List[Optional[str]]:
+        return [self.categories[code] for code in codes]
+
+
+class CompressedRecords:
+    """以 zlib 區塊壓縮保存的 JSON 記錄"""
+
+    def __init__(self, records: Iterable[bytes], block_size: int = RECORD_BLOCK_SIZE):
+        """
+        Args:
+            records: 每筆記錄的 JSON 位元組（不含換行）
+            block_size: 每個壓縮區塊的筆數
+        """
+        self.block_size = block_size
+        self.blocks: List[bytes] = []
+        self.size = 0
+        digest = hashlib.blake2b(digest_size=8)
+        block = []
+        for record in records:
+            digest.update(record + b'\n')
+            block.append(record)
+            if len(block) == block_size:
+                self._append(block)
+                block = []
+        if block:
+            self._append(block)
+        # 記錄內容的雜湊，作為欄式快照的版本
+        self.digest = digest.hexdigest()
+
+    def _append(self, block: List[bytes]):
+        self.blocks.append(zlib.compress(b'\n'.join(block)))
+        self.size += len(block)
+
+    def _block(self, number: int) -> List[bytes]:
+        return zlib.decompress(self.blocks[number]).split(b'\n')
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, index: int) -> bytes:
+        return self._block(index // self.block_size)[index % self.block_size]
+
+    def __iter__(self) -> Iterator[bytes]:
+        for number in range(len(self.blocks)):
+            yield from self._block(number)
+
+    def iter_selected(self, indices: Iterable[int]) -> Iterator[bytes]:
+        """依序輸出選取的記錄，連續落在同一區塊的記錄只解壓縮一次"""
+        number, block = None, None
+        for index in indices:
+            if index // self.block_size != number:
+                number = index // self.block_size
+                block = self._block(number)
+            yield block[index % self.block_size]
+
+    def get_many(self, indices: Iterable[int]) -> List[bytes]:
+        """取得選取的記錄（依傳入順序），每個區塊只解壓縮一次"""
+        indices = [int(i) for i in indices]
+        blocks = {number: self._block(number) for number in {i // self.block_size for i in indices}}
+        return [blocks[i // self.block_size][i % self.block_size] for i in indices]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(block) for block in self.blocks)
+
+
+class DefectStore:
+    """瑕疵資料的欄式快照"""
+
+    CATEGORICAL_FIELDS = ('city', 'district', 'road_section')
+
+    def __init__(self, records: List[Dict[str, Any]]):
+        """
+        Args:
+            records: 與上游格式相同的瑕疵記錄
+        """
+        self.size = len(records)
+        self.ids = np.fromiter((int(r['id']) for r in records), dtype=np.int64, count=self.size)
+        self.defect_type = np.fromiter((_enum_value(r.get('defect_type')) for r in records),
+                                       dtype=np.int16, count=self.size)
+        self.severity = np.fromiter((_enum_value(r.get('severity')) for r in records),
+                                    dtype=np.int16, count=self.size)
+        self.capture_time = np.fromiter((_to_epoch(r.get('capture_time')) for r in records),
+                                        dtype=np.int64, count=self.size)
+        self.latitude = np.fromiter((_to_float(r.get('latitude')) for r in records),
+                                    dtype=np.float64, count=self.size)
+        self.longitude = np.fromiter((_to_float(r.get('longitude')) for r in records),
+                                     dtype=np.float64, count=self.size)
+        self.columns = {
+            field: CategoricalColumn([r.get(field) for r in records])
+            for field in self.CATEGORICAL_FIELDS
+        }
+        self.raw = CompressedRecords(
+            json.dumps(r, ensure_ascii=False, separators=(',', ':')).encode('utf-8') for r in records
+        )
+        self.built_at = time.time()
+        # 資料內容的版本，內容不變時重新載入的快照版本相同
+        self.version = self.raw.digest
+        self._spatial_index: Optional[GridIndex] = None
+        self._id_order: Optional[np.ndarray] = None
+
+    def mask(self, defect_filter, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """以向量化布林遮罩計算查詢條件
+
+        Args:
+            defect_filter: 查詢條件（DefectFilter）
+            indices: 只檢查這些資料列，None 表示全部
+
+        Returns:
+            np.ndarray: 每一列（或 indices 中的每一列）是否符合條件
+        """
+        def column(values: np.ndarray) -> np.ndarray:
+            return values if indices is None else values[indices]
+
+        mask = np.ones(self.size if indices is None else len(indices), dtype=bool)
+        for field in self.CATEGORICAL_FIELDS:
+            values = getattr(defect_filter, field)
+            if values is not None:
+                categorical = self.columns[field]
+                mask &= np.isin(column(categorical.codes), categorical.codes_for(values))
+        if defect_filter.defect_type is not None:
+            mask &= np.isin(column(self.defect_type), defect_filter.defect_type)
+        if defect_filter.severity is not None:
+            mask &= np.isin(column(self.severity), defect_filter.severity)
+
+        capture_time = column(self.capture_time)
+        start_time = _to_epoch(defect_filter.start_time)
+        if start_time != MISSING_TIME:
+            mask &= capture_time >= start_time
+        end_time = _to_epoch(defect_filter.end_time)
+        if end_time != MISSING_TIME:
+            mask &= (capture_time <= end_time) & (capture_time != MISSING_TIME)
+        return mask
+
+    def select(self, defect_filter, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """取得符合條件的資料列索引
+
+        Args:
+            defect_filter: 查詢條件（DefectFilter）
+            indices: 只在這些資料列中選取，None 表示全部
+        """
+        if indices is None:
+            return np.flatnonzero(self.mask(defect_filter))
+        return indices[self.mask(defect_filter, indices)]
+
+    @property
+    def spatial_index(self) -> GridIndex:
+        """座標的網格索引（第一次使用時建立，快照不會變更）"""
+        if self._spatial_index is None:
+            self._spatial_index = GridIndex(self.latitude, self.longitude)
+        return self._spatial_index
+
+    def within(self, bbox: BBox, defect_filter=None) -> np.ndarray:
+        """取得矩形範圍內符合條件的資料列索引
+
+        Args:
+            bbox: (min_lon, min_lat, max_lon, max_lat)
+            defect_filter: 查詢條件（DefectFilter），None 表示不限制
+
+        Returns:
+            np.ndarray: 資料列索引
+        """
+        indices = self.spatial_index.query(bbox)
+        if defect_filter is None:
+            return indices
+        return self.select(defect_filter, indices)
+
+    @property
+    def id_order(self) -> np.ndarray:
+        """依 ID 排序的資料列索引（第一次使用時建立）"""
+        if self._id_order is None:
+            self._id_order = np.argsort(self.ids, kind='stable')
+        return self._id_order
+
+    def page(self, defect_filter, after_id: Optional[int], limit: int) -> Tuple[np.ndarray, int]:
+        """依 ID 順序取得 after_id 之後的一頁資料
+
+        Args:
+            defect_filter: 查詢條件（DefectFilter）
+            after_id: 上一頁最後一筆的 ID，None 表示第一頁
+            limit: 每頁筆數
+
+        Returns:
+            Tuple[np.ndarray, int]: 本頁的資料列索引，以及符合條件的總筆數
+        """
+        ordered = self.id_order[self.mask(defect_filter, self.id_order)]
+        start = 0 if after_id is None else int(np.searchsorted(self.ids[ordered], after_id, side='right'))
+        return ordered[start:start + limit], len(ordered)
+
+    def records(self, indices: Iterable[int]) -> List[Dict[str, Any]]:
+        """將選取的資料列解碼為字典"""
+        return [json.loads(raw) for raw in self.raw.get_many(indices)]
+
+    def json_array(self, indices: Iterable[int]) -> bytes:
+        """將選取的資料列直接串接為 JSON 陣列，不需解碼"""
+        return b'[' + b','.join(self.raw.get_many(indices)) + b']'
+
+    def location_rows(self) -> List[Dict[str, Any]]:
+        """取得所有不重複的城市、行政區與道路組合"""
+        city, district, road = (self.columns[f] for f in self.CATEGORICAL_FIELDS)
+        stacked = np.stack([city.codes, district.codes, road.codes], axis=1) if self.size else np.empty((0, 3))
+        return [
+            {
+                'city': city.categories[c],
+                'district': district.categories[d],
+                'road_section': road.categories[r]
+            }
+            for c, d, r in np.unique(stacked.astype(np.int32), axis=0)
+        ]
+
+    def memory_usage(self) -> int:
+        """估計佔用的位元組數"""
+        arrays = [self.ids, self.defect_type, self.severity, self.capture_time, self.latitude, self.longitude]
+        arrays += [column.codes for column in self.columns.values()]
+        return sum(a.nbytes for a in arrays) + self.raw.nbytes
+
+
+class DefectStoreHolder:
+    """持有目前的欄式快照，並負責從本地副本或上游重新載入
+
+    多 worker 時只有一個 worker 從資料來源重新載入，並將記錄發布到快照檔案；
+    其餘 worker 在快照檔案更新後讀取檔案重建欄式快照，不需再請求上游。
+    """
+
+    def __init__(self, snapshot_path: Optional[str] = None):
+        """
+        Args:
+            snapshot_path: 發布記錄的檔案路徑，None 表示不發布
+        """
+        self.store: Optional[DefectStore] = None
+        self.snapshot_path = snapshot_path
+        self._snapshot_mtime = None
+        self._lock = threading.Lock()
+
+    def refresh(self) -> bool:
+        """從資料來源重新載入欄式快照並發布
+
+        Returns:
+            bool: 是否更新成功
+        """
+        if is_replica_mode():
+            records = load_all_records()
+        else:
+            api_result = call_road_defect_api('road-defects')
+            if not api_result.get('success'):
+                current_app.logger.error(f"更新欄式瑕疵資料失敗: {api_result.get('message')}")
+                return False
+            records = api_result['data'].get('data') or []
+
+        store = DefectStore(records)
+        # 資料未變動時保留原快照，fork 後的 worker 可持續與主行程共用記憶體分頁
+        if self.store is not None and self.store.version == store.version:
+            return True
+        # 以整體替換快照，讀取端不需要加鎖
+        self.store = store
+        self._publish(store)
+        return True
+
+    def reload(self) -> bool:
+        """快照檔案更新時從檔案重建欄式快照（由未負責更新的 worker 執行）
+
+        Returns:
+            bool: 是否有可用的快照
+        """
+        if not self.snapshot_path:
+            return self.store is not None
+        try:
+            mtime = os.stat(self.snapshot_path).st_mtime_ns
+        except FileNotFoundError:
+            return self.store is not None
+        if mtime == self._snapshot_mtime:
+            return True
+
+        with open(self.snapshot_path, 'rb') as f:
+            store = DefectStore([json.loads(line) for line in f if line.strip()])
+        if self.store is None or self.store.version != store.version:
+            self.store = store
+        self._snapshot_mtime = mtime
+        return True
+
+    def _publish(self, store: DefectStore):
+        """以原子替換的方式寫入快照檔案，每行一筆記錄"""
+        if not self.snapshot_path:
+            return
+        temp_path = f'{self.snapshot_path}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                for raw in store.raw:
+                    f.write(raw + b'\n')
+            os.replace(temp_path, self.snapshot_path)
+            self._snapshot_mtime = os.stat(self.snapshot_path).st_mtime_ns
+        except OSError as e:
+            current_app.logger.error(f"發布欄式瑕疵快照失敗: {str(e)}")
+
+    def get(self) -> Optional[DefectStore]:
+        """取得目前的快照；僅在冷啟動尚無快照時載入一次（優先讀取已發布的快照檔案）"""
+        if self.store is None:
+            with self._lock:
+                if self.store is None and not self.reload():
+                    self.refresh()
+        return self.store
+
+
+def init_defect_store(app) -> Optional[DefectStoreHolder]:
+    """啟用時建立欄式儲存並註冊背景更新工作
+
+    Args:
+        app: Flask 應用程式實例
+
+    Returns:
+        Optional[DefectStoreHolder]: 欄式儲存，未啟用時返回 None
+    """
+    store_config = app.config.get('CURRENT_CONFIG', {}).get('defect_store', {})
+    if not store_config.get('enabled'):
+        app.extensions['defect_store'] = None
+        return None
+
+    snapshot_path = store_config.get('snapshot_path', 'defect_store.jsonl')
+    if snapshot_path and not os.path.isabs(snapshot_path):
+        snapshot_path = os.path.join(app.instance_path, snapshot_path)
+    holder = DefectStoreHolder(snapshot_path)
+    app.extensions['defect_store'] = holder
+    register_periodic_task(
+        app,
+        'defect-store',
+        store_config.get('refresh_interval', 60),
+        holder.refresh,
+        leader=True,
+        follower=holder.reload
+    )
+    return holder
+
+
+def get_defect_store() -> Optional[DefectStore]:
+    """取得目前的欄式快照，未啟用或無法載入時返回 None"""
+    holder = current_app.extensions.get('defect_store')
+    if holder is None:
+        return None
+    return holder.get()
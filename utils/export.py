@@ -0,0 +1,327 @@
+"""
+瑕疵資料匯出
+
+將符合條件的瑕疵逐筆轉換為表格列，輸出為 CSV、Excel（xlsx）或 Parquet：
+- CSV 以產生器逐塊輸出，可直接串流回應
+- Excel 以 openpyxl 的 write-only 模式寫入暫存檔
+- Parquet 以 pyarrow 分批寫入 row group
+
+Excel、Parquet 與超過同步上限的 CSV 以背景工作產生，完成後提供下載連結。
+工作狀態以 JSON 檔案存放在匯出目錄中，多個 worker 行程都能查詢。
+"""
+import csv
+import importlib.util
+import io
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from utils.background import register_periodic_task
+from utils.query import iter_defect_json
+
+# 支援的匯出格式：Content-Type 與副檔名
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet')
+}
+
+# 可同步串流輸出的格式
+STREAMING_FORMATS = ('csv',)
+
+# 各格式需要的選用套件
+FORMAT_REQUIREMENTS = {
+    'xlsx': 'openpyxl',
+    'parquet': 'pyarrow'
+}
+
+# Parquet 每個 row group 的筆數
+PARQUET_ROW_GROUP_SIZE = 50000
+
+
+def _enum_name(value: Any) -> Optional[str]:
+    return value.get('name') if isinstance(value, dict) else None
+
+
+def _enum_value(value: Any) -> Any:
+    return value.get('value') if isinstance(value, dict) else value
+
+
+# 匯出欄位：標題與取值函數
+EXPORT_COLUMNS: List[Tuple[str, Callable[[Dict[str, Any]], Any]]] = [
+    ('id', lambda d: d.get('id')),
+    ('defect_type', lambda d: _enum_value(d.get('defect_type'))),
+    ('defect_type_name', lambda d: _enum_name(d.get('defect_type'))),
+    ('severity', lambda d: _enum_value(d.get('severity'))),
+    ('severity_name', lambda d: _enum_name(d.get('severity'))),
+    ('capture_time', lambda d: d.get('capture_time')),
+    ('latitude', lambda d: d.get('latitude')),
+    ('longitude', lambda d: d.get('longitude')),
+    ('city', lambda d: d.get('city')),
+    ('district', lambda d: d.get('district')),
+    ('road_section', lambda d: d.get('road_section')),
+    ('device_id', lambda d: d.get('device_id')),
+    ('has_image', lambda d: d.get('has_image'))
+]
+
+
+class ExportUnavailable(RuntimeError):
+    """匯出格式所需的套件未安裝"""
+
+
+def check_format(fmt: str) -> Optional[str]:
+    """檢查匯出格式是否可用
+
+    Returns:
+        Optional[str]: 無法使用時的原因，可用時返回 None
+    """
+    if fmt not in EXPORT_FORMATS:
+        return f"format 參數必須為 {'、'.join(EXPORT_FORMATS)} 之一"
+    package = FORMAT_REQUIREMENTS.get(fmt)
+    if package and importlib.util.find_spec(package) is None:
+        return f'匯出 {fmt} 需要安裝 {package}'
+    return None
+
+
+def get_export_config() -> Dict[str, Any]:
+    """取得 export 設定"""
+    return current_app.config.get('CURRENT_CONFIG', {}).get('export', {})
+
+
+def iter_rows(records: Iterator[bytes]) -> Iterator[List[Any]]:
+    """將瑕疵 JSON 逐筆轉換為表格列"""
+    for record in records:
+        defect = json.loads(record)
+        yield [extract(defect) for _, extract in EXPORT_COLUMNS]
+
+
+def iter_csv(rows: Iterator[List[Any]], batch_size: int = 1000) -> Iterator[bytes]:
+    """逐塊產生 CSV 內容（含 UTF-8 BOM，Excel 開啟時不會亂碼）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in EXPORT_COLUMNS])
+    yield ('\ufeff' + buffer.getvalue()).encode('utf-8')
+
+    pending = 0
+    for row in rows:
+        if pending == 0:
+            buffer.seek(0)
+            buffer.truncate()
+        writer.writerow(row)
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue().encode('utf-8')
+            pending = 0
+    if pending:
+        yield buffer.getvalue().encode('utf-8')
+
+
+def write_csv(rows: Iterator[List[Any]], path: str):
+    with open(path, 'wb') as f:
+        for chunk in iter_csv(rows):
+            f.write(chunk)
+
+
+def write_xlsx(rows: Iterator[List[Any]], path: str):
+    """以 write-only 模式寫入 Excel，記憶體用量不隨筆數增加"""
+    try:
+        from openpyxl import Workbook
+    except ImportError as e:
+        raise ExportUnavailable('匯出 Excel 需要安裝 openpyxl') from e
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('defects')
+    sheet.append([name for name, _ in EXPORT_COLUMNS])
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def write_parquet(rows: Iterator[List[Any]], path: str, row_group_size: int = PARQUET_ROW_GROUP_SIZE):
+    """分批寫入 Parquet，每批為一個 row group"""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ExportUnavailable('匯出 Parquet 需要安裝 pyarrow') from e
+
+    schema = pa.schema([
+        ('id', pa.int64()),
+        ('defect_type', pa.int32()),
+        ('defect_type_name', pa.string()),
+        ('severity', pa.int32()),
+        ('severity_name', pa.string()),
+        ('capture_time', pa.string()),
+        ('latitude', pa.float64()),
+        ('longitude', pa.float64()),
+        ('city', pa.string()),
+        ('district', pa.string()),
+        ('road_section', pa.string()),
+        ('device_id', pa.string()),
+        ('has_image', pa.bool_())
+    ])
+
+    def flush(writer, batch):
+        columns = list(zip(*batch))
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array(column, type=field.type) for column, field in zip(columns, schema)],
+            schema=schema
+        ))
+
+    with pq.ParquetWriter(path, schema) as writer:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= row_group_size:
+                flush(writer, batch)
+                batch = []
+        if batch:
+            flush(writer, batch)
+
+
+WRITERS = {
+    'csv': write_csv,
+    'xlsx': write_xlsx,
+    'parquet': write_parquet
+}
+
+
+class ExportJobs:
+    """背景匯出工作
+
+    匯出檔案與工作狀態（<工作 ID>.json）存放在同一目錄，超過保存時間後刪除。
+    """
+
+    def __init__(self, directory: str, workers: int = 2, retention: float = 86400):
+        """
+        Args:
+            directory: 匯出檔案目錄
+            workers: 同時執行的匯出工作數
+            retention: 匯出檔案保存時間（秒）
+        """
+        self.directory = directory
+        self.retention = retention
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='export')
+        os.makedirs(directory, exist_ok=True)
+
+    def _meta_path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f'{job_id}.json')
+
+    def file_path(self, job: Dict[str, Any]) -> str:
+        return os.path.join(self.directory, f"{job['id']}.{EXPORT_FORMATS[job['format']][1]}")
+
+    def _save(self, job: Dict[str, Any]):
+        """以原子方式寫入工作狀態"""
+        path = self._meta_path(job['id'])
+        temp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """取得工作狀態，不存在時返回 None"""
+        if not job_id.isalnum():
+            return None
+        try:
+            with open(self._meta_path(job_id), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def submit(self, defect_filter, fmt: str, owner: Optional[str]) -> Dict[str, Any]:
+        """建立背景匯出工作
+
+        Args:
+            defect_filter: 查詢條件（DefectFilter）
+            fmt: 匯出格式
+            owner: 建立工作的使用者 ID
+
+        Returns:
+            Dict: 工作狀態
+        """
+        job = {
+            'id': uuid.uuid4().hex,
+            'format': fmt,
+            'filter': defect_filter.to_params(),
+            'owner': owner,
+            'status': 'pending',
+            'rows': None,
+            'error': None,
+            'created_at': time.time(),
+            'finished_at': None
+        }
+        self._save(job)
+        app = current_app._get_current_object()
+        self.executor.submit(self._run, app, job, defect_filter)
+        return job
+
+    def _run(self, app, job: Dict[str, Any], defect_filter):
+        with app.app_context():
+            path = self.file_path(job)
+            temp_path = f'{path}.tmp'
+            job['status'] = 'running'
+            self._save(job)
+            try:
+                total, records = iter_defect_json(defect_filter)
+                WRITERS[job['format']](iter_rows(records), temp_path)
+                os.replace(temp_path, path)
+                job.update(status='completed', rows=total)
+            except Exception as e:
+                app.logger.error(f"匯出工作 {job['id']} 失敗: {str(e)}")
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                job.update(status='failed', error=str(e))
+            job['finished_at'] = time.time()
+            self._save(job)
+
+    def cleanup(self) -> int:
+        """刪除超過保存時間的匯出檔案
+
+        Returns:
+            int: 刪除的工作數
+        """
+        removed = 0
+        cutoff = time.time() - self.retention
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json'):
+                continue
+            job = self.get(name[:-5])
+            if job is None or job['created_at'] > cutoff:
+                continue
+            # 未完成的工作再多保留一段保存時間（行程中斷時會停在此狀態）
+            if job['status'] in ('pending', 'running') and job['created_at'] > cutoff - self.retention:
+                continue
+            for path in (self.file_path(job), self._meta_path(job['id'])):
+                if os.path.exists(path):
+                    os.remove(path)
+            removed += 1
+        return removed
+
+
+def init_export(app) -> ExportJobs:
+    """建立背景匯出工作管理，並註冊過期檔案清理工作
+
+    Args:
+        app: Flask 應用程式實例
+    """
+    export_config = app.config.get('CURRENT_CONFIG', {}).get('export', {})
+    directory = export_config.get('path', 'exports')
+    if not os.path.isabs(directory):
+        directory = os.path.join(app.instance_path, directory)
+
+    jobs = ExportJobs(
+        directory,
+        workers=export_config.get('workers', 2),
+        retention=export_config.get('retention', 86400)
+    )
+    app.extensions['export_jobs'] = jobs
+    register_periodic_task(app, 'export-cleanup', export_config.get('cleanup_interval', 3600), jobs.cleanup, leader=True)
+    return jobs
+
+
+def get_export_jobs() -> ExportJobs:
+    """取得目前應用程式的背景匯出工作管理"""
+    return current_app.extensions.get('export_jobs')
@@ -0,0 +1,148 @@
+"""
+登入使用者快取
+
+Flask-Login 的 user_loader 與 JWT 驗證在每個請求都要載入使用者。
+每個 worker 以 LRU + TTL 快取使用者欄位的快照，命中時以 merge(load=False)
+將快照放回目前的資料庫 session，不需要查詢資料庫。
+
+使用者資料在本 worker 中更新或刪除時立即失效；其他 worker 中的快照最多保留 TTL 秒。
+"""
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import make_transient_to_detached
+from typing import Any, Dict, Optional
+from config.database import db
+from models.user import User
+
+
+class IdentityCache:
+    """以使用者 ID 為鍵的 LRU + TTL 快取"""
+
+    def __init__(self, ttl: float = 60, max_size: int = 1024):
+        """
+        Args:
+            ttl: 快照保留時間（秒）
+            max_size: 最多保留的使用者數
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data: 'OrderedDict[int, tuple]' = OrderedDict()  # 使用者 ID -> (到期時間, 欄位值)
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """取得使用者欄位的快照，未命中或已過期時返回 None"""
+        with self._lock:
+            entry = self._data.get(user_id)
+            if entry is None or entry[0] < time.monotonic():
+                self._data.pop(user_id, None)
+                self.misses += 1
+                return None
+            self._data.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, user_id: int, values: Dict[str, Any]):
+        with self._lock:
+            self._data[user_id] = (time.monotonic() + self.ttl, values)
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """移除指定使用者的快照"""
+        with self._lock:
+            self._data.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+def _snapshot(user: User) -> Dict[str, Any]:
+    """取得使用者的欄位值"""
+    return {column.key: getattr(user, column.key) for column in User.__table__.columns}
+
+
+def load_user_by_id(user_id: Any) -> Optional[User]:
+    """載入使用者，啟用快取時優先使用快照
+
+    Args:
+        user_id: 使用者 ID
+
+    Returns:
+        Optional[User]: 使用者，不存在時返回 None
+    """
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+
+    cache = get_identity_cache()
+    if cache is None:
+        return User.query.get(user_id)
+
+    values = cache.get(user_id)
+    if values is not None:
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    user = User.query.get(user_id)
+    if user is not None:
+        cache.set(user_id, _snapshot(user))
+    return user
+
+
+def invalidate_user(user_id: int):
+    """使指定使用者的快照失效（使用者資料變更時呼叫）"""
+    cache = get_identity_cache()
+    if cache is not None:
+        cache.invalidate(user_id)
+
+
+def init_identity_cache(app) -> Optional[IdentityCache]:
+    """根據設定建立登入使用者快取，並在使用者更新或刪除時自動失效
+
+    Args:
+        app: Flask 應用程式實例
+
+    Returns:
+        Optional[IdentityCache]: 快取實例，未啟用時返回 None
+    """
+    cache_config = app.config.get('CURRENT_CONFIG', {}).get('identity_cache', {})
+    if not cache_config.get('enabled', False):
+        app.extensions['identity_cache'] = None
+        return None
+
+    cache = IdentityCache(
+        ttl=cache_config.get('ttl', 60),
+        max_size=cache_config.get('max_size', 1024)
+    )
+    app.extensions['identity_cache'] = cache
+
+    def on_change(mapper, connection, target):
+        cache.invalidate(target.id)
+
+    event.listen(User, 'after_update', on_change)
+    event.listen(User, 'after_delete', on_change)
+    return cache
+
+
+def get_identity_cache() -> Optional[IdentityCache]:
+    """取得目前應用程式的登入使用者快取"""
+    return current_app.extensions.get('identity_cache')
@@ -0,0 +1,401 @@
+"""
+瑕疵圖片磁碟快取
+
+以內容雜湊（SHA-256）儲存上游圖片，瑕疵 ID 對應的中繼資料另存為小型 JSON 檔，
+總大小超過上限時依最近存取時間（LRU）淘汰。回應帶有強 ETag、Last-Modified 與
+Cache-Control，由 werkzeug 處理 304 Not Modified 與 HTTP Range；
+設定 accel_redirect 時改以 X-Accel-Redirect 交由 nginx 以 sendfile 傳送檔案。
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from flask import current_app, request, send_file, Response
+from typing import Any, Dict, Iterable, Optional
+from utils.api import call_road_defect_api, iter_response_content
+from utils.singleflight import get_single_flight
+
+# 淘汰後保留的比例，避免每次寫入都觸發淘汰
+EVICT_TARGET_RATIO = 0.9
+
+# 暫存檔前綴（淘汰時略過寫入中的檔案）
+TEMP_PREFIX = '.tmp-'
+
+
+class ImageUnavailable(Exception):
+    """上游暫時無法提供圖片（錯誤狀態碼、逾時或斷路器斷開），與上游沒有圖片（404）區分"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class CachedImage:
+    """已快取的圖片"""
+
+    def __init__(self, path: str, digest: str, content_type: str, size: int,
+                 last_modified: float, stored_at: float):
+        self.path = path
+        self.digest = digest
+        self.content_type = content_type
+        self.size = size
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+
+    @property
+    def etag(self) -> str:
+        return self.digest[:32]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'digest': self.digest,
+            'content_type': self.content_type,
+            'size': self.size,
+            'last_modified': self.last_modified,
+            'stored_at': self.stored_at
+        }
+
+
+class ImageCache:
+    """以內容雜湊定址的圖片磁碟快取（多個 worker 可共用同一目錄）"""
+
+    def __init__(self, directory: str, max_bytes: int = 1024 * 1024 * 1024, ttl: float = 7 * 86400,
+                 max_age: int = 86400, accel_redirect: Optional[str] = None):
+        """
+        Args:
+            directory: 快取目錄
+            max_bytes: 圖片總位元組上限
+            ttl: 圖片在快取中的有效時間（秒），過期後重新向上游取得
+            max_age: 回應的 Cache-Control max-age（秒）
+            accel_redirect: nginx internal location 的路徑前綴，None 表示由 Flask 傳送檔案
+        """
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, 'blobs')
+        self.meta_dir = os.path.join(directory, 'meta')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.meta_dir, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_age = max_age
+        self.accel_redirect = accel_redirect
+        self.hits = 0
+        self.misses = 0
+        self._approx_bytes: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.meta_dir, f'{key}.json')
+
+    def blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _write_meta(self, key: str, meta: Dict[str, Any]):
+        """寫入暫存檔後以 rename 取代中繼資料，讀取端不會看到寫入一半的檔案"""
+        fd, tmp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.meta_dir)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self._meta_path(key))
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def get(self, key: str) -> Optional[CachedImage]:
+        """讀取快取的圖片
+
+        Args:
+            key: 快取鍵（瑕疵 ID）
+
+        Returns:
+            Optional[CachedImage]: 快取的圖片，不存在或已過期時返回 None
+        """
+        meta_path = self._meta_path(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        path = self.blob_path(meta['digest'])
+        if meta['stored_at'] + self.ttl <= time.time() or not os.path.exists(path):
+            self.misses += 1
+            return None
+
+        # 以中繼資料檔的修改時間記錄最近存取時間（LRU）
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+        self.hits += 1
+        return CachedImage(path, meta['digest'], meta['content_type'], meta['size'],
+                           meta['last_modified'], meta['stored_at'])
+
+    def read_meta(self, key: str) -> Optional[Dict[str, Any]]:
+        """讀取中繼資料（不檢查有效時間，也不更新存取時間）"""
+        try:
+            with open(self._meta_path(key), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def update_meta(self, key: str, **fields) -> bool:
+        """在中繼資料中加入額外欄位（例如預覽圖）
+
+        Returns:
+            bool: 是否更新成功（圖片不在快取中時返回 False）
+        """
+        meta = self.read_meta(key)
+        if meta is None:
+            return False
+        meta.update(fields)
+        self._write_meta(key, meta)
+        return True
+
+    def store(self, key: str, chunks: Iterable[bytes], content_type: str,
+              last_modified: Optional[float] = None) -> CachedImage:
+        """寫入圖片
+
+        Args:
+            key: 快取鍵（瑕疵 ID）
+            chunks: 圖片內容區塊
+            content_type: 圖片的 Content-Type
+            last_modified: 上游的最後修改時間（epoch 秒），預設為寫入時間
+
+        Returns:
+            CachedImage: 快取的圖片
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.blob_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    hasher.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            digest = hasher.hexdigest()
+            path = self.blob_path(digest)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        now = time.time()
+        image = CachedImage(path, digest, content_type, size, last_modified or now, now)
+        self._write_meta(key, image.to_dict())
+        self._track(size)
+        return image
+
+    def _track(self, size: int):
+        """累計寫入量，估計超過上限時執行淘汰"""
+        with self._lock:
+            if self._approx_bytes is None:
+                self._approx_bytes = self.size()['bytes']
+            else:
+                self._approx_bytes += size
+            if self._approx_bytes > self.max_bytes:
+                self._approx_bytes = self.evict()
+
+    def evict(self) -> int:
+        """依最近存取時間淘汰圖片，直到總大小低於上限
+
+        Returns:
+            int: 淘汰後的總位元組數
+        """
+        metas = []
+        for entry in os.scandir(self.meta_dir):
+            if entry.name.startswith(TEMP_PREFIX):
+                continue
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    digest = json.load(f)['digest']
+                metas.append((entry.stat().st_mtime, entry.path, digest))
+            except (OSError, ValueError, KeyError):
+                continue
+
+        blobs = {}
+        for subdir in os.scandir(self.blob_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if not entry.name.startswith(TEMP_PREFIX):
+                    blobs[entry.name] = (entry.path, entry.stat().st_size)
+
+        refs = {}
+        for _, _, digest in metas:
+            refs[digest] = refs.get(digest, 0) + 1
+
+        # 刪除沒有任何瑕疵引用的圖片
+        total = 0
+        for digest, (path, size) in list(blobs.items()):
+            if digest in refs:
+                total += size
+                continue
+            self._remove(path)
+            del blobs[digest]
+
+        target = self.max_bytes * EVICT_TARGET_RATIO
+        for _, meta_path, digest in sorted(metas):
+            if total <= target:
+                break
+            self._remove(meta_path)
+            refs[digest] -= 1
+            if refs[digest] == 0 and digest in blobs:
+                path, size = blobs.pop(digest)
+                self._remove(path)
+                total -= size
+        return total
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def size(self) -> Dict[str, int]:
+        """統計快取中的圖片數量與總位元組數"""
+        entries = 0
+        total = 0
+        for subdir in os.scandir(self.blob_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if not entry.name.startswith(TEMP_PREFIX):
+                    entries += 1
+                    total += entry.stat().st_size
+        return {'entries': entries, 'bytes': total}
+
+    def make_response(self, image: CachedImage) -> Response:
+        """建立帶有快取標頭的圖片回應（支援 304 與 Range）
+
+        Args:
+            image: 快取的圖片
+
+        Returns:
+            Response: 圖片回應
+        """
+        if self.accel_redirect:
+            relpath = os.path.relpath(image.path, self.directory).replace(os.sep, '/')
+            response = Response(mimetype=image.content_type)
+            response.headers['X-Accel-Redirect'] = f"{self.accel_redirect.rstrip('/')}/{relpath}"
+            response.set_etag(image.etag)
+            response.last_modified = image.last_modified
+            response.cache_control.public = True
+            response.cache_control.max_age = self.max_age
+            return response.make_conditional(request)
+
+        return send_file(
+            image.path,
+            mimetype=image.content_type,
+            conditional=True,
+            etag=image.etag,
+            last_modified=image.last_modified,
+            max_age=self.max_age
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """取得快取統計"""
+        lookups = self.hits + self.misses
+        stats = {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0
+        }
+        stats.update(self.size())
+        return stats
+
+
+def _parse_http_date(value: Optional[str]) -> Optional[float]:
+    """將 HTTP 日期標頭轉換為 epoch 秒數"""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def fetch_image(defect_id: int) -> Optional[CachedImage]:
+    """取得瑕疵圖片，未快取時從上游下載並寫入快取
+
+    同一張圖片同時只會有一個請求向上游下載。
+
+    Args:
+        defect_id: 瑕疵 ID
+
+    Returns:
+        Optional[CachedImage]: 快取的圖片，上游沒有圖片（404）時返回 None
+
+    Raises:
+        ImageUnavailable: 上游返回其他錯誤或無法連線
+    """
+    image_cache = get_image_cache()
+    key = str(defect_id)
+    image = image_cache.get(key)
+    if image is not None:
+        return image
+
+    def download():
+        result = call_road_defect_api(f'road-defects/{defect_id}/image', stream=True)
+        if not result.get('success'):
+            if result.get('response') is not None:
+                result['response'].close()
+            if result.get('status_code') == 404:
+                return None
+            raise ImageUnavailable(
+                f"下載瑕疵 {defect_id} 的圖片失敗: {result.get('message') or result.get('status_code')}",
+                result.get('status_code')
+            )
+        response = result['response']
+        return image_cache.store(
+            key,
+            iter_response_content(response, chunk_size=65536),
+            response.headers.get('content-type', 'image/jpeg'),
+            _parse_http_date(response.headers.get('last-modified'))
+        )
+
+    flight = get_single_flight()
+    if flight is None:
+        return download()
+    return flight.do(f'image:{key}', download, recheck=lambda: image_cache.get(key))
+
+
+def init_image_cache(app) -> Optional[ImageCache]:
+    """根據設定建立圖片磁碟快取
+
+    Args:
+        app: Flask 應用程式實例
+
+    Returns:
+        Optional[ImageCache]: 快取實例，未啟用時返回 None
+    """
+    cache_config = app.config.get('CURRENT_CONFIG', {}).get('image_cache', {})
+    if not cache_config.get('enabled', False):
+        app.extensions['image_cache'] = None
+        return None
+
+    directory = cache_config.get('path', 'image_cache')
+    if not os.path.isabs(directory):
+        directory = os.path.join(app.instance_path, directory)
+
+    image_cache = ImageCache(
+        directory,
+        max_bytes=cache_config.get('max_bytes', 1024 * 1024 * 1024),
+        ttl=cache_config.get('ttl', 7 * 86400),
+        max_age=cache_config.get('max_age', 86400),
+        accel_redirect=cache_config.get('accel_redirect')
+    )
+    app.extensions['image_cache'] = image_cache
+    return image_cache
+
+
+def get_image_cache() -> Optional[ImageCache]:
+    """取得目前應用程式的圖片磁碟快取"""
+    return current_app.extensions.get('image_cache')
@@ -0,0 +1,199 @@
+"""
+地理位置索引
+
+將「城市 → 行政區 → 道路」層級結構預先計算為記憶體中的快照，
+由背景工作定期更新，請求只讀取目前的快照而不等待上游 API。
+多 worker 時只有一個 worker 重新建立快照並發布到檔案，其餘 worker 讀取檔案。
+"""
+import json
+import os
+import threading
+import time
+from flask import current_app
+from typing import Dict, Any, Iterable, List, Optional
+from utils.api import call_road_defect_api
+from utils.background import register_periodic_task
+from utils.defect_store import get_defect_store
+from utils.replica import is_replica_mode, query_location_rows
+
+
+def build_location_snapshot(defects: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """從瑕疵記錄建立地理位置快照
+
+    Args:
+        defects: 瑕疵記錄
+
+    Returns:
+        Dict: cities（城市列表）、districts（城市對應行政區）、
+              roads（城市與行政區對應道路）與 hierarchy（完整層級結構）
+    """
+    cities = set()
+    districts = {}
+    roads = {}
+    hierarchy = {}
+
+    for defect in defects:
+        city = defect.get('city')
+        district = defect.get('district')
+        road = defect.get('road_section')
+        if not city:
+            continue
+        cities.add(city)
+        if not district:
+            continue
+        districts.setdefault(city, set()).add(district)
+        if not road:
+            continue
+        roads.setdefault((city, district), set()).add(road)
+        hierarchy.setdefault(city, {}).setdefault(district, set()).add(road)
+
+    return {
+        'cities': sorted(cities),
+        'districts': {city: sorted(values) for city, values in districts.items()},
+        'roads': {key: sorted(values) for key, values in roads.items()},
+        'hierarchy': {
+            city: {district: sorted(hierarchy[city][district]) for district in sorted(hierarchy[city])}
+            for city in sorted(hierarchy)
+        }
+    }
+
+
+class LocationIndex:
+    """地理位置層級結構的記憶體快照"""
+
+    def __init__(self, snapshot_path: Optional[str] = None):
+        """
+        Args:
+            snapshot_path: 發布快照的檔案路徑，None 表示不發布
+        """
+        self.snapshot = None
+        self.built_at = None
+        self.snapshot_path = snapshot_path
+        self._snapshot_mtime = None
+        self._lock = threading.Lock()
+
+    def refresh(self) -> bool:
+        """從欄式儲存、本地副本或上游 API 重新建立快照
+
+        Returns:
+            bool: 是否更新成功
+        """
+        store = get_defect_store()
+        if store is not None:
+            defects = store.location_rows()
+        elif is_replica_mode():
+            defects = query_location_rows()
+        else:
+            api_result = call_road_defect_api('road-defects')
+            if not api_result.get('success'):
+                current_app.logger.error(f"更新地理位置索引失敗: {api_result.get('message')}")
+                return False
+            defects = api_result['data'].get('data') or []
+
+        snapshot = build_location_snapshot(defects)
+        # 以整體替換快照，讀取端不需要加鎖
+        self.snapshot = snapshot
+        self.built_at = time.time()
+        self._publish(snapshot)
+        return True
+
+    def reload(self) -> bool:
+        """快照檔案更新時改用檔案中的快照（由未負責更新的 worker 執行）
+
+        Returns:
+            bool: 是否有可用的快照
+        """
+        if not self.snapshot_path:
+            return self.snapshot is not None
+        try:
+            mtime = os.stat(self.snapshot_path).st_mtime_ns
+        except FileNotFoundError:
+            return self.snapshot is not None
+        if mtime == self._snapshot_mtime:
+            return True
+
+        with open(self.snapshot_path, encoding='utf-8') as f:
+            published = json.load(f)
+        published['roads'] = {(city, district): roads for city, district, roads in published['roads']}
+        self.snapshot = published
+        self.built_at = mtime / 1e9
+        self._snapshot_mtime = mtime
+        return True
+
+    def _publish(self, snapshot: Dict[str, Any]):
+        """以原子替換的方式寫入快照檔案（道路的鍵轉為列表）"""
+        if not self.snapshot_path:
+            return
+        published = dict(snapshot, roads=[
+            [city, district, roads] for (city, district), roads in snapshot['roads'].items()
+        ])
+        temp_path = f'{self.snapshot_path}.{os.getpid()}.tmp'
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(published, f, ensure_ascii=False)
+            os.replace(temp_path, self.snapshot_path)
+            self._snapshot_mtime = os.stat(self.snapshot_path).st_mtime_ns
+        except OSError as e:
+            current_app.logger.error(f"發布地理位置快照失敗: {str(e)}")
+
+    def ensure_loaded(self) -> bool:
+        """確保已有快照；僅在冷啟動尚無快照時同步載入一次
+
+        Returns:
+            bool: 是否有可用的快照
+        """
+        if self.snapshot is not None:
+            return True
+        with self._lock:
+            if self.snapshot is None and not self.reload():
+                self.refresh()
+        return self.snapshot is not None
+
+    def age(self) -> Optional[float]:
+        """快照的存在時間（秒）"""
+        if self.built_at is None:
+            return None
+        return time.time() - self.built_at
+
+    def hierarchy(self) -> Dict[str, Dict[str, List[str]]]:
+        return self.snapshot['hierarchy']
+
+    def cities(self) -> List[str]:
+        return self.snapshot['cities']
+
+    def districts(self, city: str) -> List[str]:
+        return self.snapshot['districts'].get(city, [])
+
+    def roads(self, city: str, district: str) -> List[str]:
+        return self.snapshot['roads'].get((city, district), [])
+
+
+def init_location_index(app) -> LocationIndex:
+    """建立地理位置索引並註冊背景更新工作
+
+    Args:
+        app: Flask 應用程式實例
+
+    Returns:
+        LocationIndex: 地理位置索引
+    """
+    locations_config = app.config.get('CURRENT_CONFIG', {}).get('locations', {})
+    snapshot_path = locations_config.get('snapshot_path', 'locations.json')
+    if snapshot_path and not os.path.isabs(snapshot_path):
+        snapshot_path = os.path.join(app.instance_path, snapshot_path)
+    index = LocationIndex(snapshot_path)
+    app.extensions['location_index'] = index
+    register_periodic_task(
+        app,
+        'location-index',
+        locations_config.get('refresh_interval', 300),
+        index.refresh,
+        leader=True,
+        follower=index.reload
+    )
+    return index
+
+
+def get_location_index() -> LocationIndex:
+    """取得目前應用程式的地理位置索引"""
+    return current_app.extensions['location_index']
@@ -0,0 +1,446 @@
+"""
+地圖資料查詢
+
+以空間索引只取出目前地圖視窗內的瑕疵，取代將整個查詢結果嵌入頁面。
+
+縮小的地圖視圖改以伺服器端聚合：將 Web Mercator 圖磚再切成固定大小的網格，
+每個網格內的瑕疵合併為一個群集（數量、中心與嚴重程度分布）。
+網格隨縮放等級對半切分，形成階層式的聚合結果；每個
+（查詢條件、縮放等級、圖磚）的結果各自快取，回應大小與瑕疵總數無關。
+
+統計頁的熱點檢視使用固定大小經緯度網格的密度資料，依查詢條件快取。
+
+未啟用欄式儲存時，依查詢條件建立的暫時快照（含空間索引）在 TTL 內重複使用，
+同一查詢條件的視窗、群集與圖磚請求不會各自重新下載資料並重建索引。
+"""
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+from flask import current_app
+from typing import Dict, Any, List, Optional, Tuple
+from utils.aggregation import SEVERITY_LEVELS, compute_heatmap, get_local_dataset
+from utils.cache import MemoryCacheBackend, make_cache_key
+from utils.defect_store import DefectStore, get_defect_store
+from utils.query import fetch_defects
+from utils.spatial import BBox
+
+# 單次回應的預設瑕疵數量上限
+DEFAULT_MAX_POINTS = 5000
+
+# 每個圖磚切分的網格數（每邊），256px 圖磚對應 64px 的聚合半徑
+CLUSTER_CELLS_PER_TILE = 4
+
+# 達到此縮放等級後不再聚合，直接返回個別瑕疵
+DEFAULT_CLUSTER_MAX_ZOOM = 17
+
+# 單次請求最多處理的圖磚數，超過時降低縮放等級
+MAX_TILES_PER_REQUEST = 64
+
+# 熱點網格預設大小與允許範圍（度）
+DEFAULT_HEATMAP_CELL_SIZE = 0.005
+MIN_HEATMAP_CELL_SIZE = 0.001
+MAX_HEATMAP_CELL_SIZE = 1.0
+
+# 熱點分數中各嚴重程度（輕微/中等/嚴重）的預設權重
+DEFAULT_SEVERITY_WEIGHTS = [1, 2, 3]
+
+# Web Mercator 可表示的最大緯度
+MAX_LATITUDE = 85.05112878
+
+
+def get_map_config() -> Dict[str, Any]:
+    """取得 map 設定"""
+    return current_app.config.get('CURRENT_CONFIG', {}).get('map', {})
+
+
+class FilteredDatasets:
+    """依查詢條件快取暫時建立的欄式快照（LRU + TTL）"""
+
+    def __init__(self, ttl: float = 30, max_entries: int = 8):
+        """
+        Args:
+            ttl: 快照保留時間（秒）
+            max_entries: 最多保留的查詢條件數
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data: 'OrderedDict[str, tuple]' = OrderedDict()  # 查詢條件 -> (到期時間, 快照)
+        self._building: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[DefectStore]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self._data.pop(key, None)
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def get_or_build(self, key: str, build) -> Optional[DefectStore]:
+        """取得快照，未快取時呼叫 build 建立；同一查詢條件同時只建立一次
+
+        Args:
+            key: 查詢條件的快取鍵
+            build: 建立快照的函數，無法取得資料時返回 None
+
+        Returns:
+            Optional[DefectStore]: 快照
+        """
+        store = self._get(key)
+        if store is not None:
+            return store
+        with self._lock:
+            building = self._building.setdefault(key, threading.Lock())
+        with building:
+            store = self._get(key)
+            if store is not None:
+                return store
+            try:
+                store = build()
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
+            if store is None:
+                return None
+            with self._lock:
+                self._data[key] = (time.monotonic() + self.ttl, store)
+                self._data.move_to_end(key)
+                while len(self._data) > self.max_entries:
+                    self._data.popitem(last=False)
+            return store
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _build_filtered_store(defect_filter) -> Optional[DefectStore]:
+    """以本地副本或上游建立符合條件的暫時快照"""
+    dataset = get_local_dataset(defect_filter)
+    if dataset is not None:
+        return dataset[0]
+    result = fetch_defects(defect_filter)
+    if not result['success']:
+        return None
+    return DefectStore(result['data'])
+
+
+def get_filtered_store(defect_filter) -> Optional[DefectStore]:
+    """取得只含符合條件瑕疵的暫時快照（未啟用欄式儲存時使用）
+
+    Args:
+        defect_filter: 查詢條件（DefectFilter）
+
+    Returns:
+        Optional[DefectStore]: 快照，無法取得資料時返回 None
+    """
+    datasets = current_app.extensions.get('map_datasets')
+    if datasets is None or datasets.ttl <= 0:
+        return _build_filtered_store(defect_filter)
+    key = make_cache_key('map-dataset', defect_filter.to_params())
+    return datasets.get_or_build(key, lambda: _build_filtered_store(defect_filter))
+
+
+def map_data_version(defect_filter) -> Optional[str]:
+    """地圖資料的版本：欄式儲存的版本，或符合條件的暫時快照的內容版本
+
+    Returns:
+        Optional[str]: 版本，無法取得資料時返回 None
+    """
+    store = get_defect_store()
+    if store is None:
+        store = get_filtered_store(defect_filter)
+    return store.version if store is not None else None
+
+
+def get_map_dataset(defect_filter, bbox: BBox) -> Optional[Tuple[DefectStore, np.ndarray]]:
+    """取得地圖範圍內符合條件的瑕疵
+
+    啟用欄式儲存時直接以其空間索引查詢；否則使用依查詢條件快取的暫時快照。
+
+    Args:
+        defect_filter: 查詢條件（DefectFilter）
+        bbox: (min_lon, min_lat, max_lon, max_lat)
+
+    Returns:
+        Optional[Tuple[DefectStore, np.ndarray]]: 欄式資料與範圍內的索引，無法取得資料時返回 None
+    """
+    store = get_defect_store()
+    if store is not None:
+        return store, store.within(bbox, defect_filter)
+
+    store = get_filtered_store(defect_filter)
+    if store is None:
+        return None
+    return store, store.within(bbox)
+
+
+def limit_points(indices: np.ndarray, limit: int) -> np.ndarray:
+    """超過上限時平均抽樣，避免只保留某一區域的資料"""
+    if limit <= 0 or len(indices) <= limit:
+        return indices
+    return indices[np.linspace(0, len(indices) - 1, limit).astype(np.int64)]
+
+
+def bounds_of(defects: List[Dict[str, Any]]) -> Optional[List[float]]:
+    """計算瑕疵座標的範圍
+
+    Returns:
+        Optional[List[float]]: [min_lon, min_lat, max_lon, max_lat]，沒有有效座標時返回 None
+    """
+    points = []
+    for defect in defects:
+        try:
+            points.append((float(defect['longitude']), float(defect['latitude'])))
+        except (KeyError, TypeError, ValueError):
+            continue
+    if not points:
+        return None
+    lons, lats = zip(*points)
+    return [min(lons), min(lats), max(lons), max(lats)]
+
+
+def mercator_x(lon) -> np.ndarray:
+    """經度轉換為 0 到 1 之間的 Web Mercator x 座標"""
+    return (np.asarray(lon, dtype=np.float64) + 180.0) / 360.0
+
+
+def mercator_y(lat) -> np.ndarray:
+    """緯度轉換為 0 到 1 之間的 Web Mercator y 座標（北方為 0）"""
+    lat = np.radians(np.clip(np.asarray(lat, dtype=np.float64), -MAX_LATITUDE, MAX_LATITUDE))
+    return (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0
+
+
+def tile_bbox(zoom: int, x: int, y: int) -> BBox:
+    """圖磚的經緯度範圍
+
+    Returns:
+        BBox: (min_lon, min_lat, max_lon, max_lat)
+    """
+    n = 2 ** zoom
+
+    def lat_of(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    return x / n * 360.0 - 180.0, lat_of(y + 1), (x + 1) / n * 360.0 - 180.0, lat_of(y)
+
+
+def tiles_for_bbox(bbox: BBox, zoom: int) -> List[Tuple[int, int]]:
+    """與範圍相交的圖磚
+
+    Returns:
+        List[Tuple[int, int]]: (x, y) 列表
+    """
+    n = 2 ** zoom
+    min_lon, min_lat, max_lon, max_lat = bbox
+    x0, x1 = (int(np.clip(np.floor(mercator_x(v) * n), 0, n - 1)) for v in (min_lon, max_lon))
+    y0, y1 = (int(np.clip(np.floor(mercator_y(v) * n), 0, n - 1)) for v in (max_lat, min_lat))
+    return [(x, y) for y in range(y0, y1 + 1) for x in range(x0, x1 + 1)]
+
+
+def tile_of(store: DefectStore, indices: np.ndarray, zoom: int) -> Tuple[np.ndarray, np.ndarray]:
+    """資料列所在的圖磚編號
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: 每一列的圖磚 x 與 y
+    """
+    n = 2 ** zoom
+    return (np.floor(mercator_x(store.longitude[indices]) * n).astype(np.int64),
+            np.floor(mercator_y(store.latitude[indices]) * n).astype(np.int64))
+
+
+def cluster_tile(store: DefectStore, indices: np.ndarray, zoom: int, clustered: bool) -> List[Dict[str, Any]]:
+    """將單一圖磚內的瑕疵依網格聚合
+
+    Returns:
+        List[Dict]: 群集（type=cluster）或單一瑕疵（type=point）
+    """
+    if len(indices) == 0:
+        return []
+    if not clustered:
+        return [{'type': 'point', 'defect': record} for record in store.records(indices)]
+
+    lat = store.latitude[indices]
+    lon = store.longitude[indices]
+    scale = 2 ** zoom * CLUSTER_CELLS_PER_TILE
+    cells = np.stack([
+        np.floor(mercator_x(lon) * scale).astype(np.int64),
+        np.floor(mercator_y(lat) * scale).astype(np.int64)
+    ], axis=1)
+    groups, inverse = np.unique(cells, axis=0, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    count = len(groups)
+
+    counts = np.bincount(inverse, minlength=count)
+    mean_lat = np.bincount(inverse, weights=lat, minlength=count) / counts
+    mean_lon = np.bincount(inverse, weights=lon, minlength=count) / counts
+
+    severity = store.severity[indices]
+    valid = severity >= 0
+    by_severity = np.bincount(inverse[valid] * SEVERITY_LEVELS + severity[valid],
+                              minlength=count * SEVERITY_LEVELS).reshape(count, SEVERITY_LEVELS)
+
+    order = np.argsort(inverse, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    bounds = [np.minimum.reduceat(lon[order], starts), np.minimum.reduceat(lat[order], starts),
+              np.maximum.reduceat(lon[order], starts), np.maximum.reduceat(lat[order], starts)]
+
+    items = []
+    for i, (cell_x, cell_y) in enumerate(groups):
+        if counts[i] == 1:
+            items.append({'type': 'point', 'defect': store.records([indices[order[starts[i]]]])[0]})
+            continue
+        items.append({
+            'type': 'cluster',
+            'id': f'{zoom}/{cell_x}/{cell_y}',
+            'latitude': float(mean_lat[i]),
+            'longitude': float(mean_lon[i]),
+            'count': int(counts[i]),
+            'by_severity': by_severity[i].tolist(),
+            'bounds': [float(b[i]) for b in bounds]
+        })
+    return items
+
+
+def cluster_viewport(defect_filter, bbox: BBox, zoom: int) -> Optional[Dict[str, Any]]:
+    """以伺服器端聚合取得地圖範圍內的瑕疵
+
+    Args:
+        defect_filter: 查詢條件（DefectFilter）
+        bbox: (min_lon, min_lat, max_lon, max_lat)
+        zoom: 地圖縮放等級
+
+    Returns:
+        Optional[Dict]: items（群集與單一瑕疵）、total 與 truncated（單一瑕疵是否超過上限而抽樣），
+                        無法取得資料時返回 None
+    """
+    map_config = get_map_config()
+    max_zoom = map_config.get('cluster_max_zoom', DEFAULT_CLUSTER_MAX_ZOOM)
+    zoom = int(np.clip(zoom, 0, max_zoom))
+    clustered = zoom < max_zoom
+
+    if not clustered:
+        # 不再聚合時與 /within 相同，只解碼上限內的瑕疵
+        dataset = get_map_dataset(defect_filter, bbox)
+        if dataset is None:
+            return None
+        store, indices = dataset
+        selected = limit_points(indices, map_config.get('max_points', DEFAULT_MAX_POINTS))
+        return {
+            'zoom': zoom,
+            'clustered': False,
+            'total': int(len(indices)),
+            'truncated': len(selected) < len(indices),
+            'items': [{'type': 'point', 'defect': record} for record in store.records(selected)]
+        }
+
+    # 範圍涵蓋過多圖磚時（如高解析度螢幕）改用較粗的縮放等級
+    tiles = tiles_for_bbox(bbox, zoom)
+    while len(tiles) > MAX_TILES_PER_REQUEST and zoom > 0:
+        zoom -= 1
+        tiles = tiles_for_bbox(bbox, zoom)
+
+    cache = get_cluster_cache()
+    store = get_defect_store()
+    # 欄式快照內容變更後舊的聚合結果自動失效；暫時快照則只依 TTL 失效
+    version = store.version if store is not None else 'live'
+    filter_key = make_cache_key('clusters', defect_filter.to_params())
+
+    results = {}
+    missing = []
+    for tile in tiles:
+        cached = cache.get(f'{version}|{zoom}/{tile[0]}/{tile[1]}|{filter_key}') if cache else None
+        if cached is not None:
+            results[tile] = json.loads(cached)
+        else:
+            missing.append(tile)
+
+    if missing:
+        tile_bboxes = [tile_bbox(zoom, x, y) for x, y in missing]
+        union = (min(b[0] for b in tile_bboxes), min(b[1] for b in tile_bboxes),
+                 max(b[2] for b in tile_bboxes), max(b[3] for b in tile_bboxes))
+        dataset = get_map_dataset(defect_filter, union)
+        if dataset is None:
+            return None
+        store, indices = dataset
+
+        tile_x, tile_y = tile_of(store, indices, zoom)
+        ttl = map_config.get('cluster_cache_ttl', 60)
+        for x, y in missing:
+            items = cluster_tile(store, indices[(tile_x == x) & (tile_y == y)], zoom, clustered)
+            results[(x, y)] = items
+            if cache:
+                cache.set(f'{version}|{zoom}/{x}/{y}|{filter_key}',
+                          json.dumps(items, ensure_ascii=False).encode('utf-8'), ttl)
+
+    items = [item for tile in tiles for item in results[tile]]
+    return {
+        'zoom': zoom,
+        'clustered': True,
+        'total': sum(item['count'] if item['type'] == 'cluster' else 1 for item in items),
+        'truncated': False,
+        'items': items
+    }
+
+
+def get_heatmap(defect_filter, cell_size: Optional[float] = None) -> Optional[Dict[str, Any]]:
+    """取得符合條件的瑕疵密度網格
+
+    Args:
+        defect_filter: 查詢條件（DefectFilter）
+        cell_size: 網格大小（度），超出允許範圍時取最接近的值
+
+    Returns:
+        Optional[Dict]: 密度網格（見 compute_heatmap），無法取得資料時返回 None
+    """
+    map_config = get_map_config()
+    if cell_size is None:
+        cell_size = map_config.get('heatmap_cell_size', DEFAULT_HEATMAP_CELL_SIZE)
+    cell_size = float(np.clip(cell_size, MIN_HEATMAP_CELL_SIZE, MAX_HEATMAP_CELL_SIZE))
+    weights = map_config.get('heatmap_severity_weights', DEFAULT_SEVERITY_WEIGHTS)
+
+    cache = get_cluster_cache()
+    store = get_defect_store()
+    version = store.version if store is not None else 'live'
+    key = f"{version}|heatmap/{cell_size}|{make_cache_key('heatmap', defect_filter.to_params())}"
+    cached = cache.get(key) if cache else None
+    if cached is not None:
+        return json.loads(cached)
+
+    if store is not None:
+        dataset = store, store.select(defect_filter)
+    else:
+        store = get_filtered_store(defect_filter)
+        if store is None:
+            return None
+        dataset = store, np.arange(store.size)
+
+    heatmap = compute_heatmap(*dataset, cell_size, weights)
+    if cache:
+        cache.set(key, json.dumps(heatmap).encode('utf-8'), map_config.get('cluster_cache_ttl', 60))
+    return heatmap
+
+
+def init_map_data(app) -> MemoryCacheBackend:
+    """建立地圖聚合結果與熱點網格的快取，以及依查詢條件的暫時快照快取
+
+    Args:
+        app: Flask 應用程式實例
+    """
+    map_config = app.config.get('CURRENT_CONFIG', {}).get('map', {})
+    cache = MemoryCacheBackend(max_bytes=map_config.get('cluster_cache_bytes', 16 * 1024 * 1024))
+    app.extensions['map_cluster_cache'] = cache
+    app.extensions['map_datasets'] = FilteredDatasets(
+        ttl=map_config.get('dataset_cache_ttl', 30),
+        max_entries=map_config.get('dataset_cache_size', 8)
+    )
+    return cache
+
+
+def get_cluster_cache() -> Optional[MemoryCacheBackend]:
+    """取得地圖聚合結果與熱點網格的快取"""
+    return current_app.extensions.get('map_cluster_cache')
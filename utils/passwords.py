@@ -0,0 +1,204 @@
+"""
+密碼雜湊與登入記錄
+
+1. 密碼雜湊（PBKDF2）在固定大小的執行緒池中計算：hashlib 計算時會釋放 GIL，
+   登入尖峰時同時進行的雜湊數不超過執行緒數，其餘請求執行緒仍可處理其他請求
+2. 雜湊參數（演算法與迭代次數）可設定，登入時發現舊參數的雜湊會以新參數重新雜湊
+3. 最後登入時間先記錄在記憶體中，由背景工作定期批次寫入資料庫
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from datetime import datetime, timezone
+from flask import current_app, has_app_context
+from sqlalchemy import bindparam
+from typing import Callable, Dict, Optional
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+from config.database import db
+from utils.background import register_periodic_task
+
+# 預設雜湊方法（與 Werkzeug 預設相同）
+DEFAULT_METHOD = 'pbkdf2:sha256'
+
+
+class PasswordHashingBusy(RuntimeError):
+    """等待雜湊執行緒逾時"""
+
+
+def normalize_method(method: str) -> str:
+    """補上 PBKDF2 的迭代次數，方便與已儲存的雜湊比較"""
+    if method.startswith('pbkdf2:') and method.count(':') == 1:
+        return f'{method}:{DEFAULT_PBKDF2_ITERATIONS}'
+    return method
+
+
+class PasswordHasher:
+    """在執行緒池中計算密碼雜湊"""
+
+    def __init__(self, method: str = DEFAULT_METHOD, workers: int = 0, timeout: float = 10):
+        """
+        Args:
+            method: Werkzeug 雜湊方法，例如 pbkdf2:sha256:260000
+            workers: 同時計算的雜湊數，0 表示使用 CPU 核心數
+            timeout: 等待雜湊結果的時間上限（秒）
+        """
+        self.method = normalize_method(method)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """取得目前行程的執行緒池（fork 後重新建立）"""
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, fn: Callable, *args):
+        future = self.executor.submit(fn, *args)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            raise PasswordHashingBusy('密碼驗證忙碌中，請稍後再試')
+
+    def hash(self, password: str) -> str:
+        """以目前設定的參數雜湊密碼"""
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash: str, password: str) -> bool:
+        """驗證密碼"""
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash: str) -> bool:
+        """雜湊是否以不同於目前設定的參數產生"""
+        return password_hash.split('$', 1)[0] != self.method
+
+    def close(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False)
+        self._executor = None
+
+
+class LoginRecorder:
+    """在記憶體中累積最後登入時間，定期批次寫入資料庫"""
+
+    def __init__(self):
+        self._pending: Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+
+    def record(self, user_id: int, when: Optional[datetime] = None):
+        """記錄登入，同一使用者只保留最新的時間"""
+        with self._lock:
+            self._pending[user_id] = when or datetime.now(timezone.utc)
+
+    def flush(self) -> int:
+        """將累積的登入時間寫入資料庫（需在應用程式上下文中呼叫）
+
+        Returns:
+            int: 更新的使用者數
+        """
+        # models.user 匯入本模組，於呼叫時才匯入以避免循環匯入
+        from models.user import User
+        from utils.identity import invalidate_user
+
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        table = User.__table__
+        statement = table.update().where(table.c.id == bindparam('user_id')).values(
+            last_login_at=bindparam('login_at')
+        )
+        try:
+            db.session.execute(statement, [
+                {'user_id': user_id, 'login_at': login_at}
+                for user_id, login_at in pending.items()
+            ])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # 寫入失敗時放回佇列，保留較新的時間
+            with self._lock:
+                for user_id, login_at in pending.items():
+                    self._pending[user_id] = max(login_at, self._pending.get(user_id, login_at))
+            raise
+
+        # 批次更新不經過 ORM 事件，需自行使快取的使用者失效
+        for user_id in pending:
+            invalidate_user(user_id)
+        return len(pending)
+
+
+def hash_password(password: str) -> str:
+    """雜湊密碼，沒有應用程式或未設定執行緒池時直接在目前執行緒計算"""
+    hasher = get_password_hasher()
+    if hasher is None:
+        return generate_password_hash(password)
+    return hasher.hash(password)
+
+
+def verify_password_hash(password_hash: str, password: str) -> bool:
+    """驗證密碼，沒有應用程式或未設定執行緒池時直接在目前執行緒計算"""
+    hasher = get_password_hasher()
+    if hasher is None:
+        return check_password_hash(password_hash, password)
+    return hasher.verify(password_hash, password)
+
+
+def init_passwords(app) -> PasswordHasher:
+    """根據設定建立密碼雜湊執行緒池與登入記錄
+
+    Args:
+        app: Flask 應用程式實例
+
+    Returns:
+        PasswordHasher: 密碼雜湊
+    """
+    password_config = app.config.get('CURRENT_CONFIG', {}).get('passwords', {})
+    hasher = PasswordHasher(
+        method=password_config.get('method', DEFAULT_METHOD),
+        workers=password_config.get('workers', 0),
+        timeout=password_config.get('timeout', 10)
+    )
+    app.extensions['password_hasher'] = hasher
+
+    flush_interval = password_config.get('last_login_flush_interval', 10)
+    if flush_interval > 0:
+        recorder = LoginRecorder()
+        app.extensions['login_recorder'] = recorder
+        register_periodic_task(app, 'last-login-flush', flush_interval, recorder.flush)
+
+        def flush_at_exit():
+            with app.app_context():
+                try:
+                    recorder.flush()
+                except Exception as e:
+                    app.logger.error(f"寫入最後登入時間失敗: {str(e)}")
+
+        atexit.register(flush_at_exit)
+    else:
+        app.extensions['login_recorder'] = None
+    return hasher
+
+
+def get_password_hasher() -> Optional[PasswordHasher]:
+    """取得目前應用程式的密碼雜湊，不在應用程式上下文中時返回 None"""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('password_hasher')
+
+
+def get_login_recorder() -> Optional[LoginRecorder]:
+    """取得目前應用程式的登入記錄，未啟用批次寫入時返回 None"""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('login_recorder')
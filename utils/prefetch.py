@@ -0,0 +1,160 @@
+"""
+瑕疵圖片預先下載
+
+列出高水位標記（最新的拍攝時間）減去重疊時間之後的瑕疵，預先將原圖、常用尺寸的縮圖
+與預覽圖下載到圖片磁碟快取，讓第一位使用者開啟頁面時不需等待上游。
+重疊區間涵蓋延遲上傳的瑕疵，已快取的圖片不會重新下載。
+下載以有限的並行數與每秒請求數進行，避免對上游造成尖峰負載。
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from typing import Dict, Any, List, Optional
+from config.database import db
+from models.defect import SyncState
+from utils.background import register_periodic_task
+from utils.image_cache import ImageUnavailable, fetch_image, get_image_cache
+from utils.query import DefectFilter, fetch_defects
+from utils.thumbnails import fetch_thumbnail, get_placeholders, get_thumbnail_renderer
+from utils.timeutil import parse_time, format_time
+
+# 同步進度名稱
+SYNC_STATE_NAME = 'image_prefetch'
+
+
+class RateLimiter:
+    """以固定間隔限制每秒的請求數（多執行緒共用）"""
+
+    def __init__(self, rate: float):
+        """
+        Args:
+            rate: 每秒允許的請求數，0 表示不限制
+        """
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """等待直到可以發送下一個請求"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def get_prefetch_config() -> Dict[str, Any]:
+    """取得 image_prefetch 設定"""
+    return current_app.config.get('CURRENT_CONFIG', {}).get('image_prefetch', {})
+
+
+def _prefetch_one(defect_id: int, widths: List[int], limiter: RateLimiter) -> bool:
+    """下載單一瑕疵的原圖與縮圖
+
+    Returns:
+        bool: 是否全部成功（上游回應 404 沒有圖片視為完成，其他錯誤留待下次重試）
+    """
+    image_cache = get_image_cache()
+    if image_cache.get(str(defect_id)) is None:
+        limiter.acquire()
+    try:
+        if fetch_image(defect_id) is None:
+            return True
+
+        renderer = get_thumbnail_renderer()
+        if renderer is not None:
+            for width in widths:
+                options = renderer.normalize(width, None, None)
+                if options is not None and fetch_thumbnail(defect_id, *options) is None:
+                    return False
+    except ImageUnavailable as e:
+        current_app.logger.warning(str(e))
+        return False
+    return True
+
+
+def prefetch_images(since: Optional[datetime] = None) -> Dict[str, Any]:
+    """預先下載新瑕疵的圖片
+
+    Args:
+        since: 起始的拍攝時間，預設為上次的高水位標記減去重疊時間
+
+    Returns:
+        Dict: 處理的瑕疵數、失敗數與新的高水位標記
+    """
+    prefetch_config = get_prefetch_config()
+    if get_image_cache() is None:
+        raise RuntimeError('未啟用圖片磁碟快取，無法預先下載圖片')
+
+    state = SyncState.get(SYNC_STATE_NAME)
+    if since is None and state.high_water_mark is not None:
+        since = state.high_water_mark - timedelta(minutes=prefetch_config.get('overlap_minutes', 60))
+    if since is None:
+        since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=prefetch_config.get('initial_days', 1))
+
+    result = fetch_defects(DefectFilter(start_time=format_time(since)))
+    if not result['success']:
+        db.session.rollback()
+        raise RuntimeError(f"取得新瑕疵列表失敗: {result['message']}")
+
+    defects = [d for d in result['data'] if d.get('has_image') and d.get('id') is not None]
+    defects.sort(key=lambda d: d.get('capture_time') or '')
+    widths = prefetch_config.get('thumbnail_widths', [200, 400])
+    limiter = RateLimiter(prefetch_config.get('rate', 5))
+    app = current_app._get_current_object()
+
+    def run(defect):
+        with app.app_context():
+            try:
+                return _prefetch_one(int(defect['id']), widths, limiter)
+            except Exception as e:
+                app.logger.error(f"預先下載瑕疵 {defect['id']} 的圖片失敗: {str(e)}")
+                return False
+
+    with ThreadPoolExecutor(max_workers=prefetch_config.get('concurrency', 4),
+                            thread_name_prefix='image-prefetch') as executor:
+        outcomes = list(executor.map(run, defects))
+
+    # 失敗的瑕疵留待下次重試：高水位標記停在最早失敗的拍攝時間
+    failed = [d for d, ok in zip(defects, outcomes) if not ok]
+    capture_times = [t for t in (parse_time(d.get('capture_time')) for d in (failed or defects)) if t]
+    if capture_times:
+        state.high_water_mark = min(capture_times) if failed else max(capture_times)
+    state.last_synced_at = datetime.now(timezone.utc)
+    state.last_count = len(defects)
+    db.session.commit()
+
+    # 預覽圖在圖片下載完成後於背景工作中產生，列表請求即可直接讀取
+    renderer = get_thumbnail_renderer()
+    if renderer is not None:
+        get_placeholders((int(d['id']) for d in defects), timeout=renderer.timeout)
+
+    current_app.logger.info(f"圖片預先下載完成，共 {len(defects)} 筆，失敗 {len(failed)} 筆")
+    return {
+        'defects': len(defects),
+        'failed': len(failed),
+        'high_water_mark': format_time(state.high_water_mark)
+    }
+
+
+def init_image_prefetch(app):
+    """啟用時註冊背景預先下載工作（需同時啟用圖片磁碟快取）
+
+    Args:
+        app: Flask 應用程式實例
+    """
+    prefetch_config = app.config.get('CURRENT_CONFIG', {}).get('image_prefetch', {})
+    if not prefetch_config.get('enabled') or app.extensions.get('image_cache') is None:
+        return None
+    return register_periodic_task(
+        app,
+        'image-prefetch',
+        prefetch_config.get('interval', 600),
+        prefetch_images,
+        leader=True
+    )
@@ -0,0 +1,443 @@
+"""
+瑕疵查詢規劃工具
+
+將請求參數標準化為單一查詢條件物件，計算所需的最少上游請求，
+並在本地套用上游無法處理的條件。
+
+列表另提供以 ID 為鍵的游標分頁與逐筆輸出，避免每個請求都建立完整的結果列表。
+"""
+import base64
+import json
+from itertools import product
+from flask import current_app
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from utils.api import call_road_defect_api_many
+from utils.async_api import async_call_road_defect_api_many, run_sync
+from utils.defect_store import get_defect_store
+from utils.replica import count_defects, is_replica_mode, iter_defect_raw, query_defect_page, query_defects
+
+# 上游 API 預設可接受多值的參數（參考 /api/road-defects/* 代理路由）
+DEFAULT_MULTI_VALUE_PARAMS = ('city', 'district', 'road_section', 'defect_type', 'severity')
+
+# 展開為多個上游請求時的上限，超過則改為本地過濾
+DEFAULT_MAX_FANOUT = 32
+
+
+class DefectFilter:
+    """標準化後的瑕疵查詢條件
+
+    列表欄位以排序後的 tuple 表示，None 代表不限制。
+    """
+
+    LIST_FIELDS = ('city', 'district', 'road_section', 'defect_type', 'severity')
+    INT_FIELDS = ('defect_type', 'severity')
+    TIME_FIELDS = ('start_time', 'end_time')
+
+    def __init__(self, **conditions):
+        """
+        Args:
+            **conditions: 各欄位的條件值，列表欄位可為單一值或列表
+        """
+        for field in self.LIST_FIELDS:
+            setattr(self, field, self._normalize_values(field, conditions.get(field)))
+        for field in self.TIME_FIELDS:
+            setattr(self, field, conditions.get(field) or None)
+
+    @classmethod
+    def _normalize_values(cls, field: str, values: Any) -> Optional[Tuple]:
+        """標準化列表欄位的值，移除 'all' 與無效值"""
+        if values is None:
+            return None
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+
+        normalized = set()
+        for value in values:
+            if value is None or value == '' or value == 'all':
+                continue
+            if field in cls.INT_FIELDS:
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    current_app.logger.error(f'無效的{field}值: {value}')
+                    continue
+            normalized.add(value)
+
+        # 選擇了 'all' 或沒有有效值時視為不限制
+        if not normalized or 'all' in values:
+            return None
+        return tuple(sorted(normalized))
+
+    @classmethod
+    def from_args(cls, args) -> 'DefectFilter':
+        """從請求參數建立查詢條件
+
+        同時支援 `city=...` 與 `city[]=...` 兩種寫法。
+
+        Args:
+            args: request.args
+
+        Returns:
+            DefectFilter: 查詢條件
+        """
+        conditions = {}
+        for field in cls.LIST_FIELDS:
+            values = args.getlist(field) + args.getlist(f'{field}[]')
+            conditions[field] = values or None
+        for field in cls.TIME_FIELDS:
+            conditions[field] = args.get(field)
+        return cls(**conditions)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """轉換為字典格式（僅包含有限制的欄位）"""
+        return {
+            field: getattr(self, field)
+            for field in self.LIST_FIELDS + self.TIME_FIELDS
+            if getattr(self, field) is not None
+        }
+
+    def to_params(self) -> Dict[str, Any]:
+        """轉換為上游 API 參數（列表欄位以列表傳遞）"""
+        return {
+            field: list(value) if isinstance(value, tuple) else value
+            for field, value in self.as_dict().items()
+        }
+
+    def matches(self, defect: Dict[str, Any], fields: Optional[Tuple[str, ...]] = None) -> bool:
+        """檢查瑕疵是否符合列表欄位條件
+
+        Args:
+            defect: 瑕疵資料
+            fields: 要檢查的欄位，預設為所有列表欄位
+
+        Returns:
+            bool: 是否符合
+        """
+        for field in fields if fields is not None else self.LIST_FIELDS:
+            allowed = getattr(self, field)
+            if allowed is None:
+                continue
+            value = defect.get(field)
+            if isinstance(value, dict):
+                value = value.get('value')
+            if value not in allowed:
+                return False
+        return True
+
+    def __eq__(self, other):
+        return isinstance(other, DefectFilter) and self.as_dict() == other.as_dict()
+
+    def __hash__(self):
+        return hash(tuple(sorted(self.as_dict().items())))
+
+    def __repr__(self):
+        return f'<DefectFilter({self.as_dict()})>'
+
+
+class QueryPlan:
+    """上游查詢計畫"""
+
+    def __init__(self, requests: List[Dict[str, Any]], local_fields: Tuple[str, ...]):
+        """
+        Args:
+            requests: 每個上游請求的參數
+            local_fields: 需要在本地過濾的欄位
+        """
+        self.requests = requests
+        self.local_fields = local_fields
+
+    def __repr__(self):
+        return f'<QueryPlan(requests={len(self.requests)}, local_fields={self.local_fields})>'
+
+
+def plan_defect_query(
+    defect_filter: DefectFilter,
+    multi_value_params: Optional[Tuple[str, ...]] = None,
+    max_fanout: int = DEFAULT_MAX_FANOUT
+) -> QueryPlan:
+    """計算滿足查詢條件所需的最少上游請求
+
+    上游可接受多值的欄位直接以列表下推；其餘多值欄位展開為多個請求，
+    若展開數量超過上限則改為本地過濾。道路欄位一律在本地再過濾一次。
+
+    Args:
+        defect_filter: 查詢條件
+        multi_value_params: 上游可接受多值的參數
+        max_fanout: 最多展開的上游請求數
+
+    Returns:
+        QueryPlan: 查詢計畫
+    """
+    if multi_value_params is None:
+        multi_value_params = DEFAULT_MULTI_VALUE_PARAMS
+
+    base_params = {}
+    expand = []
+    local_fields = {'road_section'}
+
+    for field, value in defect_filter.to_params().items():
+        if field not in DefectFilter.LIST_FIELDS or field in multi_value_params:
+            base_params[field] = value
+        elif len(value) == 1:
+            base_params[field] = value[0]
+        else:
+            expand.append((field, value))
+
+    # 依值數量由少到多展開，超過上限的欄位改為本地過濾
+    expand.sort(key=lambda item: len(item[1]))
+    fanout = 1
+    expanded = []
+    for field, values in expand:
+        if fanout * len(values) > max_fanout:
+            local_fields.add(field)
+            continue
+        fanout *= len(values)
+        expanded.append((field, values))
+
+    requests = []
+    for combination in product(*[values for _, values in expanded]):
+        params = base_params.copy()
+        for (field, _), value in zip(expanded, combination):
+            params[field] = value
+        requests.append(params)
+
+    return QueryPlan(requests, tuple(sorted(local_fields)))
+
+
+def _fetch_local(defect_filter: DefectFilter) -> Optional[Dict[str, Any]]:
+    """以欄式儲存或本地副本取得資料，兩者都未啟用時返回 None"""
+    # 啟用欄式儲存時以向量化遮罩過濾記憶體中的快照
+    store = get_defect_store()
+    if store is not None:
+        return {
+            'success': True,
+            'data': store.records(store.select(defect_filter)),
+            'failed': 0,
+            'message': None
+        }
+
+    # 副本模式下直接以索引查詢本地資料庫
+    if is_replica_mode():
+        return {
+            'success': True,
+            'data': query_defects(defect_filter),
+            'failed': 0,
+            'message': None
+        }
+    return None
+
+
+def _plan_upstream(defect_filter: DefectFilter) -> QueryPlan:
+    """依設定計算上游查詢計畫"""
+    api_config = current_app.config.get('CURRENT_CONFIG', {}).get('road_defect_api', {})
+    plan = plan_defect_query(
+        defect_filter,
+        multi_value_params=tuple(api_config.get('multi_value_params', DEFAULT_MULTI_VALUE_PARAMS)),
+        max_fanout=api_config.get('max_fanout', DEFAULT_MAX_FANOUT)
+    )
+    current_app.logger.debug(f"查詢計畫: {plan} {plan.requests}")
+    return plan
+
+
+def _merge_upstream(defect_filter: DefectFilter, plan: QueryPlan, results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """合併上游子查詢的結果：依 ID 去重並套用本地過濾條件"""
+    defects = []
+    seen_ids = set()
+    failed = 0
+    message = None
+    for result in results:
+        if not result.get('success'):
+            failed += 1
+            message = result.get('message')
+            continue
+        for defect in result['data'].get('data') or []:
+            if defect['id'] in seen_ids:
+                continue
+            seen_ids.add(defect['id'])
+            if defect_filter.matches(defect, plan.local_fields):
+                defects.append(defect)
+
+    return {
+        'success': failed < len(results),
+        'data': defects,
+        'failed': failed,
+        'message': message
+    }
+
+
+def fetch_defects(defect_filter: DefectFilter) -> Dict[str, Any]:
+    """取得符合條件的瑕疵資料
+
+    依序使用欄式儲存、本地副本，或依查詢計畫從上游取得。
+
+    Args:
+        defect_filter: 查詢條件
+
+    Returns:
+        Dict: success、data（去重並過濾後的瑕疵列表）、failed（失敗的上游請求數）與 message
+    """
+    local = _fetch_local(defect_filter)
+    if local is not None:
+        return local
+
+    plan = _plan_upstream(defect_filter)
+    results = call_road_defect_api_many([
+        {'endpoint': 'road-defects', 'params': params}
+        for params in plan.requests
+    ])
+    return _merge_upstream(defect_filter, plan, results)
+
+
+async def async_fetch_defects(defect_filter: DefectFilter) -> Dict[str, Any]:
+    """fetch_defects 的非同步版本，上游子查詢在事件迴圈上並行
+
+    本地查詢與合併結果在執行緒池中進行，不佔用事件迴圈。
+
+    Args:
+        defect_filter: 查詢條件
+
+    Returns:
+        Dict: 與 fetch_defects 相同
+    """
+    local = await run_sync(_fetch_local, defect_filter)
+    if local is not None:
+        return local
+
+    plan = _plan_upstream(defect_filter)
+    results = await async_call_road_defect_api_many([
+        {'endpoint': 'road-defects', 'params': params}
+        for params in plan.requests
+    ])
+    return await run_sync(_merge_upstream, defect_filter, plan, results)
+
+
+def encode_cursor(last_id: int) -> str:
+    """將上一頁最後一筆的 ID 編碼為游標"""
+    return base64.urlsafe_b64encode(f'id:{last_id}'.encode('ascii')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[int]:
+    """解析游標
+
+    Args:
+        cursor: encode_cursor 產生的游標，空值表示第一頁
+
+    Returns:
+        Optional[int]: 上一頁最後一筆的 ID
+
+    Raises:
+        ValueError: 游標格式無效
+    """
+    if not cursor:
+        return None
+    try:
+        decoded = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('ascii')
+        prefix, value = decoded.split(':', 1)
+        if prefix != 'id':
+            raise ValueError(decoded)
+        return int(value)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f'無效的游標: {cursor}') from e
+
+
+def fetch_defect_page(defect_filter: DefectFilter, after_id: Optional[int], limit: int) -> Dict[str, Any]:
+    """依 ID 順序取得一頁符合條件的瑕疵
+
+    欄式儲存與本地副本只解碼本頁的資料；上游模式仍需取得完整結果後再切頁。
+
+    Args:
+        defect_filter: 查詢條件
+        after_id: 上一頁最後一筆的 ID，None 表示第一頁
+        limit: 每頁筆數
+
+    Returns:
+        Dict: success、data（本頁瑕疵）、total（總筆數）、next_cursor（沒有下一頁時為 None）與 message
+    """
+    # 多取一筆以判斷是否還有下一頁
+    store = get_defect_store()
+    if store is not None:
+        indices, total = store.page(defect_filter, after_id, limit + 1)
+        defects = store.records(indices)
+    elif is_replica_mode():
+        defects, total = query_defect_page(defect_filter, after_id, limit + 1)
+    else:
+        result = fetch_defects(defect_filter)
+        if not result['success']:
+            return dict(result, data=[], total=0, next_cursor=None)
+        return paginate_defects(result['data'], after_id, limit)
+    return _page(defects, total, limit)
+
+
+def paginate_defects(defects: List[Dict[str, Any]], after_id: Optional[int], limit: int) -> Dict[str, Any]:
+    """從已取得的完整結果中依 ID 順序切出一頁，格式與 fetch_defect_page 相同
+
+    Args:
+        defects: 完整的瑕疵列表
+        after_id: 上一頁最後一筆的 ID，None 表示第一頁
+        limit: 每頁筆數
+    """
+    ordered = sorted(defects, key=lambda d: d['id'])
+    if after_id is not None:
+        ordered = [d for d in ordered if d['id'] > after_id]
+    return _page(ordered[:limit + 1], len(defects), limit)
+
+
+def _page(defects: List[Dict[str, Any]], total: int, limit: int) -> Dict[str, Any]:
+    """以多取一筆的結果組成分頁回應"""
+    has_more = len(defects) > limit
+    defects = defects[:limit]
+    return {
+        'success': True,
+        'data': defects,
+        'total': total,
+        'next_cursor': encode_cursor(defects[-1]['id']) if has_more else None,
+        'failed': 0,
+        'message': None
+    }
+
+
+def count_matching(defect_filter: DefectFilter) -> Optional[int]:
+    """以欄式儲存或本地副本計算符合條件的筆數，不解碼記錄
+
+    Args:
+        defect_filter: 查詢條件
+
+    Returns:
+        Optional[int]: 符合條件的筆數，只能從上游取得資料時返回 None
+    """
+    store = get_defect_store()
+    if store is not None:
+        return int(len(store.select(defect_filter)))
+    if is_replica_mode():
+        return count_defects(defect_filter)
+    return None
+
+
+def iter_defect_json(defect_filter: DefectFilter) -> Tuple[Optional[int], Iterator[bytes]]:
+    """逐筆輸出符合條件的瑕疵 JSON
+
+    欄式儲存直接輸出已編碼的記錄，本地副本逐批讀取，
+    兩者都不需要建立完整的結果列表；上游模式則逐筆編碼已取得的結果。
+
+    Args:
+        defect_filter: 查詢條件
+
+    Returns:
+        Tuple[Optional[int], Iterator[bytes]]: 總筆數（無法取得時為 None）與每筆瑕疵的 JSON
+
+    Raises:
+        RuntimeError: 無法從上游取得資料
+    """
+    store = get_defect_store()
+    if store is not None:
+        indices = store.select(defect_filter)
+        return len(indices), store.raw.iter_selected(indices)
+
+    if is_replica_mode():
+        return count_defects(defect_filter), (raw.encode('utf-8') for raw in iter_defect_raw(defect_filter))
+
+    result = fetch_defects(defect_filter)
+    if not result['success']:
+        raise RuntimeError(result['message'] or '無法獲取瑕疵列表數據')
+    defects = result['data']
+    return len(defects), (json.dumps(d, ensure_ascii=False).encode('utf-8') for d in defects)
@@ -0,0 +1,276 @@
+"""
+瑕疵資料本地副本
+
+以高水位標記（最新的拍攝時間）從上游增量同步瑕疵記錄到本地資料庫，
+並在「副本模式」下直接以索引查詢回應路由，不再經過上游 API。
+同步以跨行程的檔案鎖互斥，背景工作與同步腳本不會同時寫入副本。
+
+上游只能以拍攝時間篩選，沒有更新時間或 ID 游標：增量同步只會取得重疊區間內的記錄，
+較舊記錄的修改與上游的刪除由定期的完整比對（reconcile_interval）更新與移除。
+"""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Set, Tuple
+from config.database import db
+from models.defect import Defect, SyncState
+from utils.api import call_road_defect_api
+from utils.background import register_periodic_task
+from utils.rollups import RollupDays
+
+try:
+    import fcntl
+except ImportError:  # Windows 不支援 fcntl，僅能在行程內互斥
+    fcntl = None
+from utils.timeutil import parse_time, format_time
+
+# 同步進度名稱
+SYNC_STATE_NAME = 'defects'
+
+# 每批次查詢既有記錄的數量
+UPSERT_BATCH_SIZE = 500
+
+# 行程內的同步鎖（fcntl 不可用時使用）
+_sync_lock = threading.Lock()
+
+
+def get_replica_config() -> Dict[str, Any]:
+    """取得 defect_replica 設定"""
+    return current_app.config.get('CURRENT_CONFIG', {}).get('defect_replica', {})
+
+
+def is_replica_mode() -> bool:
+    """是否由本地副本回應讀取請求"""
+    replica_config = get_replica_config()
+    return bool(replica_config.get('enabled') and replica_config.get('serve_reads'))
+
+
+@contextmanager
+def replica_lock():
+    """取得副本同步的跨行程鎖，其他行程同步中時等待其完成"""
+    if fcntl is None:
+        with _sync_lock:
+            yield
+        return
+
+    lock_dir = os.path.join(current_app.instance_path, 'locks')
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, 'defect-replica.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def upsert_defects(records: Iterable[Dict[str, Any]], rollup_days=None) -> int:
+    """新增或更新瑕疵記錄（不提交交易）
+
+    Args:
+        records: 上游瑕疵記錄
+        rollup_days: 記錄彙總需重新計算日期的 RollupDays（可選）
+
+    Returns:
+        int: 處理的記錄數
+    """
+    # 同一批資料中重複的 ID 以最後一筆為準
+    records = list({int(record['id']): record for record in records if record.get('id') is not None}.values())
+    for start in range(0, len(records), UPSERT_BATCH_SIZE):
+        batch = records[start:start + UPSERT_BATCH_SIZE]
+        ids = [int(record['id']) for record in batch]
+        existing = {defect.id: defect for defect in Defect.query.filter(Defect.id.in_(ids))}
+        for record in batch:
+            defect = existing.get(int(record['id']))
+            if defect is None:
+                defect = Defect.from_record(record)
+                db.session.add(defect)
+            else:
+                if rollup_days is not None:
+                    rollup_days.add(defect)
+                defect.update_from_record(record)
+            if rollup_days is not None:
+                rollup_days.add(defect)
+    return len(records)
+
+
+def remove_missing_defects(ids: Set[int], rollup_days=None) -> int:
+    """刪除不在上游完整結果中的記錄（不提交交易）
+
+    Args:
+        ids: 上游目前所有記錄的 ID
+        rollup_days: 記錄彙總需重新計算日期的 RollupDays（可選）
+
+    Returns:
+        int: 刪除的記錄數
+    """
+    missing = [defect_id for (defect_id,) in db.session.query(Defect.id) if defect_id not in ids]
+    for start in range(0, len(missing), UPSERT_BATCH_SIZE):
+        for defect in Defect.query.filter(Defect.id.in_(missing[start:start + UPSERT_BATCH_SIZE])):
+            if rollup_days is not None:
+                rollup_days.add(defect)
+            db.session.delete(defect)
+    return len(missing)
+
+
+def sync_defects(full: bool = False) -> Dict[str, Any]:
+    """從上游同步瑕疵記錄
+
+    以上次同步的最新拍攝時間減去重疊時間作為 start_time，
+    重疊區間內的記錄會以 ID 更新，避免遺漏延遲上傳的資料。
+    第一次同步、指定 full 或距上次完整比對超過 reconcile_interval 秒時改為完整同步，
+    並刪除上游已不存在的記錄。
+    同一時間只有一個行程執行同步，其餘呼叫等待前一次同步完成後再執行。
+
+    Args:
+        full: 是否忽略高水位標記進行完整同步（並移除上游已刪除的記錄）
+
+    Returns:
+        Dict: 同步進度
+    """
+    with replica_lock():
+        return _sync_defects(full)
+
+
+def _sync_defects(full: bool) -> Dict[str, Any]:
+    replica_config = get_replica_config()
+    state = SyncState.get(SYNC_STATE_NAME)
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    reconcile_interval = replica_config.get('reconcile_interval', 86400)
+    if not full and reconcile_interval > 0:
+        full = state.reconciled_at is None or (now - state.reconciled_at).total_seconds() >= reconcile_interval
+
+    params = {}
+    if not full and state.high_water_mark is not None:
+        overlap = timedelta(minutes=replica_config.get('overlap_minutes', 60))
+        params['start_time'] = format_time(state.high_water_mark - overlap)
+
+    # 直接請求上游：快取或過期快取的資料可能比副本舊，寫入後會推進高水位標記
+    api_result = call_road_defect_api('road-defects', params=params or None, use_cache=False)
+    if not api_result.get('success'):
+        db.session.rollback()
+        raise RuntimeError(f"同步瑕疵資料失敗: {api_result.get('message')}")
+
+    records = api_result['data'].get('data') or []
+    rollup_days = RollupDays() if replica_config.get('rollups') else None
+    count = upsert_defects(records, rollup_days)
+    removed = 0
+    if full:
+        ids = {int(record['id']) for record in records if record.get('id') is not None}
+        removed = remove_missing_defects(ids, rollup_days)
+        state.reconciled_at = now
+    if rollup_days is not None:
+        rollup_days.apply()
+
+    capture_times = [t for t in (parse_time(record.get('capture_time')) for record in records) if t]
+    if capture_times:
+        latest = max(capture_times)
+        if state.high_water_mark is None or latest > state.high_water_mark:
+            state.high_water_mark = latest
+    state.last_synced_at = datetime.now(timezone.utc)
+    state.last_count = count
+    db.session.commit()
+
+    current_app.logger.info(
+        f"瑕疵副本{'完整' if full else '增量'}同步完成，共 {count} 筆，移除 {removed} 筆，高水位: {state.high_water_mark}"
+    )
+    return state.to_dict()
+
+
+def _filtered_query(defect_filter, *entities):
+    """建立套用查詢條件的本地副本查詢"""
+    query = db.session.query(*entities) if entities else Defect.query
+    for field in defect_filter.LIST_FIELDS:
+        values = getattr(defect_filter, field)
+        if values is not None:
+            query = query.filter(getattr(Defect, field).in_(values))
+
+    start_time = parse_time(defect_filter.start_time)
+    if start_time is not None:
+        query = query.filter(Defect.capture_time >= start_time)
+    end_time = parse_time(defect_filter.end_time)
+    if end_time is not None:
+        query = query.filter(Defect.capture_time <= end_time)
+    return query
+
+
+def query_defects(defect_filter) -> List[Dict[str, Any]]:
+    """以索引查詢本地副本
+
+    Args:
+        defect_filter: 查詢條件（DefectFilter）
+
+    Returns:
+        List[Dict]: 與上游格式相同的瑕疵列表
+    """
+    return [defect.to_dict() for defect in _filtered_query(defect_filter).order_by(Defect.id)]
+
+
+def query_defect_page(defect_filter, after_id: Optional[int], limit: int) -> Tuple[List[Dict[str, Any]], int]:
+    """以 ID 為鍵分頁查詢本地副本
+
+    Args:
+        defect_filter: 查詢條件（DefectFilter）
+        after_id: 上一頁最後一筆的 ID，None 表示第一頁
+        limit: 每頁筆數
+
+    Returns:
+        Tuple[List[Dict], int]: 本頁的瑕疵列表，以及符合條件的總筆數
+    """
+    query = _filtered_query(defect_filter)
+    total = query.count()
+    if after_id is not None:
+        query = query.filter(Defect.id > after_id)
+    return [defect.to_dict() for defect in query.order_by(Defect.id).limit(limit)], total
+
+
+def iter_defect_raw(defect_filter, batch_size: int = 1000) -> Iterator[str]:
+    """依 ID 順序逐批讀取本地副本的原始 JSON，不一次載入全部結果
+
+    Args:
+        defect_filter: 查詢條件（DefectFilter）
+        batch_size: 每批讀取的筆數
+    """
+    query = _filtered_query(defect_filter, Defect.raw).order_by(Defect.id).yield_per(batch_size)
+    for (raw,) in query:
+        yield raw
+
+
+def count_defects(defect_filter) -> int:
+    """計算本地副本中符合條件的筆數"""
+    return _filtered_query(defect_filter).count()
+
+
+def load_all_records() -> List[Dict[str, Any]]:
+    """載入本地副本中的所有瑕疵記錄"""
+    return [json.loads(raw) for (raw,) in db.session.query(Defect.raw).order_by(Defect.id)]
+
+
+def query_location_rows() -> List[Dict[str, Any]]:
+    """查詢本地副本中所有不重複的城市、行政區與道路組合"""
+    rows = db.session.query(Defect.city, Defect.district, Defect.road_section).distinct()
+    return [
+        {'city': city, 'district': district, 'road_section': road}
+        for city, district, road in rows
+    ]
+
+
+def init_replica(app):
+    """啟用時註冊背景增量同步工作
+
+    Args:
+        app: Flask 應用程式實例
+    """
+    replica_config = app.config.get('CURRENT_CONFIG', {}).get('defect_replica', {})
+    if not replica_config.get('enabled'):
+        return None
+    return register_periodic_task(
+        app,
+        'defect-replica-sync',
+        replica_config.get('sync_interval', 300),
+        sync_defects,
+        leader=True
+    )
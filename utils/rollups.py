@@ -0,0 +1,241 @@
+"""
+瑕疵數量時間區間彙總
+
+本地副本同步時重新計算有變動日期的每日彙總表（日、城市、行政區、類型、嚴重程度），
+週與月的統計由每日彙總推導。趨勢與統計查詢只需加總區間內的彙總列，
+查詢成本取決於區間數量而非瑕疵數量；不足一整天的邊界時段才查詢原始記錄。
+沒有拍攝時間的記錄不列入彙總。
+"""
+from datetime import date, datetime, time, timedelta
+from flask import current_app
+from typing import Dict, Any, Iterable, List, Optional, Set, Tuple
+from config.database import db
+from models.defect import Defect, DefectDailyRollup
+from utils.timeutil import parse_time, format_time
+
+# 彙總表可處理的查詢欄位（道路不在彙總鍵中）
+ROLLUP_FIELDS = ('city', 'district', 'defect_type', 'severity')
+
+# 與 utils.aggregation 相同的前端圖表類別數量
+SEVERITY_LEVELS = 3
+DEFECT_TYPES = 4
+
+# 重建彙總時每批讀取的記錄數
+REBUILD_BATCH_SIZE = 1000
+
+
+def rollups_enabled() -> bool:
+    """是否由每日彙總回應讀取請求（需同時啟用副本模式）"""
+    replica_config = current_app.config.get('CURRENT_CONFIG', {}).get('defect_replica', {})
+    return bool(replica_config.get('enabled') and replica_config.get('serve_reads')
+                and replica_config.get('rollups'))
+
+
+class RollupDays:
+    """同步過程中有記錄變動的日期
+
+    套用時以本地副本的記錄重新計算這些日期的彙總，而不是累加增減量：
+    結果只取決於副本內容，重複套用或與其他同步先後執行都不會重複計算。
+    """
+
+    def __init__(self):
+        self.days: Set[date] = set()
+
+    def add(self, defect: Defect):
+        """記錄瑕疵所在的日期（更新前後各呼叫一次）"""
+        if defect.capture_time is not None:
+            self.days.add(defect.capture_time.date())
+
+    def apply(self):
+        """重新計算有變動日期的彙總（不提交交易）"""
+        if self.days:
+            recompute_rollups(self.days)
+        self.days = set()
+
+
+def _summarize(defects: Iterable[Defect], days: Optional[Set[date]] = None) -> Dict[Tuple, List]:
+    """依彙總鍵統計數量與最早、最晚拍攝時間"""
+    summary: Dict[Tuple, List] = {}
+    for defect in defects:
+        key = DefectDailyRollup.key_of(defect)
+        if key is None or (days is not None and key[0] not in days):
+            continue
+        entry = summary.setdefault(key, [0, defect.capture_time, defect.capture_time])
+        entry[0] += 1
+        entry[1] = min(entry[1], defect.capture_time)
+        entry[2] = max(entry[2], defect.capture_time)
+    return summary
+
+
+def recompute_rollups(days: Optional[Iterable[date]] = None) -> int:
+    """以本地副本重新計算每日彙總（不提交交易）
+
+    Args:
+        days: 要重新計算的日期，None 表示全部
+
+    Returns:
+        int: 彙總列數
+    """
+    # 讓同一交易中尚未寫入的副本記錄也納入計算
+    db.session.flush()
+    rollups = DefectDailyRollup.query
+    defects = Defect.query
+    if days is not None:
+        days = set(days)
+        if not days:
+            return 0
+        rollups = rollups.filter(DefectDailyRollup.day.in_(days))
+        defects = defects.filter(
+            Defect.capture_time >= datetime.combine(min(days), time.min),
+            Defect.capture_time < datetime.combine(max(days) + timedelta(days=1), time.min)
+        )
+    rollups.delete(synchronize_session=False)
+
+    summary = _summarize(defects.yield_per(REBUILD_BATCH_SIZE), days)
+    for (day, city, district, defect_type, severity), (count, first, last) in summary.items():
+        db.session.add(DefectDailyRollup(day=day, city=city, district=district, defect_type=defect_type,
+                                         severity=severity, count=count,
+                                         first_capture_time=first, last_capture_time=last))
+    return len(summary)
+
+
+def rebuild_rollups() -> int:
+    """以本地副本重建所有每日彙總
+
+    Returns:
+        int: 彙總列數
+    """
+    count = recompute_rollups()
+    db.session.commit()
+    return count
+
+
+def can_use_rollups(defect_filter) -> bool:
+    """檢查查詢條件是否可由彙總表回答"""
+    return rollups_enabled() and defect_filter.road_section is None
+
+
+def _apply_filter(query, model, defect_filter):
+    for field in ROLLUP_FIELDS:
+        values = getattr(defect_filter, field)
+        if values is not None:
+            query = query.filter(getattr(model, field).in_(values))
+    return query
+
+
+def _full_day_range(start: Optional[datetime], end: Optional[datetime]) -> Tuple[Optional[date], Optional[date]]:
+    """計算完整落在查詢區間內的第一天與最後一天"""
+    first_day = None
+    if start is not None:
+        first_day = start.date() if start.time() == time.min else start.date() + timedelta(days=1)
+    last_day = None
+    if end is not None:
+        last_day = end.date() if end.time() == time.max else end.date() - timedelta(days=1)
+    return first_day, last_day
+
+
+def collect_buckets(defect_filter) -> List[Tuple[date, Optional[int], Optional[int], int, datetime, datetime]]:
+    """取得查詢區間內的每日彙總
+
+    Returns:
+        List[Tuple]: (日, 類型, 嚴重程度, 數量, 最早時間, 最晚時間)
+    """
+    start = parse_time(defect_filter.start_time)
+    end = parse_time(defect_filter.end_time)
+    first_day, last_day = _full_day_range(start, end)
+
+    buckets = []
+    # 邊界時段：(起點, 終點, 是否包含終點)
+    edges = []
+    if first_day is not None and last_day is not None and first_day > last_day:
+        # 查詢區間不足一整天
+        edges.append((start, end, True))
+    else:
+        query = _apply_filter(DefectDailyRollup.query, DefectDailyRollup, defect_filter)
+        if first_day is not None:
+            query = query.filter(DefectDailyRollup.day >= first_day)
+        if last_day is not None:
+            query = query.filter(DefectDailyRollup.day <= last_day)
+        buckets.extend(
+            (row.day, row.defect_type, row.severity, row.count, row.first_capture_time, row.last_capture_time)
+            for row in query
+        )
+        if start is not None and start.time() != time.min:
+            edges.append((start, datetime.combine(first_day, time.min), False))
+        if end is not None and end.time() != time.max:
+            edges.append((datetime.combine(last_day + timedelta(days=1), time.min), end, True))
+
+    # 不足一整天的邊界時段直接查詢原始記錄
+    for edge_start, edge_end, inclusive in edges:
+        query = _apply_filter(Defect.query, Defect, defect_filter).filter(Defect.capture_time >= edge_start)
+        query = query.filter(Defect.capture_time <= edge_end if inclusive else Defect.capture_time < edge_end)
+        buckets.extend(
+            (defect.capture_time.date(), defect.defect_type, defect.severity, 1,
+             defect.capture_time, defect.capture_time)
+            for defect in query
+        )
+    return buckets
+
+
+def _counts(items: Iterable[Tuple[Optional[int], int]], minlength: int) -> List[int]:
+    counts = [0] * minlength
+    for value, count in items:
+        if value is None or value < 0:
+            continue
+        if value >= len(counts):
+            counts.extend([0] * (value + 1 - len(counts)))
+        counts[value] += count
+    return counts
+
+
+def rollup_stats(defect_filter) -> Dict[str, Any]:
+    """以每日彙總計算基本統計（格式與 utils.aggregation.compute_stats 相同）"""
+    buckets = collect_buckets(defect_filter)
+    total = sum(b[3] for b in buckets)
+    earliest = min((b[4] for b in buckets if b[4] is not None), default=None)
+    latest = max((b[5] for b in buckets if b[5] is not None), default=None)
+    return {
+        'severity_stats': {
+            'total': total,
+            'by_severity': _counts(((b[2], b[3]) for b in buckets), SEVERITY_LEVELS)
+        },
+        'defect_type_stats': {
+            'total': total,
+            'by_type': _counts(((b[1], b[3]) for b in buckets), DEFECT_TYPES)
+        },
+        'time_range': {
+            'earliest': format_time(earliest),
+            'latest': format_time(latest)
+        }
+    }
+
+
+def bucket_start(day: date, interval: str) -> date:
+    """將日期對齊到週（星期一）或月的起點"""
+    if interval == 'week':
+        return day - timedelta(days=day.weekday())
+    if interval == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def rollup_trends(defect_filter, interval: str = 'month') -> List[Dict[str, Any]]:
+    """以每日彙總計算趨勢（格式與 utils.aggregation.compute_trends 相同）"""
+    grouped = {}
+    for day, defect_type, severity, count, _, _ in collect_buckets(defect_filter):
+        grouped.setdefault(bucket_start(day, interval), []).append((defect_type, severity, count))
+
+    trends = []
+    for start in sorted(grouped):
+        rows = grouped[start]
+        label = start.strftime('%Y-%m') if interval == 'month' else start.isoformat()
+        trends.append({
+            'period': label,
+            # 前端以 month 欄位作為圖表標籤
+            'month': label,
+            'start': format_time(datetime.combine(start, time.min)),
+            'total_defects': sum(r[2] for r in rows),
+            'by_severity': _counts(((r[1], r[2]) for r in rows), SEVERITY_LEVELS),
+            'by_type': _counts(((r[0], r[2]) for r in rows), DEFECT_TYPES)
+        })
+    return trends
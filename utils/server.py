@@ -0,0 +1,143 @@
+"""
+正式環境多 worker 啟動
+
+以 gunicorn 預先載入應用程式後 fork 出多個 worker：
+- 主行程載入應用程式並預熱欄式儲存，worker 以 copy-on-write 共用這些記憶體
+- fork 前釋放主行程的資料庫連線，fork 後重建上游 API 連線池，每個 worker 各自持有連線
+- 其餘以行程 ID 區分的資源（背景工作、SQLite 快取、縮圖行程池、非同步客戶端）在 worker 中自動重建
+- 會寫入共用資源的背景工作（資料同步、欄式儲存與地理位置索引更新、圖片預先下載、匯出清理）
+  以檔案鎖選出一個 worker 執行，其餘 worker 讀取其發布的快照
+
+平滑重新載入：對主行程送出 SIGHUP 會依序以新的 worker 取代舊的 worker；
+由於應用程式已預先載入，更新程式碼需送出 SIGUSR2 啟動新的主行程後再對舊主行程送出 SIGQUIT。
+"""
+import multiprocessing
+import os
+from flask import current_app
+from typing import Any, Dict, Optional
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # 選用套件，僅正式環境啟動時需要
+    BaseApplication = None
+
+
+def default_worker_count() -> int:
+    """依 CPU 核心數計算 worker 數（2 × 核心數 + 1）"""
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+def get_server_config(config: Dict[str, Any]) -> Dict[str, Any]:
+    """取得 server 設定，workers 為 0 或未設定時依 CPU 核心數計算
+
+    Args:
+        config: 目前環境的設定
+
+    Returns:
+        Dict: server 設定
+    """
+    server_config = dict(config.get('server', {}))
+    if not server_config.get('workers'):
+        server_config['workers'] = default_worker_count()
+    return server_config
+
+
+def prepare_fork(app):
+    """在主行程 fork 前執行：預熱共用資料並釋放資料庫連線"""
+    from config.database import db
+
+    with app.app_context():
+        server_config = get_server_config(app.config.get('CURRENT_CONFIG', {}))
+        holder = app.extensions.get('defect_store')
+        if holder is not None and server_config.get('preload_warmup', True):
+            try:
+                holder.refresh()
+            except Exception as e:
+                app.logger.error(f"預熱欄式儲存失敗: {str(e)}")
+        # 連線不可跨行程共用，fork 前清空連線池
+        db.engine.dispose()
+
+
+def reset_after_fork(app):
+    """在 worker fork 後執行：重建上游 API 連線池"""
+    from utils.api import init_api_client
+
+    client = app.extensions.get('road_defect_api')
+    init_api_client(app)
+    if client is not None:
+        client.close()
+
+
+def run_production(
+    app,
+    host: str,
+    port: int,
+    workers: Optional[int] = None,
+    ssl_context: Optional[tuple] = None
+):
+    """以多 worker 模式啟動應用程式
+
+    Args:
+        app: Flask 應用程式實例
+        host: 服務主機位址
+        port: 服務端口
+        workers: worker 數，預設使用 server 設定
+        ssl_context: (證書路徑, 私鑰路徑)
+    """
+    if BaseApplication is None:
+        raise RuntimeError('正式環境啟動需要安裝 gunicorn')
+
+    server_config = get_server_config(app.config.get('CURRENT_CONFIG', {}))
+    if workers:
+        server_config['workers'] = workers
+    app.extensions['server'] = {
+        'mode': 'gunicorn',
+        'workers': server_config['workers'],
+        'threads': server_config.get('threads', 4)
+    }
+
+    pidfile = server_config.get('pidfile')
+    if pidfile and not os.path.isabs(pidfile):
+        pidfile = os.path.join(app.instance_path, pidfile)
+
+    prepare_fork(app)
+
+    def post_fork(server, worker):
+        reset_after_fork(app)
+
+    options = {
+        'bind': f'{host}:{port}',
+        'workers': server_config['workers'],
+        'worker_class': server_config.get('worker_class', 'gthread'),
+        'threads': server_config.get('threads', 4),
+        'timeout': server_config.get('timeout', 60),
+        'graceful_timeout': server_config.get('graceful_timeout', 30),
+        'keepalive': server_config.get('keepalive', 5),
+        'max_requests': server_config.get('max_requests', 0),
+        'max_requests_jitter': server_config.get('max_requests_jitter', 0),
+        'pidfile': pidfile,
+        'preload_app': True,
+        'post_fork': post_fork,
+        'certfile': ssl_context[0] if ssl_context else None,
+        'keyfile': ssl_context[1] if ssl_context else None
+    }
+
+    class ProductionServer(BaseApplication):
+        """以 gunicorn 執行預先載入的 Flask 應用程式"""
+
+        def load_config(self):
+            for key, value in options.items():
+                if key in self.cfg.settings and value is not None:
+                    self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    ProductionServer().run()
+
+
+def get_server_info() -> Dict[str, Any]:
+    """取得目前的服務模式與 worker 資訊"""
+    info = dict(current_app.extensions.get('server') or {'mode': 'development', 'workers': 1, 'threads': 1})
+    info['pid'] = os.getpid()
+    return info
@@ -0,0 +1,145 @@
+"""
+相同上游請求的合併（single-flight）
+
+同一個鍵同時只會有一個呼叫者實際發送請求，其餘呼叫者等待並共用其結果。
+可選擇以本機鎖定檔案延伸到同一主機上的多個 worker：鍵值雜湊到固定數量的鎖定檔案，
+檔案數不隨查詢參數增加，雜湊到同一個檔案的不同鍵值會依序執行。
+"""
+import hashlib
+import os
+import threading
+from flask import current_app
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows 不支援 fcntl，僅能在 worker 內合併
+    fcntl = None
+
+# 跨 worker 鎖定檔案的預設數量
+DEFAULT_LOCK_STRIPES = 64
+
+
+class _Call:
+    """進行中的呼叫"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """以鍵值合併同時進行的相同呼叫"""
+
+    def __init__(self, lock_dir: Optional[str] = None, lock_stripes: int = DEFAULT_LOCK_STRIPES):
+        """
+        Args:
+            lock_dir: 跨 worker 鎖定檔案的目錄，None 表示僅在 worker 內合併
+            lock_stripes: 鎖定檔案數
+        """
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self.lock_stripes = max(1, lock_stripes)
+        if self.lock_dir:
+            os.makedirs(self.lock_dir, exist_ok=True)
+        self.coalesced = 0
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn: Callable[[], Any], recheck: Optional[Callable[[], Any]] = None) -> Any:
+        """執行或等待相同鍵值的呼叫
+
+        等待者與發起者共用同一個結果物件，呼叫端應將其視為唯讀。
+
+        Args:
+            key: 呼叫鍵值
+            fn: 實際執行的函數
+            recheck: 取得跨 worker 鎖後再次檢查共用快取的函數，命中時返回非 None 值
+
+        Returns:
+            Any: fn 的返回值
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_leader(key, fn, recheck)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+    def lock_path(self, key: str) -> str:
+        """取得鍵值對應的跨 worker 鎖定檔案"""
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.lock_dir, f'single-flight-{int(digest, 16) % self.lock_stripes}.lock')
+
+    def _run_leader(self, key: str, fn: Callable[[], Any], recheck: Optional[Callable[[], Any]]) -> Any:
+        """以發起者身分執行，必要時先取得跨 worker 鎖"""
+        if not self.lock_dir:
+            return fn()
+
+        lock_path = self.lock_path(key)
+        with open(lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # 其他 worker 可能已在我們等待鎖時完成請求並寫入共用快取
+                if recheck is not None:
+                    result = recheck()
+                    if result is not None:
+                        return result
+                return fn()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def init_single_flight(app) -> Optional[SingleFlight]:
+    """根據設定建立 single-flight 合併器
+
+    Args:
+        app: Flask 應用程式實例
+
+    Returns:
+        Optional[SingleFlight]: 合併器實例，未啟用時返回 None
+    """
+    api_config = app.config.get('CURRENT_CONFIG', {}).get('road_defect_api', {})
+    flight_config = api_config.get('single_flight', {})
+    if not flight_config.get('enabled', False):
+        app.extensions['road_defect_single_flight'] = None
+        return None
+
+    lock_dir = None
+    if flight_config.get('cross_process', False):
+        lock_dir = flight_config.get('lock_dir', 'locks')
+        if not os.path.isabs(lock_dir):
+            lock_dir = os.path.join(app.instance_path, lock_dir)
+
+    flight = SingleFlight(
+        lock_dir=lock_dir,
+        lock_stripes=flight_config.get('lock_stripes', DEFAULT_LOCK_STRIPES)
+    )
+    app.extensions['road_defect_single_flight'] = flight
+    return flight
+
+
+def get_single_flight() -> Optional[SingleFlight]:
+    """取得目前應用程式的 single-flight 合併器"""
+    return current_app.extensions.get('road_defect_single_flight')
@@ -0,0 +1,99 @@
+"""
+瑕疵座標的空間索引
+
+以固定大小的經緯度網格將瑕疵分桶，資料列依網格編號排序；
+矩形範圍查詢只需對每一列網格做二分搜尋取得候選資料，再精確比對座標。
+"""
+import numpy as np
+from typing import Optional, Tuple
+
+# 預設網格大小（度），約 1 公里
+DEFAULT_CELL_SIZE = 0.01
+
+BBox = Tuple[float, float, float, float]
+
+
+def parse_bbox(value: Optional[str]) -> Optional[BBox]:
+    """解析 bbox 參數（最小經度,最小緯度,最大經度,最大緯度）
+
+    與 Leaflet 的 LatLngBounds.toBBoxString() 格式相同。
+
+    Args:
+        value: bbox 參數值
+
+    Returns:
+        Optional[BBox]: (min_lon, min_lat, max_lon, max_lat)，格式無效時返回 None
+    """
+    if not value:
+        return None
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(part) for part in value.split(','))
+    except ValueError:
+        return None
+    if not all(np.isfinite([min_lon, min_lat, max_lon, max_lat])):
+        return None
+    if min_lon > max_lon or min_lat > max_lat:
+        return None
+    return min_lon, min_lat, max_lon, max_lat
+
+
+class GridIndex:
+    """經緯度網格索引"""
+
+    def __init__(self, latitude: np.ndarray, longitude: np.ndarray, cell_size: float = DEFAULT_CELL_SIZE):
+        """
+        Args:
+            latitude: 每一列的緯度（缺少時為 NaN）
+            longitude: 每一列的經度（缺少時為 NaN）
+            cell_size: 網格大小（度）
+        """
+        self.latitude = latitude
+        self.longitude = longitude
+        self.cell_size = cell_size
+
+        valid = np.flatnonzero(np.isfinite(latitude) & np.isfinite(longitude))
+        rows = np.floor(latitude[valid] / cell_size).astype(np.int64)
+        cols = np.floor(longitude[valid] / cell_size).astype(np.int64)
+        self.min_row = int(rows.min()) if len(valid) else 0
+        self.min_col = int(cols.min()) if len(valid) else 0
+        self.rows = int(rows.max()) - self.min_row + 1 if len(valid) else 0
+        self.cols = int(cols.max()) - self.min_col + 1 if len(valid) else 0
+
+        keys = (rows - self.min_row) * self.cols + (cols - self.min_col)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.order = valid[order]
+
+    def _cell(self, value: float, offset: int, count: int) -> int:
+        """將座標轉換為網格編號並限制在資料範圍內"""
+        return int(np.clip(np.floor(value / self.cell_size) - offset, 0, count - 1))
+
+    def query(self, bbox: BBox) -> np.ndarray:
+        """查詢矩形範圍內的資料列
+
+        Args:
+            bbox: (min_lon, min_lat, max_lon, max_lat)
+
+        Returns:
+            np.ndarray: 範圍內的資料列索引（遞增排序）
+        """
+        min_lon, min_lat, max_lon, max_lat = bbox
+        if not self.rows:
+            return np.empty(0, dtype=np.int64)
+
+        first_row = self._cell(min_lat, self.min_row, self.rows)
+        last_row = self._cell(max_lat, self.min_row, self.rows)
+        first_col = self._cell(min_lon, self.min_col, self.cols)
+        last_col = self._cell(max_lon, self.min_col, self.cols)
+
+        row_offsets = np.arange(first_row, last_row + 1, dtype=np.int64) * self.cols
+        starts = np.searchsorted(self.keys, row_offsets + first_col, side='left')
+        ends = np.searchsorted(self.keys, row_offsets + last_col, side='right')
+        if not (ends > starts).any():
+            return np.empty(0, dtype=np.int64)
+        candidates = np.concatenate([self.order[s:e] for s, e in zip(starts, ends) if e > s])
+
+        lat = self.latitude[candidates]
+        lon = self.longitude[candidates]
+        inside = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+        return np.sort(candidates[inside])
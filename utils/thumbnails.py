@@ -0,0 +1,343 @@
+"""
+瑕疵圖片縮圖與預覽圖
+
+以 Pillow 在行程池中將原圖縮小並重新壓縮為 JPEG 或 WebP，
+產生的縮圖與原圖一樣存放在圖片磁碟快取中。寬度會對齊到設定的尺寸清單，
+避免任意參數產生大量衍生檔案。
+
+另為每張已快取的原圖產生一次極小的模糊預覽圖（base64 data URI），
+存放在原圖的中繼資料中，列表回應直接附上，前端不需等待圖片下載即可顯示。
+列表回應只讀取前 placeholder_limit 筆的預覽圖，尚未產生的預覽圖於背景產生，請求不會等待。
+"""
+import base64
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from flask import current_app
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+from utils.image_cache import CachedImage, fetch_image, get_image_cache
+from utils.singleflight import get_single_flight
+
+# 支援的輸出格式與 Content-Type
+THUMBNAIL_FORMATS = {
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp'
+}
+
+# 品質參數的允許範圍
+MIN_QUALITY = 30
+MAX_QUALITY = 95
+
+# 預覽圖的壓縮品質
+PLACEHOLDER_QUALITY = 40
+
+# 每個 worker 記憶的預覽圖數量
+PLACEHOLDER_MEMO_SIZE = 20000
+
+
+def render_thumbnail(source_path: str, width: int, quality: int, fmt: str) -> bytes:
+    """產生縮圖（在子行程中執行）
+
+    Args:
+        source_path: 原圖路徑
+        width: 縮圖寬度上限（高度依比例）
+        quality: 壓縮品質
+        fmt: 輸出格式（jpeg 或 webp）
+
+    Returns:
+        bytes: 縮圖內容
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as image:
+        # JPEG 以縮小比例解碼，減少解碼時間與記憶體
+        image.draft('RGB', (width, width))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.thumbnail((width, width * 4), Image.LANCZOS)
+
+        output = io.BytesIO()
+        if fmt == 'webp':
+            image.save(output, 'WEBP', quality=quality, method=4)
+        else:
+            image.save(output, 'JPEG', quality=quality, optimize=True, progressive=True)
+        return output.getvalue()
+
+
+def render_placeholder(source_path: str, width: int) -> str:
+    """產生極小的預覽圖（在子行程中執行）
+
+    Args:
+        source_path: 原圖路徑
+        width: 預覽圖寬度
+
+    Returns:
+        str: JPEG 格式的 data URI
+    """
+    data = render_thumbnail(source_path, width, PLACEHOLDER_QUALITY, 'jpeg')
+    return 'data:image/jpeg;base64,' + base64.b64encode(data).decode('ascii')
+
+
+class ThumbnailRenderer:
+    """縮圖參數的標準化與行程池"""
+
+    def __init__(self, widths: List[int], quality: int = 75, workers: int = 2, timeout: float = 10,
+                 placeholder_width: int = 16, placeholder_limit: int = 50):
+        """
+        Args:
+            widths: 允許的縮圖寬度（由小到大）
+            quality: 預設壓縮品質
+            workers: 行程池大小
+            timeout: 單張縮圖的產生時間上限（秒）
+            placeholder_width: 預覽圖寬度
+            placeholder_limit: 列表回應最多附上預覽圖的筆數（約為一頁顯示的筆數）
+        """
+        self.widths = sorted(widths)
+        self.quality = quality
+        self.workers = workers
+        self.timeout = timeout
+        self.placeholder_width = placeholder_width
+        self.placeholder_limit = placeholder_limit
+        self._placeholders: OrderedDict = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        """取得目前行程的行程池（fork 後重新建立）"""
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def normalize(self, width: Optional[int], quality: Optional[int],
+                  fmt: Optional[str]) -> Optional[Tuple[int, int, str]]:
+        """標準化縮圖參數
+
+        寬度向上對齊到允許的尺寸，超過最大尺寸時使用最大尺寸。
+
+        Args:
+            width: 要求的寬度
+            quality: 要求的壓縮品質
+            fmt: 要求的輸出格式
+
+        Returns:
+            Optional[Tuple[int, int, str]]: (寬度, 品質, 格式)，參數無效時返回 None
+        """
+        if width is None:
+            width = self.widths[-1]
+        if width <= 0:
+            return None
+        width = next((w for w in self.widths if w >= width), self.widths[-1])
+
+        quality = self.quality if quality is None else max(MIN_QUALITY, min(MAX_QUALITY, quality))
+
+        fmt = (fmt or 'jpeg').lower()
+        if fmt == 'jpg':
+            fmt = 'jpeg'
+        if fmt not in THUMBNAIL_FORMATS:
+            return None
+        return width, quality, fmt
+
+    def render(self, source_path: str, width: int, quality: int, fmt: str) -> bytes:
+        """在行程池中產生縮圖"""
+        return self.executor.submit(render_thumbnail, source_path, width, quality, fmt).result(timeout=self.timeout)
+
+    def submit_placeholder(self, key: str, source_path: str, save: Callable[[str], None]) -> Future:
+        """在行程池中產生預覽圖，完成後以 save 寫入
+
+        同一張圖片已在產生中時返回進行中的 Future，不重複提交。
+        """
+        executor = self.executor
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = self._pending[key] = executor.submit(render_placeholder, source_path, self.placeholder_width)
+
+        def done(f):
+            try:
+                if not f.cancelled() and f.exception() is None:
+                    self.remember(key, f.result())
+                    save(f.result())
+            finally:
+                with self._lock:
+                    self._pending.pop(key, None)
+
+        future.add_done_callback(done)
+        return future
+
+    def remember(self, key: str, placeholder: str):
+        """記住預覽圖（依最近使用淘汰）"""
+        with self._lock:
+            self._placeholders[key] = placeholder
+            self._placeholders.move_to_end(key)
+            while len(self._placeholders) > PLACEHOLDER_MEMO_SIZE:
+                self._placeholders.popitem(last=False)
+
+    def recall(self, key: str) -> Optional[str]:
+        with self._lock:
+            placeholder = self._placeholders.get(key)
+            if placeholder is not None:
+                self._placeholders.move_to_end(key)
+            return placeholder
+
+    def close(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=False)
+        self._executor = None
+
+
+def thumbnail_key(defect_id: int, width: int, quality: int, fmt: str) -> str:
+    """縮圖在圖片快取中的鍵"""
+    return f'{defect_id}-w{width}-q{quality}.{fmt}'
+
+
+def fetch_thumbnail(defect_id: int, width: int, quality: int, fmt: str) -> Optional[CachedImage]:
+    """取得瑕疵圖片的縮圖，未快取時產生並寫入快取
+
+    Args:
+        defect_id: 瑕疵 ID
+        width: 縮圖寬度
+        quality: 壓縮品質
+        fmt: 輸出格式
+
+    Returns:
+        Optional[CachedImage]: 縮圖，上游沒有圖片時返回 None；原圖無法解碼時返回原圖
+
+    Raises:
+        ImageUnavailable: 下載原圖時上游返回其他錯誤或無法連線
+    """
+    image_cache = get_image_cache()
+    renderer = get_thumbnail_renderer()
+    key = thumbnail_key(defect_id, width, quality, fmt)
+    image = image_cache.get(key)
+    if image is not None:
+        return image
+
+    def generate():
+        source = fetch_image(defect_id)
+        if source is None:
+            return None
+        try:
+            data = renderer.render(source.path, width, quality, fmt)
+        except Exception as e:
+            current_app.logger.error(f"產生瑕疵 {defect_id} 的縮圖失敗: {str(e)}")
+            return source
+        return image_cache.store(key, [data], THUMBNAIL_FORMATS[fmt], source.last_modified)
+
+    flight = get_single_flight()
+    if flight is None:
+        return generate()
+    return flight.do(f'image:{key}', generate, recheck=lambda: image_cache.get(key))
+
+
+def get_placeholders(defect_ids: Iterable[int], timeout: float = 0) -> Dict[int, str]:
+    """取得瑕疵圖片的預覽圖
+
+    只處理原圖已在磁碟快取中的瑕疵，不會為了預覽圖向上游下載圖片。
+    尚未產生的預覽圖交給行程池於背景產生，完成後寫入中繼資料，之後的請求即可取得。
+
+    Args:
+        defect_ids: 瑕疵 ID
+        timeout: 等待尚未產生的預覽圖的時間上限（秒），0 表示不等待
+
+    Returns:
+        Dict[int, str]: 瑕疵 ID 對應的預覽圖 data URI
+    """
+    image_cache = get_image_cache()
+    renderer = get_thumbnail_renderer()
+    if image_cache is None or renderer is None:
+        return {}
+
+    placeholders = {}
+    pending = {}
+    for defect_id in defect_ids:
+        key = str(defect_id)
+        placeholder = renderer.recall(key)
+        if placeholder is None:
+            meta = image_cache.read_meta(key)
+            if meta is None:
+                continue
+            placeholder = meta.get('placeholder')
+            if placeholder is None:
+                pending[defect_id] = renderer.submit_placeholder(
+                    key,
+                    image_cache.blob_path(meta['digest']),
+                    lambda placeholder, key=key: image_cache.update_meta(key, placeholder=placeholder)
+                )
+                continue
+            renderer.remember(key, placeholder)
+        placeholders[defect_id] = placeholder
+
+    if not pending or timeout <= 0:
+        return placeholders
+
+    done, _ = wait(pending.values(), timeout=timeout)
+    for defect_id, future in pending.items():
+        if future in done and future.exception() is None:
+            placeholders[defect_id] = future.result()
+    return placeholders
+
+
+def attach_placeholders(defects: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """在前 placeholder_limit 筆瑕疵資料中加入 image_placeholder 欄位
+
+    返回新的列表，不修改可能被快取或合併請求共用的原始資料。
+
+    Args:
+        defects: 瑕疵列表
+
+    Returns:
+        List[Dict]: 加入預覽圖的瑕疵列表
+    """
+    renderer = get_thumbnail_renderer()
+    if renderer is None:
+        return defects
+    placeholders = get_placeholders(
+        d['id'] for d in defects[:renderer.placeholder_limit] if d.get('has_image') and d.get('id') is not None
+    )
+    if not placeholders:
+        return defects
+    return [
+        dict(defect, image_placeholder=placeholders[defect['id']]) if defect.get('id') in placeholders else defect
+        for defect in defects
+    ]
+
+
+def init_thumbnails(app) -> Optional[ThumbnailRenderer]:
+    """根據設定建立縮圖產生器（需同時啟用圖片磁碟快取）
+
+    Args:
+        app: Flask 應用程式實例
+
+    Returns:
+        Optional[ThumbnailRenderer]: 縮圖產生器，未啟用時返回 None
+    """
+    thumbnail_config = app.config.get('CURRENT_CONFIG', {}).get('thumbnails', {})
+    if not thumbnail_config.get('enabled', False) or app.extensions.get('image_cache') is None:
+        app.extensions['thumbnail_renderer'] = None
+        return None
+
+    renderer = ThumbnailRenderer(
+        widths=thumbnail_config.get('widths', [100, 200, 400, 800]),
+        quality=thumbnail_config.get('quality', 75),
+        workers=thumbnail_config.get('workers', 2),
+        timeout=thumbnail_config.get('timeout', 10),
+        placeholder_width=thumbnail_config.get('placeholder_width', 16),
+        placeholder_limit=thumbnail_config.get('placeholder_limit', 50)
+    )
+    app.extensions['thumbnail_renderer'] = renderer
+    return renderer
+
+
+def get_thumbnail_renderer() -> Optional[ThumbnailRenderer]:
+    """取得目前應用程式的縮圖產生器"""
+    return current_app.extensions.get('thumbnail_renderer')
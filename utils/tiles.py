@@ -0,0 +1,189 @@
+"""
+瑕疵圖層的 GeoJSON 圖磚
+
+依 XYZ 圖磚編號產生 GeoJSON FeatureCollection，查詢條件與 /home 相同。
+縮放等級低於 cluster_max_zoom 時圖磚內容為伺服器端聚合的群集，否則為個別瑕疵。
+
+產生的圖磚存放在圖磚快取中，鍵包含資料版本、查詢條件雜湊與圖磚編號；
+資料版本為欄式快照的版本，未啟用欄式儲存時為依查詢條件快取的暫時快照的內容版本。
+資料更新後版本改變，舊圖磚不再命中並由 LRU 淘汰。
+常用縮放等級的圖磚（不含查詢條件）由背景工作預先產生。
+"""
+import hashlib
+import json
+import os
+import numpy as np
+from flask import current_app
+from typing import Dict, Any, List, Optional
+from utils.background import register_periodic_task
+from utils.cache import MemoryCacheBackend, SQLiteCacheBackend, make_cache_key
+from utils.defect_store import DefectStore, get_defect_store
+from utils.map_data import (DEFAULT_CLUSTER_MAX_ZOOM, cluster_tile, get_map_config, get_map_dataset,
+                            map_data_version, tile_bbox, tile_of)
+from utils.query import DefectFilter
+
+# 允許的最大縮放等級
+MAX_TILE_ZOOM = 22
+
+
+def get_tile_config() -> Dict[str, Any]:
+    """取得 tiles 設定"""
+    return current_app.config.get('CURRENT_CONFIG', {}).get('tiles', {})
+
+
+def filter_hash(defect_filter) -> str:
+    """查詢條件的雜湊，作為圖磚快取鍵的一部分"""
+    return hashlib.sha1(make_cache_key('tiles', defect_filter.to_params()).encode('utf-8')).hexdigest()[:16]
+
+
+def tile_version(defect_filter) -> Optional[str]:
+    """圖磚資料的版本，無法取得資料時返回 None
+
+    Args:
+        defect_filter: 查詢條件（DefectFilter）
+    """
+    return map_data_version(defect_filter)
+
+
+def tile_etag(version: str, digest: str, z: int, x: int, y: int) -> str:
+    """圖磚的 ETag，不需產生圖磚內容即可比對"""
+    return f'{version}-{digest}-{z}-{x}-{y}'
+
+
+def _features(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """將聚合結果轉換為 GeoJSON Feature"""
+    features = []
+    for item in items:
+        if item['type'] == 'cluster':
+            properties = {key: item[key] for key in ('id', 'count', 'by_severity', 'bounds')}
+            properties['cluster'] = True
+            longitude, latitude = item['longitude'], item['latitude']
+        else:
+            properties = dict(item['defect'], cluster=False)
+            longitude, latitude = properties.pop('longitude'), properties.pop('latitude')
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [longitude, latitude]},
+            'properties': properties
+        })
+    return features
+
+
+def _encode(items: List[Dict[str, Any]]) -> bytes:
+    return json.dumps({'type': 'FeatureCollection', 'features': _features(items)},
+                      ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _render(store: DefectStore, indices: np.ndarray, z: int, x: int, y: int) -> bytes:
+    """以範圍內的資料列產生單一圖磚"""
+    tile_x, tile_y = tile_of(store, indices, z)
+    max_zoom = get_map_config().get('cluster_max_zoom', DEFAULT_CLUSTER_MAX_ZOOM)
+    return _encode(cluster_tile(store, indices[(tile_x == x) & (tile_y == y)], z, z < max_zoom))
+
+
+def get_tile(defect_filter, z: int, x: int, y: int) -> Optional[bytes]:
+    """取得圖磚內容，未快取時產生並寫入快取
+
+    Args:
+        defect_filter: 查詢條件（DefectFilter）
+        z: 縮放等級
+        x: 圖磚 x
+        y: 圖磚 y
+
+    Returns:
+        Optional[bytes]: GeoJSON 內容，無法取得資料時返回 None
+    """
+    version = tile_version(defect_filter)
+    if version is None:
+        return None
+    cache = get_tile_cache()
+    key = f'{version}|{filter_hash(defect_filter)}|{z}/{x}/{y}'
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+    dataset = get_map_dataset(defect_filter, tile_bbox(z, x, y))
+    if dataset is None:
+        return None
+    body = _render(*dataset, z, x, y)
+    if cache is not None:
+        cache.set(key, body, get_tile_config().get('ttl', 86400))
+    return body
+
+
+def prerender_tiles() -> Dict[str, Any]:
+    """預先產生常用縮放等級中有資料的圖磚（不含查詢條件）
+
+    Returns:
+        Dict: 資料版本與產生的圖磚數
+    """
+    cache = get_tile_cache()
+    store = get_defect_store()
+    if cache is None or store is None:
+        return {'version': None, 'tiles': 0}
+
+    tile_config = get_tile_config()
+    digest = filter_hash(DefectFilter())
+    ttl = tile_config.get('ttl', 86400)
+    indices = np.flatnonzero(np.isfinite(store.latitude) & np.isfinite(store.longitude))
+    rendered = 0
+    for z in tile_config.get('prerender_zooms', []):
+        tile_x, tile_y = tile_of(store, indices, z)
+        for x, y in np.unique(np.stack([tile_x, tile_y], axis=1), axis=0).tolist():
+            key = f'{store.version}|{digest}|{z}/{x}/{y}'
+            if cache.get(key) is not None:
+                continue
+            in_tile = indices[(tile_x == x) & (tile_y == y)]
+            cache.set(key, _render(store, in_tile, z, x, y), ttl)
+            rendered += 1
+
+    if rendered:
+        current_app.logger.info(f"預先產生圖磚完成，共 {rendered} 個（版本 {store.version}）")
+    return {'version': store.version, 'tiles': rendered}
+
+
+def valid_tile(z: int, x: int, y: int) -> bool:
+    """圖磚編號是否有效"""
+    return 0 <= z <= MAX_TILE_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z
+
+
+def init_tiles(app):
+    """根據設定建立圖磚快取，並在啟用欄式儲存時註冊預先產生工作
+
+    Args:
+        app: Flask 應用程式實例
+    """
+    tile_config = app.config.get('CURRENT_CONFIG', {}).get('tiles', {})
+    if not tile_config.get('enabled', False):
+        app.extensions['tile_cache'] = None
+        return None
+
+    max_bytes = tile_config.get('max_bytes', 64 * 1024 * 1024)
+    backend_name = tile_config.get('backend', 'memory')
+    if backend_name == 'sqlite':
+        path = tile_config.get('path', 'tile_cache.db')
+        if not os.path.isabs(path):
+            path = os.path.join(app.instance_path, path)
+        cache = SQLiteCacheBackend(path, max_bytes=max_bytes)
+    elif backend_name == 'memory':
+        cache = MemoryCacheBackend(max_bytes=max_bytes)
+    else:
+        raise ValueError(f'不支援的快取後端: {backend_name}')
+    app.extensions['tile_cache'] = cache
+
+    if tile_config.get('prerender_zooms') and app.extensions.get('defect_store') is not None:
+        register_periodic_task(
+            app,
+            'tile-prerender',
+            tile_config.get('prerender_interval', 120),
+            prerender_tiles,
+            # 共用的 SQLite 快取只需一個 worker 預先產生；記憶體快取由各 worker 自行產生
+            leader=backend_name == 'sqlite'
+        )
+    return cache
+
+
+def get_tile_cache():
+    """取得目前應用程式的圖磚快取"""
+    return current_app.extensions.get('tile_cache')
@@ -0,0 +1,47 @@
+"""
+時間格式工具
+"""
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+
+def parse_time(value: Any) -> Optional[datetime]:
+    """將 ISO 8601 字串轉換為不含時區的 UTC 時間
+
+    未帶時區的時間視為 UTC。
+
+    Args:
+        value: ISO 8601 字串或 datetime
+
+    Returns:
+        Optional[datetime]: UTC 時間，無法解析時返回 None
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        text = str(value).strip()
+        if text.endswith('Z'):
+            text = text[:-1] + '+00:00'
+        try:
+            parsed = datetime.fromisoformat(text)
+        except ValueError:
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def format_time(value: Optional[datetime]) -> Optional[str]:
+    """將不含時區的 UTC 時間轉換為 ISO 8601 字串
+
+    Args:
+        value: UTC 時間
+
+    Returns:
+        Optional[str]: ISO 8601 字串（+00:00）
+    """
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc).isoformat()